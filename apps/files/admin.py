@@ -0,0 +1,19 @@
+from django.contrib import admin
+from .models import ChunkedUpload, StoredBlob
+
+
+# Register your models here.
+class ChunkedUploadAdmin(admin.ModelAdmin):
+    list_display = ["id", "filename", "target", "status", "created_at"]
+    list_filter = ["target", "status"]
+
+
+admin.site.register(ChunkedUpload, ChunkedUploadAdmin)
+
+
+class StoredBlobAdmin(admin.ModelAdmin):
+    list_display = ["name", "size", "refcount", "created_at"]
+    search_fields = ["name"]
+
+
+admin.site.register(StoredBlob, StoredBlobAdmin)
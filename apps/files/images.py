@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+from functools import partial
+from io import BytesIO
+import posixpath
+
+MEDIA_HOST = "https://www.tradepayafrica.com"
+
+# format, file extension, save options
+VARIANT_FORMATS = (
+    ("JPEG", "jpeg", {"quality": 80, "optimize": True, "progressive": True}),
+    ("WEBP", "webp", {"quality": 75, "method": 4}),
+)
+
+
+def flatten(image):
+    """JPEG has no alpha channel, so transparent images are put on white"""
+    if image.mode in ("RGBA", "LA") or (
+        image.mode == "P" and "transparency" in image.info
+    ):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def render_variants(field_file, widths=None):
+    """
+    Renders fixed width thumbnails and WebP versions of an uploaded image, returns
+    the map stored on the model: {"source": name, "jpeg": {width: name}, ...}
+    Files that are not images (e.g. PDFs) get a map without renditions
+    """
+    widths = sorted(widths or settings.IMAGE_VARIANT_WIDTHS, reverse=True)
+    variants = {"source": field_file.name}
+    try:
+        with field_file.open("rb") as fh:
+            image = Image.open(fh)
+            image.load()
+    except (UnidentifiedImageError, OSError):
+        return variants
+
+    image = ImageOps.exif_transpose(image)
+    targets = [width for width in widths if width < image.width] or [image.width]
+    stem = posixpath.splitext(field_file.name)[0]
+    variants["width"] = image.width
+    for _format, extension, _options in VARIANT_FORMATS:
+        variants[extension] = {}
+
+    # Each rendition is resized from the previous, larger one which is much
+    # cheaper than going back to the full resolution original every time
+    resized = image
+    for width in targets:
+        height = max(1, round(image.height * width / image.width))
+        resized = resized.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        for image_format, extension, options in VARIANT_FORMATS:
+            frame = flatten(resized) if image_format == "JPEG" else resized
+            buffer = BytesIO()
+            frame.save(buffer, image_format, **options)
+            variants[extension][str(width)] = default_storage.save(
+                f"derivatives/{stem}/{width}.{extension}",
+                ContentFile(buffer.getvalue()),
+            )
+    return variants
+
+
+def variant_names(variants):
+    """Names of the renditions in a variants map, "source" is not one of them"""
+    for value in (variants or {}).values():
+        if isinstance(value, dict):
+            yield from value.values()
+
+
+def release_variants(variants):
+    """Releases the rendition files of variants once the transaction commits"""
+    for name in variant_names(variants):
+        transaction.on_commit(partial(default_storage.delete, name))
+
+
+def variant_urls(variants):
+    """
+    srcset style map of the renditions of an image, {"webp": {"320w": url}}
+    empty until the renditions have been generated
+    """
+    return {
+        extension: {
+            f"{width}w": MEDIA_HOST + default_storage.url(name)
+            for width, name in sorted(
+                variants[extension].items(), key=lambda item: int(item[0])
+            )
+        }
+        for _format, extension, _options in VARIANT_FORMATS
+        if variants and extension in variants
+    }
+
+
+def thumbnail_url(field_file, variants):
+    """Smallest JPEG rendition of an image, the original until they exist"""
+    renditions = (variants or {}).get("jpeg")
+    if renditions:
+        name = renditions[min(renditions, key=int)]
+        return MEDIA_HOST + default_storage.url(name)
+    return MEDIA_HOST + field_file.url if field_file else ""
@@ -0,0 +1,147 @@
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from concurrent.futures import ProcessPoolExecutor
+import os
+import posixpath
+import shutil
+
+from apps.files.images import variant_names
+from apps.files.models import StoredBlob
+from apps.files.signals import IMAGE_FIELDS
+from apps.files.storage import CAS_PREFIX, content_name, hash_file
+
+
+def hash_media_file(path):
+    try:
+        return path, hash_file(path), os.path.getsize(path)
+    except OSError:
+        return path, None, 0
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def remap_variants(variants, mapping):
+    remapped = {}
+    for key, value in variants.items():
+        if isinstance(value, dict):
+            value = {width: mapping.get(name, name) for width, name in value.items()}
+        elif key == "source":
+            value = mapping.get(value, value)
+        remapped[key] = value
+    return remapped
+
+
+class Command(BaseCommand):
+    help = "Moves media stored under upload paths into content addressed storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument("--dry-run", action="store_true")
+        parser.add_argument(
+            "--keep-originals",
+            action="store_true",
+            help="Leave the old files in place after the rows have been updated",
+        )
+
+    def file_fields(self):
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if isinstance(field, models.FileField):
+                    yield model, field.name
+
+    def handle(self, *args, **options):
+        legacy = set()
+        for model, field_name in self.file_fields():
+            legacy.update(
+                model.objects.exclude(**{f"{field_name}__startswith": CAS_PREFIX + "/"})
+                .exclude(**{field_name: ""})
+                .exclude(**{f"{field_name}__isnull": True})
+                .values_list(field_name, flat=True)
+                .distinct()
+            )
+        for model, (_image_field, variants_field) in IMAGE_FIELDS.items():
+            for variants in model.objects.exclude(**{variants_field: {}}).values_list(
+                variants_field, flat=True
+            ):
+                legacy.update(
+                    name
+                    for name in variant_names(variants)
+                    if not name.startswith(CAS_PREFIX + "/")
+                )
+        self.stdout.write(f"{len(legacy)} files to rehash")
+
+        # Hashing is the expensive part and needs no database, so it is spread
+        # over worker processes
+        mapping = {}
+        sizes = {}
+        paths = {default_storage.path(name): name for name in legacy}
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            for path, digest, size in executor.map(
+                hash_media_file, paths, chunksize=64
+            ):
+                name = paths[path]
+                if digest is None:
+                    self.stderr.write(f"Missing file {name}, skipped")
+                    continue
+                mapping[name] = content_name(
+                    digest, posixpath.splitext(name)[1].lower()
+                )
+                sizes[mapping[name]] = size
+
+        unique = len(set(mapping.values()))
+        self.stdout.write(f"{len(mapping)} files hashed, {unique} distinct contents")
+        if options["dry_run"]:
+            return
+
+        for name, cas_name in mapping.items():
+            target = default_storage.path(cas_name)
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(default_storage.path(name), target)
+            except OSError:
+                shutil.copy2(default_storage.path(name), target)
+
+        references = {}
+        with transaction.atomic():
+            for model, field_name in self.file_fields():
+                changed = []
+                for names in chunked(list(mapping), 1000):
+                    for pk, name in model.objects.filter(
+                        **{f"{field_name}__in": names}
+                    ).values_list("pk", field_name):
+                        instance = model(pk=pk)
+                        setattr(instance, field_name, mapping[name])
+                        changed.append(instance)
+                        references[mapping[name]] = references.get(mapping[name], 0) + 1
+                model.objects.bulk_update(changed, [field_name], batch_size=500)
+            for model, (_image_field, variants_field) in IMAGE_FIELDS.items():
+                changed = []
+                for pk, variants in model.objects.exclude(
+                    **{variants_field: {}}
+                ).values_list("pk", variants_field):
+                    remapped = remap_variants(variants, mapping)
+                    if remapped == variants:
+                        continue
+                    for name in variant_names(variants):
+                        if name in mapping:
+                            references[mapping[name]] = (
+                                references.get(mapping[name], 0) + 1
+                            )
+                    instance = model(pk=pk)
+                    setattr(instance, variants_field, remapped)
+                    changed.append(instance)
+                model.objects.bulk_update(changed, [variants_field], batch_size=500)
+            for cas_name, count in references.items():
+                StoredBlob.retain(cas_name, sizes.get(cas_name, 0), count)
+
+        if not options["keep_originals"]:
+            for name in mapping:
+                default_storage.delete(name)
+        self.stdout.write(self.style.SUCCESS("Media rehashed"))
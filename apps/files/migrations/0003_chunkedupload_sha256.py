@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("files", "0002_storedblob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chunkedupload",
+            name="sha256",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,305 @@
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.utils.translation import gettext_lazy as _
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.utils.timezone import now
+from pathlib import Path
+import hashlib
+import math
+import os
+import shutil
+import uuid
+import magic
+
+from apps.inventory.models import Product, ProductDocument
+from apps.profiles.models import Company, ContactPerson, ProfileDocument
+from utils.utils import Base64File
+
+# Create your models here.
+User = get_user_model()
+
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+class StoredBlob(models.Model):
+    """
+    Reference count of a file kept by ContentAddressedStorage, the file is only
+    removed from disk once nothing refers to it anymore
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+    @classmethod
+    def retain(cls, name, size, count=1, place_file=None):
+        """
+        Adds count references to name. place_file, when given, is called with
+        the row locked to put the file on disk if it is not there, so a
+        concurrent release cannot remove it in between
+        """
+        with transaction.atomic():
+            if not cls.objects.select_for_update().filter(name=name).exists():
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(name=name, size=size)
+                except IntegrityError:
+                    # Created by a concurrent upload of the same content
+                    cls.objects.select_for_update().filter(name=name).exists()
+            if place_file:
+                place_file()
+            cls.objects.filter(name=name).update(refcount=F("refcount") + count)
+
+    @classmethod
+    def release(cls, name, remove_file):
+        """
+        Drops a reference, remove_file is called with the row locked once
+        nothing refers to the file anymore
+        """
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                return
+            if blob.refcount > 1:
+                cls.objects.filter(pk=blob.pk).update(refcount=F("refcount") - 1)
+                return
+            remove_file()
+            blob.delete()
+
+
+class ChunkedFile(File):
+    """
+    Reads a completed upload straight from its chunk files so storage backends
+    can stream it into place without the file ever being joined in memory
+    """
+
+    def __init__(self, paths, name, size):
+        super().__init__(None, name=name)
+        self.paths = paths
+        self._size = size
+
+    @property
+    def size(self):
+        return self._size
+
+    def multiple_chunks(self, chunk_size=None):
+        return len(self.paths) > 1 or self._size > (
+            chunk_size or self.DEFAULT_CHUNK_SIZE
+        )
+
+    def chunks(self, chunk_size=None):
+        chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        for path in self.paths:
+            with open(path, "rb") as part:
+                while True:
+                    data = part.read(chunk_size)
+                    if not data:
+                        break
+                    yield data
+
+    def open(self, mode=None):
+        return self
+
+    def close(self):
+        pass
+
+
+class ChunkedUpload(models.Model):
+    """
+    Resumable upload session, chunks are kept on local disk under
+    CHUNKED_UPLOAD_ROOT/<id>/ until the client completes the upload
+    """
+
+    TARGETS = (
+        ("product_brochure", _("Product Brochure")),
+        ("product_document", _("Product Document")),
+        ("company_business_certificate", _("Company Business Certificate")),
+        ("profile_document", _("Profile Document")),
+    )
+    STATUS = (
+        ("UPLOADING", "UPLOADING"),
+        ("COMPLETE", "COMPLETE"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="chunked_uploads"
+    )
+    filename = models.CharField(max_length=255, verbose_name=_("File Name"))
+    target = models.CharField(max_length=50, choices=TARGETS)
+    # Product id for brochures and product documents, Company id for certificates
+    # and profile documents, optional for documents
+    target_id = models.PositiveBigIntegerField(blank=True, null=True)
+    total_size = models.PositiveBigIntegerField()
+    # Hex sha256 of the whole file, checked on completion when the client sends it
+    sha256 = models.CharField(max_length=64, blank=True)
+    chunk_size = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS, default=STATUS[0][0])
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.status})"
+
+    @property
+    def total_chunks(self):
+        return max(1, math.ceil(self.total_size / self.chunk_size))
+
+    @property
+    def chunk_dir(self):
+        return Path(settings.CHUNKED_UPLOAD_ROOT) / str(self.id)
+
+    def chunk_path(self, index):
+        return self.chunk_dir / f"{index}.part"
+
+    def expected_chunk_size(self, index):
+        if index < self.total_chunks - 1:
+            return self.chunk_size
+        return self.total_size - self.chunk_size * (self.total_chunks - 1)
+
+    def received_chunks(self):
+        if not self.chunk_dir.exists():
+            return []
+        return sorted(
+            int(entry.name[: -len(".part")])
+            for entry in os.scandir(self.chunk_dir)
+            if entry.name.endswith(".part")
+        )
+
+    def missing_chunks(self):
+        received = set(self.received_chunks())
+        return [index for index in range(self.total_chunks) if index not in received]
+
+    def write_chunk(self, index, stream):
+        """
+        Streams a chunk to disk, the chunk only becomes visible once it has been
+        fully written so a dropped connection never leaves a partial chunk behind
+        """
+        if self.status != "UPLOADING":
+            raise ValidationError("Upload has already been completed")
+        if index < 0 or index >= self.total_chunks:
+            raise ValidationError(
+                f"Chunk index must be between 0 and {self.total_chunks - 1}"
+            )
+
+        expected = self.expected_chunk_size(index)
+        self.chunk_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.chunk_dir / f"{index}.{uuid.uuid4().hex}.tmp"
+        written = 0
+        with open(tmp_path, "wb") as part:
+            while stream is not None and written <= expected:
+                data = stream.read(COPY_BUFFER_SIZE)
+                if not data:
+                    break
+                written += len(data)
+                part.write(data)
+        if written != expected:
+            tmp_path.unlink(missing_ok=True)
+            raise ValidationError(f"Chunk {index} must be exactly {expected} bytes")
+        os.replace(tmp_path, self.chunk_path(index))
+
+    def content_hash(self):
+        sha256 = hashlib.sha256()
+        for index in range(self.total_chunks):
+            with open(self.chunk_path(index), "rb") as part:
+                while True:
+                    data = part.read(COPY_BUFFER_SIZE)
+                    if not data:
+                        break
+                    sha256.update(data)
+        return sha256.hexdigest()
+
+    def discard(self):
+        shutil.rmtree(self.chunk_dir, ignore_errors=True)
+
+    def file_extension(self):
+        with open(self.chunk_path(0), "rb") as first_chunk:
+            mime_type = magic.from_buffer(first_chunk.read(2048), mime=True)
+        extension = mime_type.split("/")[-1]
+        if extension not in Base64File.ALLOWED_TYPES:
+            raise ValidationError(f"Files of type {mime_type} are not allowed")
+        return extension
+
+    def can_edit_company(self, company):
+        if self.user.is_superuser:
+            return True
+        return ContactPerson.objects.filter(user=self.user, companies=company).exists()
+
+    def resolve_target(self):
+        """
+        Returns the instance the upload will be attached to, or None when the
+        upload creates a new document
+        """
+        if self.target in ("product_brochure", "product_document"):
+            if self.target_id is None:
+                if self.target == "product_brochure":
+                    raise ValidationError("target_id is required for brochures")
+                return None
+            try:
+                instance = Product.objects.select_related("seller").get(
+                    id=self.target_id
+                )
+            except Product.DoesNotExist:
+                raise ValidationError("Product does not exist")
+            company = instance.seller
+        else:
+            if self.target_id is None:
+                if self.target == "company_business_certificate":
+                    raise ValidationError("target_id is required for certificates")
+                return None
+            try:
+                instance = Company.objects.get(id=self.target_id)
+            except Company.DoesNotExist:
+                raise ValidationError("Company does not exist")
+            company = instance
+        if not self.can_edit_company(company):
+            raise ValidationError("Not Authorized to upload files for this company")
+        return instance
+
+    def complete(self):
+        """
+        Attaches the assembled file to its target and removes the chunks,
+        returns the model instance the file was saved on
+        """
+        missing = self.missing_chunks()
+        if missing:
+            raise ValidationError(f"Missing chunks: {missing}")
+        if self.sha256 and self.sha256.lower() != self.content_hash():
+            # There is no telling which chunk is wrong, the client starts over
+            self.discard()
+            raise ValidationError("File does not match its sha256, upload it again")
+        target = self.resolve_target()
+        name = f"{Path(self.filename).stem}.{self.file_extension()}"
+        content = ChunkedFile(
+            [self.chunk_path(index) for index in range(self.total_chunks)],
+            name,
+            self.total_size,
+        )
+
+        if self.target == "product_brochure":
+            target.brochure.save(name, content)
+            instance = target
+        elif self.target == "company_business_certificate":
+            target.business_certificate.save(name, content)
+            instance = target
+        elif self.target == "product_document":
+            instance = ProductDocument(name=name)
+            instance.file.save(name, content)
+            if target:
+                target.documents.add(instance)
+        else:
+            instance = ProfileDocument(name=name, uploaded_by=self.user, company=target)
+            instance.file.save(name, content)
+
+        self.status = "COMPLETE"
+        self.completed_at = now()
+        self.save(update_fields=["status", "completed_at"])
+        self.discard()
+        return instance
@@ -0,0 +1,32 @@
+from rest_framework import serializers
+from django.conf import settings
+from .models import ChunkedUpload
+import re
+
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    total_chunks = serializers.SerializerMethodField()
+    received_chunks = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChunkedUpload
+        fields = "__all__"
+        read_only_fields = ["user", "chunk_size", "status", "completed_at"]
+
+    def get_total_chunks(self, obj):
+        return obj.total_chunks
+
+    def get_received_chunks(self, obj):
+        return obj.received_chunks()
+
+    def validate_total_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("File must not be empty.")
+        if value > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError("File is too large.")
+        return value
+
+    def validate_sha256(self, value):
+        if value and not re.fullmatch(r"[0-9a-fA-F]{64}", value):
+            raise serializers.ValidationError("Must be a hex encoded sha256.")
+        return value
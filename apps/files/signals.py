@@ -0,0 +1,96 @@
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from apps.inventory.models import Category, ProductImage
+from apps.profiles.models import Company
+from .images import release_variants
+from .tasks import generate_image_variants
+
+# model: (image field, field holding its renditions)
+IMAGE_FIELDS = {
+    ProductImage: ("image", "variants"),
+    Company: ("profile_logo", "profile_logo_variants"),
+    Category: ("category_image", "category_image_variants"),
+}
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Company)
+@receiver(post_save, sender=Category)
+def queue_image_variants(sender, instance, **kwargs):
+    field_name, variants_field = IMAGE_FIELDS[sender]
+    field_file = getattr(instance, field_name)
+    variants = getattr(instance, variants_field) or {}
+    if not field_file:
+        if variants:
+            sender.objects.filter(pk=instance.pk).update(**{variants_field: {}})
+            release_variants(variants)
+        return
+    if variants.get("source") == field_file.name:
+        return
+    transaction.on_commit(
+        lambda: generate_image_variants.delay(
+            sender._meta.label, instance.pk, field_name, variants_field
+        )
+    )
+
+
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_delete, sender=Company)
+@receiver(post_delete, sender=Category)
+def release_deleted_variants(sender, instance, **kwargs):
+    release_variants(getattr(instance, IMAGE_FIELDS[sender][1]))
+
+
+def file_fields(model):
+    return [
+        field
+        for field in model._meta.concrete_fields
+        if isinstance(field, models.FileField)
+    ]
+
+
+def file_names(instance):
+    names = {}
+    for field in file_fields(type(instance)):
+        # Read from __dict__ so a deferred field is not loaded for this
+        if field.attname in instance.__dict__:
+            value = instance.__dict__[field.attname]
+            names[field.attname] = getattr(value, "name", value)
+    return names
+
+
+def release_on_commit(name):
+    if name:
+        transaction.on_commit(lambda: default_storage.delete(name))
+
+
+def remember_file_names(sender, instance, **kwargs):
+    instance._stored_file_names = file_names(instance)
+
+
+def release_replaced_files(sender, instance, **kwargs):
+    """Releases the files a save replaced, once the save is committed"""
+    stored = getattr(instance, "_stored_file_names", {})
+    current = file_names(instance)
+    for attname, name in current.items():
+        if attname in stored and stored[attname] != name:
+            release_on_commit(stored[attname])
+    instance._stored_file_names = current
+
+
+def release_deleted_files(sender, instance, **kwargs):
+    for name in file_names(instance).values():
+        release_on_commit(name)
+
+
+# Every row holding a file owns a reference to it in content addressed storage,
+# the receivers are only connected to models with files so deletes of the others
+# can still skip the signals
+for model in apps.get_models():
+    if file_fields(model):
+        post_init.connect(remember_file_names, sender=model, dispatch_uid="files")
+        post_save.connect(release_replaced_files, sender=model, dispatch_uid="files")
+        post_delete.connect(release_deleted_files, sender=model, dispatch_uid="files")
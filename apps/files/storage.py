@@ -0,0 +1,68 @@
+from django.core.files.storage import FileSystemStorage
+import hashlib
+import os
+import posixpath
+import uuid
+
+CAS_PREFIX = "cas"
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+def content_name(digest, extension):
+    """cas/ab/cd/abcd...<extension>, two levels of prefixes keep directories small"""
+    return posixpath.join(CAS_PREFIX, digest[:2], digest[2:4], digest + extension)
+
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while True:
+            data = fh.read(HASH_BUFFER_SIZE)
+            if not data:
+                break
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores files under the sha256 of their content, so uploading a file that is
+    already stored only adds a reference to it, see StoredBlob
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is derived from the content in _save
+        return name
+
+    def _save(self, name, content):
+        from .models import StoredBlob
+
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        extension = posixpath.splitext(name)[1].lower()
+        cas_name = content_name(sha256.hexdigest(), extension)
+
+        def place_file():
+            if self.exists(cas_name):
+                return
+            # Written under a unique name and then moved into place, so the file
+            # never shows up half written
+            tmp_name = super(ContentAddressedStorage, self)._save(
+                posixpath.join(CAS_PREFIX, "tmp", uuid.uuid4().hex), content
+            )
+            os.makedirs(os.path.dirname(self.path(cas_name)), exist_ok=True)
+            os.replace(self.path(tmp_name), self.path(cas_name))
+
+        StoredBlob.retain(cas_name, content.size, place_file=place_file)
+        return cas_name
+
+    def delete(self, name):
+        from .models import StoredBlob
+
+        if not name.startswith(CAS_PREFIX + "/"):
+            super().delete(name)
+            return
+        StoredBlob.release(
+            name, lambda: super(ContentAddressedStorage, self).delete(name)
+        )
@@ -0,0 +1,56 @@
+from celery import shared_task
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+from utils.cache import bump_on_commit
+from .images import release_variants, render_variants
+from .models import ChunkedUpload
+
+# Cached responses showing the renditions of a model's images
+CACHE_TAGS = {
+    "inventory.ProductImage": "products",
+    "profiles.Company": "companies",
+    "inventory.Category": "categories",
+}
+
+
+@shared_task(ignore_result=True)
+def purge_stale_uploads():
+    """Removes chunks of uploads that were abandoned before completion"""
+    stale = ChunkedUpload.objects.filter(
+        status="UPLOADING",
+        created_at__lt=now() - settings.CHUNKED_UPLOAD_EXPIRY,
+    )
+    for upload in stale.iterator():
+        upload.discard()
+    stale.delete()
+
+
+@shared_task(ignore_result=True)
+def generate_image_variants(model_label, pk, field_name, variants_field):
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).first()
+    if not instance:
+        return
+    field_file = getattr(instance, field_name)
+    if not field_file:
+        return
+    variants = render_variants(field_file)
+    # update() instead of save() so no signal fires, and the renditions are only
+    # stored if the image was not replaced while they were being rendered. The
+    # renditions not kept, the old ones or these, are released. Without a signal
+    # the cached responses showing them are refreshed here
+    with transaction.atomic():
+        previous = (
+            model.objects.select_for_update()
+            .filter(pk=pk, **{field_name: field_file.name})
+            .values_list(variants_field, flat=True)
+            .first()
+        )
+        if previous is None:
+            release_variants(variants)
+            return
+        model.objects.filter(pk=pk).update(**{variants_field: variants})
+        bump_on_commit(CACHE_TAGS[model_label])
+        release_variants(previous)
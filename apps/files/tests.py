@@ -0,0 +1,395 @@
+from django.test import TestCase
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import override_settings
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.test import APIClient
+from django.core.cache import cache
+from django.utils.timezone import now
+from apps.inventory.models import CurrencyRates, Product, ProductDocument, ProductImage
+from apps.profiles.models import Company, ContactPerson, ProfileDocument
+from .models import ChunkedUpload, StoredBlob
+from .images import variant_names
+from .storage import CAS_PREFIX
+from .tasks import generate_image_variants
+from .views import can_view_private_file
+from PIL import Image
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+# Create your tests here.
+User = get_user_model()
+
+
+class MediaRootMixin:
+    """Runs each test against an empty MEDIA_ROOT of its own"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def document(self, content, name="document.pdf"):
+        document = ProductDocument(name=name)
+        with self.captureOnCommitCallbacks(execute=True):
+            document.file.save(name, ContentFile(content))
+        return document
+
+
+class ContentAddressedStorageTest(MediaRootMixin, TestCase):
+    def test_same_content_stored_once_and_freed_with_last_reference(self):
+        first = self.document(b"same content")
+        second = self.document(b"same content", name="copy.pdf")
+        name = first.file.name
+        self.assertTrue(name.startswith(CAS_PREFIX + "/"))
+        self.assertEqual(second.file.name, name)
+        self.assertEqual(StoredBlob.objects.get(name=name).refcount, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(StoredBlob.objects.get(name=name).refcount, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(StoredBlob.objects.filter(name=name).exists())
+
+    def test_replaced_file_released(self):
+        document = self.document(b"first version")
+        old_name = document.file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            document.file.save("document.pdf", ContentFile(b"second version"))
+        self.assertNotEqual(document.file.name, old_name)
+        self.assertFalse(default_storage.exists(old_name))
+        self.assertFalse(StoredBlob.objects.filter(name=old_name).exists())
+
+        # Saving the row again without touching the file keeps its reference
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductDocument.objects.get(pk=document.pk).save()
+        self.assertTrue(default_storage.exists(document.file.name))
+
+    def test_missing_file_put_back_for_new_reference(self):
+        document = self.document(b"content")
+        os.remove(default_storage.path(document.file.name))
+        self.document(b"content", name="again.pdf")
+        self.assertTrue(default_storage.exists(document.file.name))
+        self.assertEqual(StoredBlob.objects.get(name=document.file.name).refcount, 2)
+
+
+class RehashMediaTest(MediaRootMixin, TestCase):
+    def legacy_document(self, name, content):
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fh:
+            fh.write(content)
+        return ProductDocument.objects.create(name=name, file=name)
+
+    def test_legacy_files_moved_and_deduplicated(self):
+        first = self.legacy_document("user_main/a.pdf", b"duplicate")
+        second = self.legacy_document("user_main/b.pdf", b"duplicate")
+        other = self.legacy_document("user_main/c.pdf", b"unique")
+
+        call_command("rehash_media", workers=1, stdout=io.StringIO())
+
+        for document in (first, second, other):
+            document.refresh_from_db()
+            self.assertTrue(document.file.name.startswith(CAS_PREFIX + "/"))
+            self.assertTrue(default_storage.exists(document.file.name))
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertNotEqual(first.file.name, other.file.name)
+        self.assertEqual(StoredBlob.objects.get(name=first.file.name).refcount, 2)
+        self.assertEqual(StoredBlob.objects.get(name=other.file.name).refcount, 1)
+        self.assertFalse(default_storage.exists("user_main/a.pdf"))
+
+    def test_dry_run_changes_nothing(self):
+        document = self.legacy_document("user_main/a.pdf", b"content")
+        call_command("rehash_media", workers=1, dry_run=True, stdout=io.StringIO())
+        document.refresh_from_db()
+        self.assertEqual(document.file.name, "user_main/a.pdf")
+        self.assertFalse(StoredBlob.objects.exists())
+
+
+@override_settings(MEDIA_ACCEL_REDIRECT=False)
+class MediaAccessTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user(
+            email="owner@example.com", password="password", name="Owner"
+        )
+        self.colleague = User.objects.create_user(
+            email="colleague@example.com", password="password", name="Colleague"
+        )
+        self.stranger = User.objects.create_user(
+            email="stranger@example.com", password="password", name="Stranger"
+        )
+        self.staff = User.objects.create_user(
+            email="staff@example.com", password="password", name="Staff"
+        )
+        self.staff.is_staff = True
+        self.staff.save()
+        company = Company.objects.create(company_name="Company", email="c@example.com")
+        contact = ContactPerson.objects.create(
+            user=self.colleague, first_name="C", last_name="P", email="c@example.com"
+        )
+        contact.companies.add(company)
+        self.private = ProfileDocument(
+            name="licence.pdf", company=company, uploaded_by=self.owner
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.private.file.save("licence.pdf", ContentFile(b"private"))
+        self.public = self.document(b"public")
+        self.client = APIClient()
+
+    def get(self, path, user=None):
+        self.client.force_authenticate(user)
+        return self.client.get("/mediafiles/" + path)
+
+    def test_can_view_private_file(self):
+        path = self.private.file.name
+        self.assertIsNone(can_view_private_file(self.stranger, self.public.file.name))
+        self.assertTrue(can_view_private_file(self.owner, path))
+        self.assertTrue(can_view_private_file(self.colleague, path))
+        self.assertTrue(can_view_private_file(self.staff, path))
+        self.assertFalse(can_view_private_file(self.stranger, path))
+        self.assertFalse(can_view_private_file(AnonymousUser(), path))
+
+    def test_private_file_served_to_allowed_users_only(self):
+        self.assertEqual(self.get(self.private.file.name).status_code, 403)
+        self.assertEqual(
+            self.get(self.private.file.name, self.stranger).status_code, 403
+        )
+        response = self.get(self.private.file.name, self.owner)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"private")
+        self.assertEqual(response["Cache-Control"], "private, no-store")
+
+    def test_only_content_addressed_files_cached_as_immutable(self):
+        response = self.get(self.public.file.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["Cache-Control"], "public, max-age=31536000, immutable"
+        )
+
+        path = default_storage.path("user_main/legacy.pdf")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fh:
+            fh.write(b"legacy")
+        response = self.get("user_main/legacy.pdf")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("immutable", response["Cache-Control"])
+
+    def test_paths_outside_media_refused(self):
+        self.assertEqual(self.get("../settings.py").status_code, 404)
+        self.assertEqual(self.get(CAS_PREFIX + "/tmp/upload").status_code, 404)
+        self.assertEqual(self.get("missing.pdf").status_code, 404)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT=True)
+    def test_sent_by_nginx_when_enabled(self):
+        response = self.get(self.public.file.name)
+        self.assertEqual(
+            response["X-Accel-Redirect"], "/protected-media/" + self.public.file.name
+        )
+
+
+class ImageVariantsTest(MediaRootMixin, TestCase):
+    def png(self, width, height, colour):
+        buffer = io.BytesIO()
+        Image.new("RGBA", (width, height), colour).save(buffer, "PNG")
+        return ContentFile(buffer.getvalue())
+
+    def save_image(self, image, content, name="photo.png"):
+        # The renditions task is run in place of queuing it
+        with mock.patch.object(
+            generate_image_variants, "delay", side_effect=generate_image_variants
+        ), self.captureOnCommitCallbacks(execute=True):
+            image.image.save(name, content)
+        image.refresh_from_db()
+        return image
+
+    def test_renditions_generated_below_original_width(self):
+        image = self.save_image(ProductImage(), self.png(800, 400, "red"))
+        variants = image.variants
+        self.assertEqual(variants["source"], image.image.name)
+        self.assertEqual(variants["width"], 800)
+        for extension in ("jpeg", "webp"):
+            self.assertEqual(sorted(variants[extension], key=int), ["320", "640"])
+        for name in variant_names(variants):
+            self.assertTrue(default_storage.exists(name))
+        with Image.open(default_storage.open(variants["webp"]["320"])) as rendition:
+            self.assertEqual(rendition.size, (320, 160))
+
+    def test_old_renditions_released_when_image_replaced_or_deleted(self):
+        image = self.save_image(ProductImage(), self.png(800, 400, "red"))
+        old = list(variant_names(image.variants))
+        image = self.save_image(image, self.png(700, 300, "blue"))
+        self.assertTrue(image.variants["jpeg"])
+        for name in old:
+            self.assertFalse(default_storage.exists(name))
+
+        current = list(variant_names(image.variants))
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        for name in current:
+            self.assertFalse(default_storage.exists(name))
+        self.assertFalse(StoredBlob.objects.exists())
+
+    def test_cached_list_shows_renditions_once_generated(self):
+        cache.clear()
+        seller = Company.objects.create(company_name="Seller", email="s@example.com")
+        CurrencyRates.objects.create(currency_rate_timestamp=now(), usd=1)
+        product = Product.objects.create(
+            name="Cocoa", description="Beans", seller=seller, cost="10.00"
+        )
+        image = ProductImage()
+        with mock.patch.object(
+            generate_image_variants, "delay"
+        ), self.captureOnCommitCallbacks(execute=True):
+            image.image.save("photo.png", self.png(800, 400, "red"))
+            product.images.add(image)
+        client = APIClient()
+        client.force_authenticate(
+            User.objects.create_user(
+                email="buyer@example.com", password="password", name="Buyer"
+            )
+        )
+        first = client.get("/api/v1/products/")
+        self.assertEqual(first.json()[0]["image_variants"], [{}])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            generate_image_variants(
+                "inventory.ProductImage", image.pk, "image", "variants"
+            )
+        response = client.get("/api/v1/products/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(response.json()[0]["image_variants"][0]["webp"]), ["320w", "640w"]
+        )
+
+    def test_files_that_are_not_images_get_no_renditions(self):
+        image = self.save_image(
+            ProductImage(), ContentFile(b"%PDF-1.4 not an image"), "brochure.pdf"
+        )
+        self.assertEqual(image.variants, {"source": image.image.name})
+
+
+@override_settings(CHUNKED_UPLOAD_CHUNK_SIZE=10)
+class ChunkedUploadTest(MediaRootMixin, TestCase):
+    content = b"%PDF-1.4\n%" + b"x" * 20
+
+    def setUp(self):
+        super().setUp()
+        upload_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_root, ignore_errors=True)
+        settings_override = override_settings(CHUNKED_UPLOAD_ROOT=upload_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(
+            email="user@example.com", password="password", name="User"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def init(self, **data):
+        response = self.client.post(
+            "/api/v1/uploads/",
+            {
+                "filename": "brochure.pdf",
+                "target": "product_document",
+                "total_size": len(self.content),
+                **data,
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def put_chunk(self, upload_id, index, data=None):
+        if data is None:
+            data = self.content[index * 10 : (index + 1) * 10]
+        return self.client.put(
+            f"/api/v1/uploads/{upload_id}/chunks/{index}/",
+            data,
+            content_type="application/octet-stream",
+        )
+
+    def complete(self, upload_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f"/api/v1/uploads/{upload_id}/complete/")
+
+    def test_chunks_sent_out_of_order_and_completed(self):
+        upload_id = self.init()
+        for index in (2, 0):
+            self.assertEqual(self.put_chunk(upload_id, index).status_code, 200)
+        response = self.client.get(f"/api/v1/uploads/{upload_id}/")
+        self.assertEqual(response.data["total_chunks"], 3)
+        self.assertEqual(response.data["received_chunks"], [0, 2])
+        self.assertEqual(self.complete(upload_id).status_code, 400)
+
+        self.assertEqual(self.put_chunk(upload_id, 1).status_code, 200)
+        response = self.complete(upload_id)
+        self.assertEqual(response.status_code, 201)
+        document = ProductDocument.objects.get(id=response.data["id"])
+        self.assertEqual(document.file.read(), self.content)
+        upload = ChunkedUpload.objects.get(id=upload_id)
+        self.assertEqual(upload.status, "COMPLETE")
+        self.assertFalse(upload.chunk_dir.exists())
+        self.assertEqual(self.put_chunk(upload_id, 0).status_code, 400)
+
+    def test_chunk_of_the_wrong_size_rejected(self):
+        upload_id = self.init()
+        self.assertEqual(self.put_chunk(upload_id, 0, b"short").status_code, 400)
+        self.assertEqual(self.put_chunk(upload_id, 2, b"x" * 11).status_code, 400)
+        self.assertEqual(self.put_chunk(upload_id, 3, b"x" * 10).status_code, 400)
+        self.assertEqual(ChunkedUpload.objects.get(id=upload_id).received_chunks(), [])
+
+    def test_hash_checked_on_completion(self):
+        upload_id = self.init(sha256="0" * 64)
+        for index in range(3):
+            self.put_chunk(upload_id, index)
+        self.assertEqual(self.complete(upload_id).status_code, 400)
+        self.assertFalse(ProductDocument.objects.exists())
+        # The chunks are dropped so the file is sent again
+        upload = ChunkedUpload.objects.get(id=upload_id)
+        self.assertEqual(upload.missing_chunks(), [0, 1, 2])
+
+        upload_id = self.init(sha256=hashlib.sha256(self.content).hexdigest())
+        for index in range(3):
+            self.put_chunk(upload_id, index)
+        self.assertEqual(self.complete(upload_id).status_code, 201)
+
+    def test_size_limits_checked_on_init(self):
+        for total_size in (0, settings.CHUNKED_UPLOAD_MAX_SIZE + 1):
+            response = self.client.post(
+                "/api/v1/uploads/",
+                {
+                    "filename": "brochure.pdf",
+                    "target": "product_document",
+                    "total_size": total_size,
+                },
+                format="json",
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_other_users_upload_not_found(self):
+        upload_id = self.init()
+        self.put_chunk(upload_id, 0)
+        other = User.objects.create_user(
+            email="other@example.com", password="password", name="Other"
+        )
+        self.client.force_authenticate(other)
+        self.assertEqual(
+            self.client.get(f"/api/v1/uploads/{upload_id}/").status_code, 404
+        )
+        self.assertEqual(self.put_chunk(upload_id, 1).status_code, 404)
+        self.assertEqual(self.complete(upload_id).status_code, 404)
+        self.assertEqual(ChunkedUpload.objects.get(id=upload_id).received_chunks(), [0])
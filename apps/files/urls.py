@@ -0,0 +1,17 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path("uploads/", views.init_upload, name="init_upload"),
+    path("uploads/<uuid:upload_id>/", views.upload_status, name="upload_status"),
+    path(
+        "uploads/<uuid:upload_id>/chunks/<int:index>/",
+        views.upload_chunk,
+        name="upload_chunk",
+    ),
+    path(
+        "uploads/<uuid:upload_id>/complete/",
+        views.complete_upload,
+        name="complete_upload",
+    ),
+]
@@ -0,0 +1,202 @@
+from rest_framework import status, permissions
+from rest_framework.decorators import (
+    api_view,
+    permission_classes,
+    authentication_classes,
+)
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse
+from apps.profiles.models import ContactPerson, ProfileDocument, Rep
+from apps.orders.models import ArchivedInvoice, Invoice, StatementReconciliation
+from .models import ChunkedUpload
+from .serializers import ChunkedUploadSerializer
+from .storage import CAS_PREFIX
+import mimetypes
+import posixpath
+
+# Create your views here.
+
+
+def get_upload(request, upload_id):
+    return ChunkedUpload.objects.filter(id=upload_id, user=request.user.id).first()
+
+
+def upload_not_found():
+    return Response(
+        {
+            "errors": "Upload not found",
+            "status": "failed",
+            "message": "No upload in progress with this id",
+        },
+        status=status.HTTP_404_NOT_FOUND,
+    )
+
+
+@api_view(["POST"])
+@permission_classes([permissions.IsAuthenticated])
+@authentication_classes([JWTAuthentication])
+def init_upload(request):
+    """
+    Starts a resumable upload, the client then PUTs each chunk as the raw
+    request body and finally calls complete. Chunks that fail can be resent,
+    GET on the upload returns the chunks already received
+    """
+    serializer = ChunkedUploadSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    upload = ChunkedUpload(
+        user=request.user,
+        chunk_size=settings.CHUNKED_UPLOAD_CHUNK_SIZE,
+        **serializer.validated_data,
+    )
+    # Fail before any bytes are sent if the target is invalid
+    upload.resolve_target()
+    upload.save()
+    return Response(
+        ChunkedUploadSerializer(instance=upload).data, status=status.HTTP_201_CREATED
+    )
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+@authentication_classes([JWTAuthentication])
+def upload_status(request, upload_id):
+    upload = get_upload(request, upload_id)
+    if not upload:
+        return upload_not_found()
+    return Response(ChunkedUploadSerializer(instance=upload).data)
+
+
+@api_view(["PUT"])
+@permission_classes([permissions.IsAuthenticated])
+@authentication_classes([JWTAuthentication])
+def upload_chunk(request, upload_id, index):
+    upload = get_upload(request, upload_id)
+    if not upload:
+        return upload_not_found()
+    upload.write_chunk(index, request.stream)
+    return Response(
+        {"chunk": index, "received_chunks": upload.received_chunks()},
+        status=status.HTTP_200_OK,
+    )
+
+
+@api_view(["POST"])
+@permission_classes([permissions.IsAuthenticated])
+@authentication_classes([JWTAuthentication])
+@transaction.atomic
+def complete_upload(request, upload_id):
+    upload = get_upload(request, upload_id)
+    if not upload:
+        return upload_not_found()
+    instance = upload.complete()
+    return Response(
+        {
+            "target": upload.target,
+            "id": instance.id,
+            "filename": upload.filename,
+        },
+        status=status.HTTP_201_CREATED,
+    )
+
+
+def can_view_private_file(user, path):
+    """
+    None when the file is public, otherwise whether the user may download it.
+    Rep ID cards are visible to the rep, profile documents to the uploader, the
+    rep they belong to and the contact people of their company, invoice PDFs to
+    the buyer and the contact people of the issuer. Settlement statements and
+    their reconciliation reports are for staff only
+    """
+    reps = list(Rep.objects.filter(id_card=path).values_list("user", flat=True))
+    documents = list(
+        ProfileDocument.objects.filter(file=path).select_related("rep", "company")
+    )
+    invoices = list(
+        Invoice.objects.filter(pdf=path).values_list("buyer", "issuer")
+    ) + list(ArchivedInvoice.objects.filter(pdf=path).values_list("buyer", "issuer"))
+    statements = StatementReconciliation.objects.filter(
+        Q(statement=path) | Q(report=path)
+    ).exists()
+    if not reps and not documents and not invoices and not statements:
+        return None
+    if not user.is_authenticated:
+        return False
+    if user.is_staff or user.is_superuser or user.id in reps:
+        return True
+    for buyer, issuer in invoices:
+        if buyer == user.id:
+            return True
+        if ContactPerson.objects.filter(user=user, companies=issuer).exists():
+            return True
+    for document in documents:
+        if document.uploaded_by_id == user.id:
+            return True
+        if document.rep and document.rep.user_id == user.id:
+            return True
+        if (
+            document.company
+            and ContactPerson.objects.filter(
+                user=user, companies=document.company
+            ).exists()
+        ):
+            return True
+    return False
+
+
+@api_view(["GET", "HEAD"])
+@permission_classes([permissions.AllowAny])
+def serve_media(request, path):
+    """
+    Checks access to a media file and lets nginx send it via X-Accel-Redirect,
+    so workers never stream file bytes. Without nginx (MEDIA_ACCEL_REDIRECT off)
+    the file is streamed by Django
+    """
+    path = posixpath.normpath(path).lstrip("/")
+    if path.startswith("..") or path.startswith(CAS_PREFIX + "/tmp/"):
+        raise Http404
+    allowed = can_view_private_file(request.user, path)
+    if allowed is False:
+        return Response(
+            {
+                "errors": "Not Authorized to view this file",
+                "status": "failed",
+                "message": "Not Authorized to view this file",
+            },
+            status=status.HTTP_403_FORBIDDEN,
+        )
+
+    return media_file_response(path, private=allowed is not None)
+
+
+def media_file_response(path, private, filename=None):
+    """
+    Response for a stored file, the caller checks access. filename makes the
+    browser download it under that name
+    """
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if settings.MEDIA_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + path
+    else:
+        try:
+            response = FileResponse(
+                default_storage.open(path), content_type=content_type
+            )
+        except FileNotFoundError:
+            raise Http404
+    if filename:
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    if private:
+        response["Cache-Control"] = "private, no-store"
+    elif path.startswith(CAS_PREFIX + "/"):
+        # Stored under the hash of their content, so the bytes never change
+        response["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        # Files not rehashed yet keep their upload name, which can be reused
+        response["Cache-Control"] = "public, max-age=3600"
+    return response
@@ -1,5 +1,13 @@
 from django.contrib import admin
-from .models import Category, Product, ProductImage, CurrencyRates, ProductViews
+from .models import (
+    Category,
+    Product,
+    ProductImage,
+    CurrencyRates,
+    ProductViews,
+    ArchivedProductView,
+    CatalogChange,
+)
 
 
 # Register your models here.
@@ -12,3 +20,5 @@ admin.site.register(Product, ProductAdmin)
 admin.site.register(ProductImage)
 admin.site.register(CurrencyRates)
 admin.site.register(ProductViews)
+admin.site.register(ArchivedProductView)
+admin.site.register(CatalogChange)
@@ -0,0 +1,37 @@
+from django.db import transaction
+from .models import ArchivedProductView, ProductViews
+
+
+def archive_product_views(cutoff, batch_size):
+    """Moves up to batch_size ProductViews created before cutoff, oldest first"""
+    with transaction.atomic():
+        views = list(
+            ProductViews.objects.select_for_update(skip_locked=True)
+            .filter(created_at__lt=cutoff)
+            .order_by("pkid")
+            .values("pkid", "id", "ip", "product_id", "created_at")[:batch_size]
+        )
+        if not views:
+            return 0
+        ArchivedProductView.objects.bulk_create(
+            [
+                ArchivedProductView(
+                    id=view["id"],
+                    ip=view["ip"],
+                    product_id=view["product_id"],
+                    created_at=view["created_at"],
+                )
+                for view in views
+            ],
+            ignore_conflicts=True,
+        )
+        ProductViews.objects.filter(pkid__in=[view["pkid"] for view in views]).delete()
+    return len(views)
+
+
+def product_viewed_from(product, ip):
+    """Whether ip already viewed product, recent views are looked up first"""
+    return (
+        ProductViews.objects.filter(product=product, ip=ip).exists()
+        or ArchivedProductView.objects.filter(product=product, ip=ip).exists()
+    )
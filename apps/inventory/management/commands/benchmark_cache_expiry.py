@@ -0,0 +1,84 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.urls import Resolver404, resolve
+from rest_framework.test import APIRequestFactory, force_authenticate
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import threading
+import time
+import urllib.parse
+import uuid
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests a cached endpoint from parallel threads while its cache entry "
+        "expires a few times, and prints the requests served and database "
+        "queries run in each second. With single flight the queries do not "
+        "spike when the entry expires"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default="/api/v1/products/?top=true")
+        parser.add_argument("--threads", type=int, default=32)
+        parser.add_argument("--seconds", type=int, default=10)
+        parser.add_argument(
+            "--timeout", type=int, default=3, help="Cache timeout during the run"
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            raise CommandError("An in-memory database is not shared between threads")
+        path = options["path"]
+        try:
+            match = resolve(urllib.parse.urlsplit(path).path)
+        except Resolver404:
+            raise CommandError(f"No endpoint at {path}")
+        run = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(
+            email=f"benchmark-{run}@example.com", password=uuid.uuid4().hex, name=run
+        )
+        factory = APIRequestFactory()
+        requests = collections.Counter()
+        queries = collections.Counter()
+        statuses = collections.Counter()
+        lock = threading.Lock()
+        started = time.monotonic()
+        deadline = started + options["seconds"]
+
+        def count_query(execute, sql, params, many, context):
+            with lock:
+                queries[int(time.monotonic() - started)] += 1
+            return execute(sql, params, many, context)
+
+        def client(_index):
+            try:
+                with connection.execute_wrapper(count_query):
+                    while time.monotonic() < deadline:
+                        request = factory.get(path)
+                        force_authenticate(request, user=user)
+                        response = match.func(request, *match.args, **match.kwargs)
+                        with lock:
+                            requests[int(time.monotonic() - started)] += 1
+                            statuses[response.status_code] += 1
+            finally:
+                connection.close()
+
+        try:
+            with override_settings(RESPONSE_CACHE_TIMEOUT=options["timeout"]):
+                with ThreadPoolExecutor(max_workers=options["threads"]) as executor:
+                    list(executor.map(client, range(options["threads"])))
+        finally:
+            user.delete()
+
+        self.stdout.write(f"{'second':>6} {'requests':>9} {'queries':>8}")
+        for second in range(options["seconds"]):
+            self.stdout.write(f"{second:>6} {requests[second]:>9} {queries[second]:>8}")
+        self.stdout.write(
+            f"{sum(requests.values())} requests, {sum(queries.values())} queries, "
+            f"status codes {dict(statuses)}"
+        )
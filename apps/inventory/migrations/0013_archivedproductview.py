@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("inventory", "0012_category_category_image_variants_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedProductView",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(editable=False, primary_key=True, serialize=False),
+                ),
+                ("ip", models.CharField(max_length=250, verbose_name="IP Address")),
+                ("created_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="productviews",
+            index=models.Index(fields=["product", "ip"], name="product_view_ip_idx"),
+        ),
+        migrations.AddField(
+            model_name="archivedproductview",
+            name="product",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="archived_views",
+                to="inventory.product",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="archivedproductview",
+            index=models.Index(fields=["product", "ip"], name="archived_view_ip_idx"),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("inventory", "0013_archivedproductview"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="available_quantity",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
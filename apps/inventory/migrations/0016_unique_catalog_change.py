@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:53
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_changes(apps, schema_editor):
+    """Keeps the latest row of every object"""
+    CatalogChange = apps.get_model("inventory", "CatalogChange")
+    duplicated = (
+        CatalogChange.objects.values("kind", "object_id")
+        .annotate(latest=Max("id"), rows=Count("id"))
+        .filter(rows__gt=1)
+    )
+    for row in list(duplicated):
+        CatalogChange.objects.filter(
+            kind=row["kind"], object_id=row["object_id"], id__lt=row["latest"]
+        ).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("inventory", "0015_catalogchange_product_updated_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_changes, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="catalogchange",
+            name="catalog_change_object_idx",
+        ),
+        migrations.AddConstraint(
+            model_name="catalogchange",
+            constraint=models.UniqueConstraint(
+                fields=("kind", "object_id"), name="unique_catalog_change"
+            ),
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 from mptt.models import MPTTModel, TreeForeignKey, TreeManyToManyField
 from django.utils.translation import gettext_lazy as _
 from autoslug import AutoSlugField
@@ -10,6 +11,7 @@ from django.conf import settings
 from django.core.exceptions import ValidationError
 from multiselectfield import MultiSelectField
 import uuid
+from utils.cache import bump_on_commit
 
 # Create your models here.
 
@@ -124,6 +126,8 @@ class Category(MPTTModel):
     category_image = models.FileField(
         upload_to=user_directory_path, blank=True, null=True
     )
+    # Thumbnail and WebP renditions of category_image, filled in by a celery task
+    category_image_variants = models.JSONField(default=dict, blank=True)
 
     class MPTTMeta:
         order_insertion_by = ["name"]
@@ -155,6 +159,8 @@ class ProductImage(models.Model):
         return "user_{0}/{1}".format("main", filename)
 
     image = models.FileField(upload_to=user_directory_path, blank=True, null=True)
+    # Thumbnail and WebP renditions of image, filled in by a celery task
+    variants = models.JSONField(default=dict, blank=True)
 
 
 # class SampleInformation(models.Model):
@@ -206,7 +212,7 @@ class Product(models.Model):
         help_text=_("format: Y-m-d H:M:S"),
     )
     updated_at = models.DateTimeField(
-        auto_now_add=True,
+        auto_now=True,
         editable=False,
         verbose_name=_("date product last updated"),
         help_text=_("format: Y-m-d H:M:S"),
@@ -225,6 +231,9 @@ class Product(models.Model):
     unit = models.CharField(max_length=250, blank=True, null=True)
     weight = models.CharField(max_length=20, blank=True, null=True)
     cost = models.DecimalField(decimal_places=2, default="0.00", max_digits=20)
+    # Units that can still be ordered, taken when an order is placed and given
+    # back when it is cancelled. None means the seller does not track stock
+    available_quantity = models.PositiveIntegerField(blank=True, null=True)
     """
 All fields with MultiSelectField will be saved as a comma separated string,
 add "max_choices" to limit the number of choices for the radio buttons
@@ -309,6 +318,30 @@ add "max_choices" to limit the number of choices for the radio buttons
     def __str__(self):
         return str(self.name) if self.name else ""
 
+    @classmethod
+    def take_stock(cls, product_id, quantity):
+        """
+        Takes quantity units if that many are available, in one conditional
+        UPDATE so concurrent orders need no lock up front. Returns whether it did
+        """
+        taken = cls.objects.filter(
+            pk=product_id, available_quantity__gte=quantity
+        ).update(available_quantity=F("available_quantity") - quantity)
+        if taken:
+            # Cached product responses read available_quantity again, see
+            # with_current_stock, and keep everything else
+            bump_on_commit("stock")
+            CatalogChange.record("product", [product_id])
+        return bool(taken)
+
+    @classmethod
+    def return_stock(cls, product_id, quantity):
+        if cls.objects.filter(pk=product_id, available_quantity__isnull=False).update(
+            available_quantity=F("available_quantity") + quantity
+        ):
+            bump_on_commit("stock")
+            CatalogChange.record("product", [product_id])
+
 
 class CurrencyRates(models.Model):
     currency_rate_timestamp = models.DateTimeField()
@@ -375,3 +408,79 @@ class ProductViews(TimeStampedUUIDModel):
     class Meta:
         verbose_name = "Total Views on Product"
         verbose_name_plural = "Total Product Views"
+        indexes = [
+            # Checked on every product view to count each ip once
+            models.Index(fields=["product", "ip"], name="product_view_ip_idx")
+        ]
+
+
+class ArchivedProductView(models.Model):
+    """ProductViews older than PRODUCT_VIEW_ARCHIVE_AFTER_DAYS, see archive.py"""
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    ip = models.CharField(verbose_name=_("IP Address"), max_length=250)
+    product = models.ForeignKey(
+        Product, related_name="archived_views", on_delete=models.CASCADE
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=["product", "ip"], name="archived_view_ip_idx")]
+
+
+class CatalogChange(models.Model):
+    """
+    Latest change of each product, company and category, for the delta sync
+    feed. Deleted objects keep their row as a tombstone. Stock changes count,
+    view counts do not
+    """
+
+    KINDS = (
+        ("product", _("Product")),
+        ("company", _("Company")),
+        ("category", _("Category")),
+    )
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    object_id = models.PositiveBigIntegerField()
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "object_id"], name="unique_catalog_change"
+            )
+        ]
+
+    @classmethod
+    def record(cls, kind, object_ids, deleted=False):
+        """
+        Moves the objects to the end of the feed, replacing their last change,
+        once the transaction commits. Rows are numbered in commit order then, a
+        long transaction cannot slip a change behind a cursor already handed out
+        """
+        object_ids = list(object_ids)
+        if object_ids:
+            transaction.on_commit(lambda: cls._record(kind, object_ids, deleted))
+
+    @classmethod
+    def _record(cls, kind, object_ids, deleted, attempts=3):
+        # A new row rather than an update, the id is the feed cursor
+        object_ids = sorted(set(object_ids))
+        for attempt in range(attempts):
+            try:
+                with transaction.atomic():
+                    cls.objects.filter(kind=kind, object_id__in=object_ids).delete()
+                    cls.objects.bulk_create(
+                        [
+                            cls(kind=kind, object_id=object_id, deleted=deleted)
+                            for object_id in object_ids
+                        ]
+                    )
+                return
+            except IntegrityError:
+                # A concurrent change of one of the objects was recorded in the
+                # meantime, its row is replaced on the next attempt
+                if attempt == attempts - 1:
+                    raise
@@ -1,6 +1,14 @@
 from rest_framework import serializers
-from .models import Product, Category, ProductImage, CurrencyRates, ProductDocument
+from .models import (
+    CatalogChange,
+    Product,
+    Category,
+    ProductImage,
+    CurrencyRates,
+    ProductDocument,
+)
 from utils.utils import Base64File
+from apps.files.images import variant_urls
 import base64
 
 
@@ -15,9 +23,31 @@ class CurrencyRatesSerializer(serializers.ModelSerializer):
         return obj.rates
 
 
+def with_current_stock(products):
+    """
+    ProductReturnSerializer data with available_quantity read again, for cached
+    responses stored before stock was last taken or returned
+    """
+    stock = dict(
+        Product.objects.filter(
+            id__in=[product["id"] for product in products]
+        ).values_list("id", "available_quantity")
+    )
+    return [
+        {
+            **product,
+            "available_quantity": stock.get(
+                product["id"], product["available_quantity"]
+            ),
+        }
+        for product in products
+    ]
+
+
 class ProductReturnSerializer(serializers.ModelSerializer):
     categories = serializers.SerializerMethodField(required=False)
     images = serializers.SerializerMethodField(required=False)
+    image_variants = serializers.SerializerMethodField(required=False)
     brochure = serializers.SerializerMethodField(required=False)
     seller = serializers.SerializerMethodField(required=False)
     rates = serializers.SerializerMethodField(required=False)
@@ -55,6 +85,10 @@ class ProductReturnSerializer(serializers.ModelSerializer):
         #         continue
         # return images_data
 
+    def get_image_variants(self, obj):
+        # Same order as images, lets clients pick the smallest adequate rendition
+        return [variant_urls(pic.variants) for pic in obj.images.all()]
+
     def get_brochure(self, obj):
         return (
             "https://www.tradepayafrica.com" + obj.brochure.url if obj.brochure else ""
@@ -103,6 +137,7 @@ class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
         fields = "__all__"
+        read_only_fields = ["variants"]
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -111,10 +146,12 @@ class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = "__all__"
+        read_only_fields = ["category_image_variants"]
 
 
 class CategoryReturnSerializer(serializers.ModelSerializer):
     category_image = serializers.SerializerMethodField()
+    category_image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Category
@@ -127,6 +164,9 @@ class CategoryReturnSerializer(serializers.ModelSerializer):
             else ""
         )
 
+    def get_category_image_variants(self, obj):
+        return variant_urls(obj.category_image_variants)
+
 
 class ProductDocumentSerializer(serializers.ModelSerializer):
     file = Base64File()
@@ -134,3 +174,9 @@ class ProductDocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductDocument
         fields = "__all__"
+
+
+class CatalogChangeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CatalogChange
+        fields = "__all__"
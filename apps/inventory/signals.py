@@ -0,0 +1,70 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from utils.cache import invalidate_on_change
+from .models import (
+    CatalogChange,
+    Category,
+    Company,
+    CurrencyRates,
+    Product,
+    ProductDocument,
+    ProductImage,
+)
+
+# Cached catalogue responses depending on these models, see utils.cache
+invalidate_on_change(Product, "products")
+invalidate_on_change(ProductImage, "products")
+invalidate_on_change(ProductDocument, "products")
+invalidate_on_change(Category, "categories")
+invalidate_on_change(CurrencyRates, "currency_rates")
+
+
+# Models in the delta sync feed, see CatalogChange
+CATALOG_KINDS = {Product: "product", Company: "company", Category: "category"}
+
+
+def record_saved(sender, instance, **kwargs):
+    CatalogChange.record(CATALOG_KINDS[sender], [instance.pk])
+
+
+def record_deleted(sender, instance, **kwargs):
+    CatalogChange.record(CATALOG_KINDS[sender], [instance.pk], deleted=True)
+
+
+def record_relation(field):
+    """Records both ends of a many to many change of field, when in the feed"""
+    through = field.remote_field.through
+    source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+
+    def receiver(sender, instance, action, reverse, model, pk_set, **kwargs):
+        if action not in ("post_add", "post_remove", "pre_clear"):
+            return
+        if action == "pre_clear":
+            own, other = (target, source) if reverse else (source, target)
+            pk_set = list(
+                through.objects.filter(**{own: instance.pk}).values_list(
+                    other, flat=True
+                )
+            )
+        if type(instance) in CATALOG_KINDS:
+            CatalogChange.record(CATALOG_KINDS[type(instance)], [instance.pk])
+        if model in CATALOG_KINDS:
+            CatalogChange.record(CATALOG_KINDS[model], pk_set)
+
+    m2m_changed.connect(
+        receiver,
+        sender=through,
+        weak=False,
+        dispatch_uid=f"catalog-change-{field.model._meta.label}-{field.name}",
+    )
+
+
+for model in CATALOG_KINDS:
+    post_save.connect(record_saved, sender=model, dispatch_uid="catalog-change")
+    post_delete.connect(record_deleted, sender=model, dispatch_uid="catalog-change")
+for field in (
+    Product._meta.get_field("categories"),
+    Product._meta.get_field("images"),
+    Product._meta.get_field("documents"),
+    Category._meta.get_field("companies"),
+):
+    record_relation(field)
@@ -1,3 +1,231 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.db import IntegrityError, transaction
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from apps.profiles.models import Company
+from utils.cache import get_cache, single_flight
+from .models import CatalogChange, Category, CurrencyRates, Product
+import time
 
 # Create your tests here.
+User = get_user_model()
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = Company.objects.create(company_name="Seller", email="s@example.com")
+        CurrencyRates.objects.create(currency_rate_timestamp=now(), usd=1)
+        self.product = Product.objects.create(
+            name="Cocoa", description="Beans", seller=seller, cost="10.00"
+        )
+        self.user = User.objects.create_user(
+            email="buyer@example.com", password="password", name="Buyer"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_hits_until_a_product_is_saved(self):
+        first = self.client.get("/api/v1/products/")
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/v1/products/")
+        self.assertEqual(first.json(), second.json())
+
+        # Views are counted on hits as well, without invalidating the cache
+        self.client.get(f"/api/v1/products/?id={self.product.id}")
+        self.client.get(f"/api/v1/products/?id={self.product.id}")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.views, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Cocoa beans"
+            self.product.save()
+        response = self.client.get("/api/v1/products/")
+        self.assertEqual(response.json()[0]["name"], "Cocoa beans")
+
+        # Taking stock keeps the cached list, only the quantities are read again
+        Product.objects.filter(id=self.product.id).update(available_quantity=5)
+        self.client.get("/api/v1/categories/")
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.take_stock(self.product.id, 2)
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/v1/products/")
+        self.assertEqual(response.json()[0]["available_quantity"], 3)
+        with self.assertNumQueries(0):
+            self.client.get("/api/v1/categories/")
+
+        self.user.is_staff = True
+        self.user.save()
+        metrics = self.client.get("/api/v1/cache-metrics/").json()["products"]
+        self.assertEqual((metrics["hits"], metrics["misses"]), (3, 3))
+
+    def test_company_products_follow_stock(self):
+        Product.objects.filter(id=self.product.id).update(available_quantity=5)
+        url = f"/api/v1/company/?id={self.product.seller_id}"
+        first = self.client.get(url)
+        self.assertEqual(first.json()[0]["products"][0]["available_quantity"], 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.take_stock(self.product.id, 2)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["products"][0]["available_quantity"], 3)
+
+    def test_conditional_get(self):
+        first = self.client.get("/api/v1/categories/")
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/api/v1/categories/", HTTP_IF_NONE_MATCH=first["ETag"]
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], first["ETag"])
+
+        # Each query gets its own tag
+        other = self.client.get("/api/v1/categories/?top=true")
+        self.assertNotEqual(other["ETag"], first["ETag"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name="Grains")
+        response = self.client.get(
+            "/api/v1/categories/", HTTP_IF_NONE_MATCH=first["ETag"]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+        self.assertFalse(response.has_header("Last-Modified"))
+        self.assertIn("Accept", response["Vary"])
+
+        # The browsable API renders another body, under another tag
+        html = self.client.get("/api/v1/categories/", HTTP_ACCEPT="text/html")
+        self.assertNotEqual(html["ETag"], response["ETag"])
+        response = self.client.get(
+            "/api/v1/categories/",
+            HTTP_ACCEPT="text/html",
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_one_rebuild_per_key(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return "fresh", True
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(
+                executor.map(lambda _i: single_flight("key", compute, 60), range(8))
+            )
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({value for value, _outcome in results}, {"fresh"})
+        self.assertEqual(
+            sorted(outcome for _value, outcome in results), ["coalesced"] * 7 + ["miss"]
+        )
+
+        # Expired while another process rebuilds it: the old value is served
+        get_cache().set("key", {"value": "old", "fresh_until": 0})
+        get_cache().add("rebuilding:key", True)
+        self.assertEqual(single_flight("key", compute, 60), ("old", "stale"))
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(CATALOG_CHANGES_DELAY=0)
+class CatalogChangesTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(
+            email="buyer@example.com", password="password", name="Buyer"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def changes(self, **params):
+        response = self.client.get("/api/v1/changes/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_changes_paged_by_cursor_with_tombstones(self):
+        since = now().isoformat()
+        with self.captureOnCommitCallbacks(execute=True):
+            seller = Company.objects.create(
+                company_name="Seller", email="s@example.com"
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            grains = Category.objects.create(name="Grains")
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                name="Maize", description="Yellow", seller=seller, cost="1.00"
+            )
+            created = product.updated_at
+            product.categories.add(grains)
+            product.save()
+        self.assertGreater(product.updated_at, created)
+
+        page = self.changes(since=since, limit=2)
+        self.assertTrue(page["more"])
+        rest = self.changes(after=page["cursor"])
+        self.assertFalse(rest["more"])
+        # One row per object, in the order of their last change
+        self.assertEqual(
+            [
+                (change["kind"], change["object_id"])
+                for change in page["results"] + rest["results"]
+            ],
+            [("company", seller.id), ("category", grains.id), ("product", product.id)],
+        )
+
+        product_id = product.id
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        tail = self.changes(after=rest["cursor"])
+        self.assertEqual(
+            [(c["kind"], c["object_id"], c["deleted"]) for c in tail["results"]],
+            [("product", product_id, True)],
+        )
+        self.assertEqual(self.changes(after=tail["cursor"])["results"], [])
+        self.assertEqual(CatalogChange.objects.filter(kind="product").count(), 1)
+
+        # Stock is taken with update(), it is journalled all the same
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Product.objects.create(
+                name="Millet", description="Red", cost="1.00", available_quantity=4
+            )
+        cursor = self.changes(after=tail["cursor"])["cursor"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.take_stock(other.id, 1)
+        self.assertEqual(
+            [c["object_id"] for c in self.changes(after=cursor)["results"]],
+            [other.id],
+        )
+
+    def test_one_row_per_object(self):
+        CatalogChange._record("product", [7, 7, 8], False)
+        first = CatalogChange.objects.get(kind="product", object_id=7).id
+
+        # Losing the insert to a concurrent writer, the change is recorded again
+        bulk_create = CatalogChange.objects.bulk_create
+        calls = []
+
+        def racing_bulk_create(rows):
+            calls.append(rows)
+            if len(calls) == 1:
+                raise IntegrityError("Duplicate entry")
+            return bulk_create(rows)
+
+        with mock.patch.object(
+            CatalogChange.objects, "bulk_create", side_effect=racing_bulk_create
+        ):
+            CatalogChange._record("product", [7], False)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(CatalogChange.objects.count(), 2)
+        self.assertGreater(CatalogChange.objects.get(object_id=7).id, first)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CatalogChange.objects.create(kind="product", object_id=8)
+
+    def test_since_required(self):
+        response = self.client.get("/api/v1/changes/", {"since": "yesterday"})
+        self.assertEqual(response.status_code, 400)
@@ -13,4 +13,6 @@ urlpatterns = [
     path("disable-product/", views.disable_product),
     path("my-products/", views.get_my_products),
     path("enable-product/", views.enable_product),
+    path("cache-metrics/", views.get_cache_metrics, name="cache_metrics"),
+    path("changes/", views.get_catalog_changes, name="catalog_changes"),
 ]
@@ -13,26 +13,41 @@ from .serializers import (
     CurrencyRatesSerializer,
     ProductDocumentSerializer,
     CategoryReturnSerializer,
+    CatalogChangeSerializer,
+    with_current_stock,
+)
+from .models import (
+    CatalogChange,
+    Product,
+    Category,
+    CurrencyRates,
+    Company,
+    ProductViews,
 )
-from .models import Product, Category, CurrencyRates, Company, ProductViews
 from apps.profiles.models import ContactPerson
 from rest_framework.response import Response
 from django.db import transaction, IntegrityError
 from rest_framework.views import APIView
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils.dateparse import parse_datetime
 from django.utils.timezone import now
 from datetime import timedelta
-from django.db.models import Count
+from django.db.models import Count, F
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
 # Create your views here.
 
+from .archive import product_viewed_from
+from utils.cache import CachedListMixin, cache_metrics, cache_response
 from utils.fuzzysearch import FuzzySearchFilter
+from utils.idempotency import idempotent
 
 User = get_user_model()
 
 
-class SearchProduct(generics.ListAPIView):
+class SearchProduct(CachedListMixin, generics.ListAPIView):
     """
     Fuzzy Search allows for typos, but the tradeoff is speed,
     increasing fuzz ratio in utils.fuzzysearch will yield faster results,
@@ -45,6 +60,32 @@ class SearchProduct(generics.ListAPIView):
         FuzzySearchFilter,
     ]
     search_fields = ["name", "description"]
+    cache_name = "products"
+    cache_tags = ("products", "categories", "companies", "currency_rates")
+    cache_live_tags = ("stock",)
+
+    def refresh_cached(self, data):
+        return with_current_stock(data)
+
+    def list(self, request, *args, **kwargs):
+        # Counted before the cache lookup, a cached product still gets its views
+        product_id = request.query_params.get("id")
+        if product_id:
+            self.record_view(product_id)
+        return super().list(request, *args, **kwargs)
+
+    def record_view(self, product_id):
+        """Counts a view of the product once per ip"""
+        x_forwarded_for = self.request.META.get("HTTP_X_FORWARDED_FOR")
+        if x_forwarded_for:
+            ip = x_forwarded_for.split(",")[0]
+        else:
+            ip = self.request.META.get("REMOTE_ADDR")
+        if product_viewed_from(product_id, ip):
+            return
+        # update() sends no post_save, a view does not invalidate the cache
+        if Product.objects.filter(id=product_id).update(views=F("views") + 1):
+            ProductViews.objects.create(product_id=product_id, ip=ip)
 
     def get_queryset(self):
         # if superuser queryset equals all, if not qs equals is_active=True
@@ -58,22 +99,7 @@ class SearchProduct(generics.ListAPIView):
         top = self.request.query_params.get("top")
         limit = self.request.query_params.get("limit")
         if product_id:
-            product = Product.objects.filter(id=product_id).order_by("-updated_at")
-            if len(product) > 0:
-                # Update views and prevent spam views
-                x_forwarded_for = self.request.META.get("HTTP_X_FORWARDED_FOR")
-                if x_forwarded_for:
-                    ip = x_forwarded_for.split(",")[0]
-                else:
-                    ip = self.request.META.get("REMOTE_ADDR")
-
-                if not ProductViews.objects.filter(product=product[0], ip=ip).exists():
-                    ProductViews.objects.create(product=product[0], ip=ip)
-
-                    product[0].views += 1
-                    product[0].save()
-
-            queryset = product
+            queryset = Product.objects.filter(id=product_id).order_by("-updated_at")
         elif company_id:
             queryset = Product.objects.filter(
                 seller=company_id, is_active=True
@@ -117,6 +143,7 @@ def get_number_of_products(request):
 @api_view(["POST"])
 @permission_classes([permissions.IsAuthenticated])
 @authentication_classes([JWTAuthentication])
+@idempotent
 @transaction.atomic
 def create_product(request):
     data = request.data
@@ -290,10 +317,12 @@ def enable_product(request):
     return Response({"success": "product enabled"}, status=status.HTTP_200_OK)
 
 
-class SearchCategories(generics.ListAPIView):
+class SearchCategories(CachedListMixin, generics.ListAPIView):
     serializer_class = CategoryReturnSerializer
     filter_backends = [filters.SearchFilter]
     search_fields = ["name"]
+    cache_name = "categories"
+    cache_tags = ("categories", "products")
 
     def get_queryset(self):
         queryset = Category.objects.all()
@@ -363,6 +392,7 @@ def edit_category(request):
 
 
 @api_view(["GET"])
+@cache_response("currency_rates", tags=("currency_rates",))
 @transaction.atomic
 def get_currency_rates(request):
     rates = None
@@ -377,3 +407,69 @@ def get_currency_rates(request):
 
     serializer = CurrencyRatesSerializer(rates)
     return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+def get_cache_metrics(request):
+    """Hits and misses of the cached endpoints"""
+    return Response(cache_metrics(), status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+def get_catalog_changes(request):
+    """
+    Products, companies and categories changed since a time, oldest first, one
+    row per object with deleted set for removed ones:
+    ?since=2024-05-01T10:00:00Z to start, then ?after=<cursor> with the cursor
+    of the previous page. Keep the last cursor for the next sync
+    """
+    params = request.query_params
+    settled = CatalogChange.objects.filter(
+        changed_at__lte=now() - timedelta(seconds=settings.CATALOG_CHANGES_DELAY)
+    ).order_by("id")
+    changes = settled
+    cursor = None
+    if params.get("after"):
+        try:
+            cursor = int(params["after"])
+        except ValueError:
+            raise ValidationError("after must be a cursor returned by this endpoint")
+        changes = changes.filter(id__gt=cursor)
+    elif params.get("since"):
+        try:
+            since = parse_datetime(params["since"])
+        except ValueError:
+            since = None
+        if since is None:
+            raise ValidationError("since must be an ISO 8601 date and time")
+        changes = changes.filter(changed_at__gte=since)
+    else:
+        raise ValidationError("since or after is required")
+    try:
+        limit = max(
+            1,
+            min(
+                int(params.get("limit", settings.CATALOG_CHANGES_PAGE_SIZE)),
+                settings.CATALOG_CHANGES_PAGE_SIZE,
+            ),
+        )
+    except ValueError:
+        raise ValidationError("limit must be a number")
+
+    page = list(changes[: limit + 1])
+    more = len(page) > limit
+    page = page[:limit]
+    if page:
+        cursor = page[-1].id
+    elif cursor is None:
+        # Nothing since then, later changes come after the newest settled one
+        cursor = settled.reverse().values_list("id", flat=True).first() or 0
+    return Response(
+        {
+            "results": CatalogChangeSerializer(page, many=True).data,
+            "cursor": str(cursor),
+            "more": more,
+        },
+        status=status.HTTP_200_OK,
+    )
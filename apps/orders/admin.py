@@ -1,6 +1,28 @@
 from django.contrib import admin
-from .models import Order
+from .models import (
+    Order,
+    CompanyOrderSummary,
+    OutboxEvent,
+    InvoiceSequence,
+    WebhookEvent,
+    SellerDailySales,
+    SellerStatement,
+    ArchivedInvoice,
+    ArchivedOrder,
+    StatementReconciliation,
+    StockReservation,
+)
 
 # Register your models here.
 
 admin.site.register(Order)
+admin.site.register(CompanyOrderSummary)
+admin.site.register(OutboxEvent)
+admin.site.register(InvoiceSequence)
+admin.site.register(WebhookEvent)
+admin.site.register(SellerDailySales)
+admin.site.register(SellerStatement)
+admin.site.register(ArchivedOrder)
+admin.site.register(ArchivedInvoice)
+admin.site.register(StockReservation)
+admin.site.register(StatementReconciliation)
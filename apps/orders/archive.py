@@ -0,0 +1,114 @@
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch
+from .models import (
+    ArchivedInvoice,
+    ArchivedOrder,
+    Invoice,
+    Order,
+    OrderDetail,
+    StockReservation,
+    Transaction,
+)
+from .pdf import invoice_pdf_bytes, invoice_pdf_context, invoice_pdf_hash
+from .serializers import OrderDetailedSerializer
+
+# Open orders stay live however old they are
+ARCHIVED_STATUSES = ("FULFILLED", "CANCELLED")
+
+
+def orders_with_details():
+    """Orders with everything OrderDetailedSerializer reads prefetched"""
+    details = OrderDetail.objects.select_related("item_code").prefetch_related(
+        "item_code__images"
+    )
+    invoices = Invoice.objects.select_related("issuer", "buyer").prefetch_related(
+        "transactions"
+    )
+    return Order.objects.prefetch_related(
+        Prefetch("details", queryset=details),
+        Prefetch("invoice_set", queryset=invoices),
+    )
+
+
+def current_pdf(invoice, details):
+    """
+    Name of the PDF of the invoice as it reads now, rendered and stored when
+    the one it has is missing or stale. The stale one is released
+    """
+    context = invoice_pdf_context(invoice, details)
+    content_hash = invoice_pdf_hash(context)
+    if invoice.pdf and invoice.pdf_hash == content_hash:
+        return invoice.pdf.name
+    name = default_storage.save(
+        "invoices/invoice.pdf", ContentFile(invoice_pdf_bytes(context))
+    )
+    if invoice.pdf:
+        stale = invoice.pdf.name
+        transaction.on_commit(lambda: default_storage.delete(stale))
+    return name
+
+
+def archive_orders(cutoff, batch_size):
+    """
+    Moves up to batch_size finished orders placed before cutoff into
+    ArchivedOrder, with their details, invoices and transactions. The invoice
+    PDFs are kept, as ArchivedInvoice
+    """
+    with transaction.atomic():
+        orders = list(
+            orders_with_details()
+            .select_for_update(skip_locked=True)
+            .filter(order_date__lt=cutoff, status__in=ARCHIVED_STATUSES)
+            .order_by("id")[:batch_size]
+        )
+        if not orders:
+            return 0
+        ArchivedOrder.objects.bulk_create(
+            [
+                ArchivedOrder(
+                    id=order.id,
+                    placed_by_id=order.placed_by_id,
+                    placed_to_id=order.placed_to_id,
+                    order_date=order.order_date,
+                    status=order.status,
+                    currency=order.currency,
+                    grand_total=order.grand_total,
+                    document=OrderDetailedSerializer(order).data,
+                )
+                for order in orders
+            ]
+        )
+        order_ids = [order.id for order in orders]
+        invoices = [invoice for order in orders for invoice in order.invoice_set.all()]
+        # The PDFs move along with the invoices, buyers can still download them
+        ArchivedInvoice.objects.bulk_create(
+            [
+                ArchivedInvoice(
+                    id=invoice.id,
+                    order_id=order.id,
+                    buyer_id=invoice.buyer_id,
+                    issuer_id=invoice.issuer_id,
+                    number=invoice.invoice_number,
+                    pdf=current_pdf(
+                        invoice, sorted(order.details.all(), key=lambda d: d.id)
+                    ),
+                )
+                for order in orders
+                for invoice in order.invoice_set.all()
+            ]
+        )
+        # _raw_delete skips the delete signals: the seller summaries and daily
+        # sales go on counting archived orders
+        for queryset in (
+            Transaction.objects.filter(
+                invoice__in=[invoice.id for invoice in invoices]
+            ),
+            Invoice.objects.filter(order__in=order_ids),
+            OrderDetail.objects.filter(order__in=order_ids),
+            StockReservation.objects.filter(order__in=order_ids),
+            Order.objects.filter(id__in=order_ids),
+        ):
+            queryset._raw_delete(queryset.db)
+    return len(orders)
@@ -0,0 +1,65 @@
+from django.core.exceptions import ValidationError
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from rest_framework import filters
+from rest_framework.pagination import CursorPagination
+from datetime import datetime, time, timedelta
+from .models import Order
+
+
+def parse_order_date(value, end_of_day=False):
+    """Accepts a date or a datetime, a bare date covers the whole day"""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError(f"{value} is not a valid date")
+        moment = datetime.combine(day, time.min)
+        if end_of_day:
+            moment += timedelta(days=1)
+    return make_aware(moment) if is_naive(moment) else moment
+
+
+class OrderFilter(filters.BaseFilterBackend):
+    """
+    Exact filters on indexed order columns, status and currency take a comma
+    separated list: ?status=PENDING,PARTIAL&placed_to=3&order_date_after=2024-01-01
+    """
+
+    list_filters = {"status": Order.STATUS, "currency": Order.CURRENCY}
+    id_filters = ("placed_to", "placed_by")
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        for field, choices in self.list_filters.items():
+            if params.get(field):
+                values = params[field].upper().split(",")
+                allowed = {choice for choice, _label in choices}
+                if not set(values) <= allowed:
+                    raise ValidationError(f"{field} must be one of {sorted(allowed)}")
+                queryset = queryset.filter(**{f"{field}__in": values})
+        for field in self.id_filters:
+            if params.get(field):
+                if not params[field].isdigit():
+                    raise ValidationError(f"{field} must be an id")
+                queryset = queryset.filter(**{f"{field}_id": params[field]})
+        if params.get("order_date_after"):
+            queryset = queryset.filter(
+                order_date__gte=parse_order_date(params["order_date_after"])
+            )
+        if params.get("order_date_before"):
+            queryset = queryset.filter(
+                order_date__lt=parse_order_date(
+                    params["order_date_before"], end_of_day=True
+                )
+            )
+        return queryset
+
+
+class OrderCursorPagination(CursorPagination):
+    """Newest first, pages are fetched by keyset on order_date instead of OFFSET"""
+
+    ordering = ("-order_date", "-id")
+    page_size = 20
+    page_size_query_param = "limit"
+    max_page_size = 100
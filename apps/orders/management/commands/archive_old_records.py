@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from datetime import timedelta
+
+from apps.inventory.archive import archive_product_views
+from apps.orders.archive import archive_orders
+from utils.archive import run_in_batches
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves finished orders and product views older than the retention "
+        "period to the archive tables, in throttled batches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--order-days", type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS
+        )
+        parser.add_argument(
+            "--view-days", type=int, default=settings.PRODUCT_VIEW_ARCHIVE_AFTER_DAYS
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.ARCHIVE_BATCH_SIZE
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=settings.ARCHIVE_BATCH_PAUSE,
+            help="Seconds to wait between batches",
+        )
+        parser.add_argument("--max-batches", type=int)
+
+    def handle(self, *args, **options):
+        for name, archive, days in (
+            ("orders", archive_orders, options["order_days"]),
+            ("product views", archive_product_views, options["view_days"]),
+        ):
+            moved = run_in_batches(
+                archive,
+                now() - timedelta(days=days),
+                options["batch_size"],
+                pause=options["pause"],
+                max_batches=options["max_batches"],
+            )
+            self.stdout.write(f"{moved} {name} archived")
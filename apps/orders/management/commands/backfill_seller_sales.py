@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+
+from apps.orders.models import Order, SellerDailySales
+
+
+def rebuild_chunk(company_ids):
+    return SellerDailySales.rebuild(company_ids)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds SellerDailySales from the orders, in chunks of sellers spread "
+        "over worker processes. Run it once after deploying the rollup, and "
+        "whenever the rows may have drifted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--company", type=int, action="append", help="Only these sellers"
+        )
+        parser.add_argument("--chunk-size", type=int, default=200)
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        company_ids = options["company"] or list(
+            Order.objects.order_by("placed_to")
+            .values_list("placed_to", flat=True)
+            .distinct()
+        )
+        size = options["chunk_size"]
+        chunks = [
+            company_ids[start : start + size]
+            for start in range(0, len(company_ids), size)
+        ]
+        self.stdout.write(f"{len(company_ids)} sellers in {len(chunks)} chunks")
+
+        if options["workers"] <= 1 or len(chunks) <= 1:
+            rows = sum(map(rebuild_chunk, chunks))
+        else:
+            # Forked workers must not share this process' database connection
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=options["workers"],
+                mp_context=multiprocessing.get_context("fork"),
+            ) as executor:
+                rows = sum(executor.map(rebuild_chunk, chunks))
+        self.stdout.write(self.style.SUCCESS(f"{rows} daily rows written"))
@@ -0,0 +1,103 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import statistics
+import time
+import uuid
+
+from apps.inventory.models import Product
+from apps.orders.models import Order, OutboxEvent
+from apps.orders.views import create_order
+from apps.profiles.models import Company
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Places orders for one product from parallel threads through the "
+        "create-order endpoint, and checks the stock was never oversold. "
+        "Creates its own buyer, seller and product and removes them afterwards"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=200)
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--stock", type=int, default=100)
+        parser.add_argument("--quantity", type=int, default=1)
+        parser.add_argument(
+            "--keep", action="store_true", help="Keep the orders and products made"
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor == "sqlite" and options["threads"] > 1:
+            raise CommandError("SQLite serialises every write, run it on MySQL")
+        run = uuid.uuid4().hex[:8]
+        buyer = User.objects.create_user(
+            email=f"benchmark-{run}@example.com", password=uuid.uuid4().hex, name=run
+        )
+        seller = Company.objects.create(
+            company_name=f"Benchmark {run}", email=f"seller-{run}@example.com"
+        )
+        product = Product.objects.create(
+            name=f"Benchmark {run}",
+            description="Stock contention benchmark",
+            seller=seller,
+            cost="1.00",
+            available_quantity=options["stock"],
+        )
+        body = {
+            "currency": "USD",
+            "products": [{"id": product.id, "quantity": options["quantity"]}],
+        }
+
+        factory = APIRequestFactory()
+
+        def place_order(_index):
+            request = factory.post("/api/v1/create-order/", body, format="json")
+            force_authenticate(request, user=buyer)
+            started = time.monotonic()
+            try:
+                response = create_order(request)
+                return response.status_code, time.monotonic() - started
+            finally:
+                if options["threads"] > 1:
+                    connection.close()
+
+        try:
+            started = time.monotonic()
+            if options["threads"] > 1:
+                with ThreadPoolExecutor(max_workers=options["threads"]) as executor:
+                    results = list(executor.map(place_order, range(options["orders"])))
+            else:
+                results = list(map(place_order, range(options["orders"])))
+            seconds = time.monotonic() - started
+
+            codes = collections.Counter(code for code, _seconds in results)
+            latencies = sorted(seconds for _code, seconds in results)
+            product.refresh_from_db()
+            sold = Order.objects.filter(placed_to=seller).count() * options["quantity"]
+            self.stdout.write(
+                f"{options['orders']} orders from {options['threads']} threads in "
+                f"{seconds:.2f}s ({options['orders'] / seconds:.0f}/s), "
+                f"status codes {dict(codes)}\n"
+                f"latency p50 {statistics.median(latencies) * 1000:.0f}ms, "
+                f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f}ms\n"
+                f"{sold} units sold, {product.available_quantity} left "
+                f"of {options['stock']}"
+            )
+            if sold + product.available_quantity != options["stock"]:
+                raise CommandError("Sold and left do not add up to the stock")
+        finally:
+            if not options["keep"]:
+                order_ids = list(
+                    Order.objects.filter(placed_to=seller).values_list("id", flat=True)
+                )
+                OutboxEvent.objects.filter(payload__order__in=order_ids).delete()
+                Order.objects.filter(id__in=order_ids).delete()
+                product.delete()
+                seller.delete()
+                buyer.delete()
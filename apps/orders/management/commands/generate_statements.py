@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils.dateparse import parse_date
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import multiprocessing
+import os
+
+from apps.orders.models import Order
+from apps.orders.statements import (
+    generate_statements,
+    load_rates,
+    month_range,
+    statement_companies,
+)
+from apps.orders.tasks import generate_monthly_statements
+
+
+class Command(BaseCommand):
+    help = "Generates the seller statements of a month"
+
+    def add_arguments(self, parser):
+        parser.add_argument("month", help="Any day of the month, YYYY-MM-DD")
+        parser.add_argument("--currency", default=settings.STATEMENT_CURRENCY)
+        parser.add_argument(
+            "--local",
+            action="store_true",
+            help="Generate here in a process pool instead of queueing celery tasks",
+        )
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument(
+            "--chunk-size", type=int, default=settings.STATEMENT_CHUNK_SIZE
+        )
+
+    def handle(self, *args, **options):
+        day = parse_date(options["month"])
+        currency = options["currency"]
+        if day is None:
+            raise CommandError("month must be a date")
+        if currency not in dict(Order.CURRENCY):
+            raise CommandError(f"currency must be one of {list(dict(Order.CURRENCY))}")
+        start, _end = month_range(day)
+        if not options["local"]:
+            generate_monthly_statements.delay(start.isoformat(), currency)
+            self.stdout.write(f"Queued the statements of {start:%Y-%m}")
+            return
+
+        try:
+            rates = load_rates()
+        except ValueError as error:
+            raise CommandError(error)
+        company_ids = statement_companies(start)
+        size = options["chunk_size"]
+        chunks = [
+            company_ids[index : index + size]
+            for index in range(0, len(company_ids), size)
+        ]
+        generate = functools.partial(
+            generate_statements, period_start=start, currency=currency, rates=rates
+        )
+        if options["workers"] <= 1 or len(chunks) <= 1:
+            written = sum(map(generate, chunks))
+        else:
+            # Forked workers must not share this process' database connection
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=options["workers"],
+                mp_context=multiprocessing.get_context("fork"),
+            ) as executor:
+                written = sum(executor.map(generate, chunks))
+        self.stdout.write(
+            self.style.SUCCESS(f"{written} statements for {start:%Y-%m} in {currency}")
+        )
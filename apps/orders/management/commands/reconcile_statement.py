@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.orders.reconciliation import reconcile, statement_format
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconciles a PAPSS or Peoples Pay settlement statement with the transactions"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("statement", help="CSV or XML statement file")
+        parser.add_argument("--format", choices=["csv", "xml"])
+        parser.add_argument(
+            "--report",
+            help="Where to write the exceptions, defaults to <statement>.exceptions.csv",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.RECONCILIATION_BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        path = options["statement"]
+        report_path = options["report"] or f"{path}.exceptions.csv"
+        with open(path, "rb") as statement, open(
+            report_path, "w", newline=""
+        ) as report:
+            result = reconcile(
+                statement,
+                report,
+                file_format=options["format"] or statement_format(path),
+                batch_size=options["batch_size"],
+            )
+        self.stdout.write(
+            f"{result['lines']} lines, {result['matched']} matched, "
+            f"{result['updated']} transactions updated, "
+            f"{result['exceptions']} exceptions in {result['seconds']}s"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Exceptions written to {report_path}"))
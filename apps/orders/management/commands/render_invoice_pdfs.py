@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from apps.orders.models import Invoice
+from apps.orders.pdf import (
+    invoice_pdf_bytes,
+    invoice_pdf_hash,
+    load_invoice_pdf_context,
+    store_invoice_pdf,
+)
+from apps.orders.tasks import render_invoices_for_period
+
+
+class Command(BaseCommand):
+    help = "Renders the PDFs of the invoices issued in a period"
+
+    def add_arguments(self, parser):
+        parser.add_argument("start", help="First issue date, YYYY-MM-DD")
+        parser.add_argument("end", help="Last issue date, YYYY-MM-DD")
+        parser.add_argument(
+            "--local",
+            action="store_true",
+            help="Render here in a process pool instead of queueing celery tasks",
+        )
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        start, end = parse_date(options["start"]), parse_date(options["end"])
+        if start is None or end is None or start > end:
+            raise CommandError("start and end must be dates, start before end")
+        if not options["local"]:
+            render_invoices_for_period.delay(start.isoformat(), end.isoformat())
+            self.stdout.write(f"Queued the invoices from {start} to {end}")
+            return
+
+        pending = []
+        for invoice_id in (
+            Invoice.objects.filter(issued__range=(start, end))
+            .order_by("id")
+            .values_list("id", flat=True)
+        ):
+            invoice, context = load_invoice_pdf_context(invoice_id)
+            content_hash = invoice_pdf_hash(context)
+            if not (invoice.pdf and invoice.pdf_hash == content_hash):
+                pending.append((invoice, content_hash, context))
+        self.stdout.write(f"{len(pending)} invoices to render")
+
+        # Rendering needs no database, only the results are stored from here
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            rendered = executor.map(
+                invoice_pdf_bytes,
+                [context for _invoice, _hash, context in pending],
+                chunksize=16,
+            )
+            for (invoice, content_hash, _context), pdf_bytes in zip(pending, rendered):
+                store_invoice_pdf(invoice, content_hash, pdf_bytes)
+        self.stdout.write(self.style.SUCCESS("Invoices rendered"))
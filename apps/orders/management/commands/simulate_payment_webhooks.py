@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import time
+
+from apps.orders.models import Transaction
+from apps.orders.webhooks import LocalPaymentProvider
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends signed payment callbacks for existing transactions to a running "
+        "server, to exercise the webhook endpoint"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "url", help="e.g. http://localhost:8000/api/v1/webhooks/papss/"
+        )
+        parser.add_argument("--provider", default="papss")
+        parser.add_argument("--status", default="settled")
+        parser.add_argument("--count", type=int, default=1000)
+        parser.add_argument(
+            "--duplicates",
+            type=int,
+            default=0,
+            help="Deliveries of every event beyond the first, as providers retry",
+        )
+        parser.add_argument("--concurrency", type=int, default=16)
+
+    def handle(self, *args, **options):
+        provider = LocalPaymentProvider(options["provider"])
+        transactions = Transaction.objects.order_by("id").values_list(
+            "reference", "amount"
+        )[: options["count"]]
+        events = [
+            provider.event(reference, options["status"], str(amount))
+            for reference, amount in transactions
+        ]
+        deliveries = events * (options["duplicates"] + 1)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            codes = collections.Counter(
+                executor.map(
+                    lambda event: provider.deliver(options["url"], event), deliveries
+                )
+            )
+        seconds = time.monotonic() - started
+        self.stdout.write(
+            f"{len(deliveries)} deliveries of {len(events)} events in {seconds:.2f}s "
+            f"({len(deliveries) / max(seconds, 0.001):.0f}/s), status codes {dict(codes)}"
+        )
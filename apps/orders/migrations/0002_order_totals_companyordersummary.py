@@ -0,0 +1,132 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:12
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model("orders", "Order")
+    CompanyOrderSummary = apps.get_model("orders", "CompanyOrderSummary")
+
+    orders = Order.objects.annotate(
+        detail_quantity=Coalesce(Sum("details__quantity"), 0),
+        detail_subtotal=Coalesce(Sum("details__subtotal"), Decimal(0)),
+        detail_tax=Coalesce(Sum("details__tax"), Decimal(0)),
+    ).order_by("pk")
+    batch = []
+    for order in orders.iterator(chunk_size=1000):
+        order.item_count = order.detail_quantity
+        order.subtotal = order.detail_subtotal
+        order.tax_total = order.detail_tax
+        order.grand_total = order.subtotal + order.tax_total
+        batch.append(order)
+        if len(batch) == 1000:
+            Order.objects.bulk_update(
+                batch, ["item_count", "subtotal", "tax_total", "grand_total"]
+            )
+            batch = []
+    Order.objects.bulk_update(
+        batch, ["item_count", "subtotal", "tax_total", "grand_total"]
+    )
+
+    CompanyOrderSummary.objects.bulk_create(
+        CompanyOrderSummary(**row)
+        for row in Order.objects.values("status", "currency", company_id=F("placed_to"))
+        .annotate(order_count=Count("pk"), total=Sum("grand_total"))
+        .order_by()
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("profiles", "0005_alter_profiledocument_file_alter_rep_id_card"),
+        ("orders", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="grand_total",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=25),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="item_count",
+            field=models.PositiveIntegerField(
+                default=0, help_text="Number of units across all order details"
+            ),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="subtotal",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=25),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="tax_total",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=25),
+        ),
+        migrations.CreateModel(
+            name="CompanyOrderSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "PENDING"),
+                            ("PARTIAL", "PARTIAL"),
+                            ("FULFILLED", "FULFILLED"),
+                            ("CANCELLED", "CANCELLED"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "currency",
+                    models.CharField(
+                        choices=[
+                            ("GHC", "GHC ₵"),
+                            ("USD", "USD $"),
+                            ("CFA", "CFA"),
+                            ("NGN", "NGN ₦"),
+                            ("EUR", "EUR €"),
+                        ],
+                        max_length=50,
+                    ),
+                ),
+                ("order_count", models.IntegerField(default=0)),
+                (
+                    "total",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=25),
+                ),
+                (
+                    "company",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="order_summaries",
+                        to="profiles.company",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="companyordersummary",
+            constraint=models.UniqueConstraint(
+                fields=("company", "status", "currency"),
+                name="unique_company_order_summary",
+            ),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0004_outboxevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="invoice",
+            name="pdf",
+            field=models.FileField(
+                blank=True, db_index=True, null=True, upload_to="invoices/"
+            ),
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="pdf_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
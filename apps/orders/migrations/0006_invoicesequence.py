@@ -0,0 +1,89 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def number_existing_invoices(apps, schema_editor):
+    Invoice = apps.get_model("orders", "Invoice")
+    InvoiceSequence = apps.get_model("orders", "InvoiceSequence")
+
+    next_numbers = {}
+    batch = []
+    for invoice in (
+        Invoice.objects.order_by("issued", "id")
+        .only("id", "issuer_id", "issued")
+        .iterator(chunk_size=1000)
+    ):
+        key = (invoice.issuer_id, invoice.issued.year)
+        invoice.number_year = invoice.issued.year
+        invoice.sequence_number = next_numbers.get(key, 1)
+        next_numbers[key] = invoice.sequence_number + 1
+        batch.append(invoice)
+        if len(batch) == 1000:
+            Invoice.objects.bulk_update(batch, ["number_year", "sequence_number"])
+            batch = []
+    Invoice.objects.bulk_update(batch, ["number_year", "sequence_number"])
+    InvoiceSequence.objects.bulk_create(
+        InvoiceSequence(issuer_id=issuer_id, year=year, next_number=next_number)
+        for (issuer_id, year), next_number in next_numbers.items()
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("profiles", "0005_alter_profiledocument_file_alter_rep_id_card"),
+        ("orders", "0005_invoice_pdf"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InvoiceSequence",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("year", models.PositiveSmallIntegerField()),
+                ("next_number", models.PositiveIntegerField(default=1)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="number_year",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="sequence_number",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="invoice",
+            constraint=models.UniqueConstraint(
+                fields=("issuer", "number_year", "sequence_number"),
+                name="unique_invoice_number",
+            ),
+        ),
+        migrations.AddField(
+            model_name="invoicesequence",
+            name="issuer",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="invoice_sequences",
+                to="profiles.company",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="invoicesequence",
+            constraint=models.UniqueConstraint(
+                fields=("issuer", "year"), name="unique_invoice_sequence"
+            ),
+        ),
+        migrations.RunPython(number_existing_invoices, migrations.RunPython.noop),
+    ]
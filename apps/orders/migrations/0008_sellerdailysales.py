@@ -0,0 +1,77 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("profiles", "0005_alter_profiledocument_file_alter_rep_id_card"),
+        ("orders", "0007_webhookevent"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SellerDailySales",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "PENDING"),
+                            ("PARTIAL", "PARTIAL"),
+                            ("FULFILLED", "FULFILLED"),
+                            ("CANCELLED", "CANCELLED"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "currency",
+                    models.CharField(
+                        choices=[
+                            ("GHC", "GHC ₵"),
+                            ("USD", "USD $"),
+                            ("CFA", "CFA"),
+                            ("NGN", "NGN ₦"),
+                            ("EUR", "EUR €"),
+                        ],
+                        max_length=50,
+                    ),
+                ),
+                ("order_count", models.IntegerField(default=0)),
+                (
+                    "total",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=25),
+                ),
+                (
+                    "company",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_sales",
+                        to="profiles.company",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "seller daily sales",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="sellerdailysales",
+            constraint=models.UniqueConstraint(
+                fields=("company", "date", "status", "currency"),
+                name="unique_seller_daily_sales",
+            ),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("profiles", "0005_alter_profiledocument_file_alter_rep_id_card"),
+        ("orders", "0008_sellerdailysales"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SellerStatement",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("period_start", models.DateField(help_text="First day of the month")),
+                (
+                    "currency",
+                    models.CharField(
+                        choices=[
+                            ("GHC", "GHC ₵"),
+                            ("USD", "USD $"),
+                            ("CFA", "CFA"),
+                            ("NGN", "NGN ₦"),
+                            ("EUR", "EUR €"),
+                        ],
+                        max_length=50,
+                    ),
+                ),
+                ("invoice_count", models.IntegerField(default=0)),
+                (
+                    "total",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=25),
+                ),
+                (
+                    "tax_total",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=25),
+                ),
+                (
+                    "shipping",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=25),
+                ),
+                ("by_currency", models.JSONField(default=dict)),
+                ("rates", models.JSONField(default=dict)),
+                ("generated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["issuer", "issued"], name="invoice_issuer_issued_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="sellerstatement",
+            name="company",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="statements",
+                to="profiles.company",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="sellerstatement",
+            constraint=models.UniqueConstraint(
+                fields=("company", "period_start", "currency"),
+                name="unique_seller_statement",
+            ),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:46
+
+from django.conf import settings
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("profiles", "0005_alter_profiledocument_file_alter_rep_id_card"),
+        ("orders", "0009_sellerstatement"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedOrder",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("order_date", models.DateTimeField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "PENDING"),
+                            ("PARTIAL", "PARTIAL"),
+                            ("FULFILLED", "FULFILLED"),
+                            ("CANCELLED", "CANCELLED"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "currency",
+                    models.CharField(
+                        choices=[
+                            ("GHC", "GHC ₵"),
+                            ("USD", "USD $"),
+                            ("CFA", "CFA"),
+                            ("NGN", "NGN ₦"),
+                            ("EUR", "EUR €"),
+                        ],
+                        max_length=50,
+                    ),
+                ),
+                (
+                    "grand_total",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=25),
+                ),
+                (
+                    "document",
+                    models.JSONField(
+                        encoder=django.core.serializers.json.DjangoJSONEncoder
+                    ),
+                ),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "placed_by",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "placed_to",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="profiles.company",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["placed_to", "status", "order_date"],
+                        name="archived_order_seller_idx",
+                    ),
+                    models.Index(
+                        fields=["placed_by", "order_date"],
+                        name="archived_order_buyer_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("profiles", "0005_alter_profiledocument_file_alter_rep_id_card"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("orders", "0011_stockreservation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedInvoice",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("number", models.CharField(max_length=50)),
+                ("pdf", models.FileField(db_index=True, upload_to="invoices/")),
+                (
+                    "buyer",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "issuer",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="profiles.company",
+                    ),
+                ),
+                (
+                    "order",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="invoices",
+                        to="orders.archivedorder",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0012_archivedinvoice"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StatementReconciliation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "statement",
+                    models.FileField(db_index=True, upload_to="reconciliation/"),
+                ),
+                (
+                    "report",
+                    models.FileField(
+                        blank=True,
+                        db_index=True,
+                        null=True,
+                        upload_to="reconciliation/",
+                    ),
+                ),
+                ("counts", models.JSONField(default=dict)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
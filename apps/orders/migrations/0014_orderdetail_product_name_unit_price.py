@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:50
+
+from django.db import migrations, models
+from decimal import Decimal
+
+
+def copy_product_name_and_price(apps, schema_editor):
+    """The unit price the lines were ordered at, their subtotal per unit"""
+    OrderDetail = apps.get_model("orders", "OrderDetail")
+
+    batch = []
+    for detail in (
+        OrderDetail.objects.select_related("item_code")
+        .only("id", "quantity", "subtotal", "item_code__name")
+        .iterator(chunk_size=1000)
+    ):
+        detail.product_name = detail.item_code.name
+        if detail.quantity:
+            detail.unit_price = (detail.subtotal / detail.quantity).quantize(
+                Decimal("0.01")
+            )
+        batch.append(detail)
+        if len(batch) == 1000:
+            OrderDetail.objects.bulk_update(batch, ["product_name", "unit_price"])
+            batch = []
+    OrderDetail.objects.bulk_update(batch, ["product_name", "unit_price"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0013_statementreconciliation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="orderdetail",
+            name="product_name",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="orderdetail",
+            name="unit_price",
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=25),
+        ),
+        migrations.RunPython(copy_product_name_and_price, migrations.RunPython.noop),
+    ]
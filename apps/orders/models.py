@@ -1,8 +1,15 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.timezone import get_current_timezone, localdate, now
 from django.utils.translation import gettext_lazy as _
 from apps.inventory.models import Product
 from apps.profiles.models import Company
 import uuid
+from datetime import date
+from decimal import Decimal
 from django.contrib.auth import get_user_model
 from django_countries.fields import CountryField
 from utils.template_email import send_template_email
@@ -23,6 +30,13 @@ class Order(models.Model):
         ("FULFILLED", "FULFILLED"),
         ("CANCELLED", "CANCELLED"),
     )
+    # Statuses an order may move to from each status, see transition_to
+    TRANSITIONS = {
+        "PENDING": ("PARTIAL", "FULFILLED", "CANCELLED"),
+        "PARTIAL": ("FULFILLED", "CANCELLED"),
+        "FULFILLED": (),
+        "CANCELLED": (),
+    }
     CURRENCY = (
         ("GHC", "GHC ₵"),
         ("USD", "USD $"),
@@ -42,21 +56,382 @@ class Order(models.Model):
     status = models.CharField(max_length=10, choices=STATUS, default=STATUS[0][0])
     currency = models.CharField(max_length=50, choices=CURRENCY, default=CURRENCY[0][0])
     note = models.TextField(verbose_name=_("Note"), blank=True, null=True)
+    # Kept in step with the order details by update_totals
+    item_count = models.PositiveIntegerField(
+        default=0, help_text=_("Number of units across all order details")
+    )
+    subtotal = models.DecimalField(max_digits=25, decimal_places=2, default=0)
+    tax_total = models.DecimalField(max_digits=25, decimal_places=2, default=0)
+    grand_total = models.DecimalField(max_digits=25, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["placed_to", "status", "order_date"],
+                name="order_seller_status_date_idx",
+            ),
+            models.Index(
+                fields=["placed_by", "order_date"], name="order_buyer_date_idx"
+            ),
+        ]
+
+    def summary_snapshot(self):
+        """
+        The CompanyOrderSummary and SellerDailySales rows the order is counted
+        in, and its value
+        """
+        return {
+            "company": self.placed_to_id,
+            "status": self.status,
+            "currency": self.currency,
+            "date": localdate(self.order_date).isoformat(),
+            "grand_total": str(self.grand_total),
+        }
+
+    def transition_to(self, status):
+        """
+        Moves the order to status if the state machine allows it and records an
+        order.status_changed event, call inside the transaction that locked it
+        """
+        if status == self.status:
+            return
+        if status not in self.TRANSITIONS.get(self.status, ()):
+            raise ValidationError(
+                f"Order {self.id} cannot go from {self.status} to {status}"
+            )
+        previous = self.summary_snapshot()
+        self.status = status
+        self.save(update_fields=["status", "last_updated"])
+        if status == "CANCELLED":
+            # A PARTIAL order has confirmed its reservations, nothing was
+            # delivered once it is cancelled either
+            StockReservation.settle(
+                [self.id],
+                StockReservation.RELEASED,
+                states=(StockReservation.HELD, StockReservation.CONFIRMED),
+            )
+        else:
+            StockReservation.settle([self.id], StockReservation.CONFIRMED)
+        OutboxEvent.publish(
+            "order.status_changed",
+            order=self.id,
+            previous=previous,
+            current=self.summary_snapshot(),
+        )
+
+    def set_totals(self, details):
+        """Sets the totals from unsaved OrderDetail instances, before insert"""
+        self.item_count = sum(detail.quantity for detail in details)
+        self.subtotal = sum(
+            (Decimal(detail.subtotal) for detail in details), Decimal(0)
+        )
+        self.tax_total = sum((Decimal(detail.tax) for detail in details), Decimal(0))
+        self.grand_total = self.subtotal + self.tax_total
 
-    def send_order_request_by_email(self):
-        mail_context = {
+    def update_totals(self):
+        """
+        Recomputes the totals from the stored details, a change of value reaches
+        the seller summaries through an order.changed event. Call inside the
+        transaction changing the details
+        """
+        with transaction.atomic():
+            order = Order.objects.select_for_update().filter(pk=self.pk).first()
+            if order is None:
+                return
+            totals = order.details.aggregate(
+                item_count=Coalesce(Sum("quantity"), 0),
+                subtotal=Coalesce(Sum("subtotal"), Decimal(0)),
+                tax_total=Coalesce(Sum("tax"), Decimal(0)),
+            )
+            grand_total = totals["subtotal"] + totals["tax_total"]
+            Order.objects.filter(pk=self.pk).update(grand_total=grand_total, **totals)
+            if grand_total != order.grand_total:
+                previous = order.summary_snapshot()
+                order.grand_total = grand_total
+                OutboxEvent.publish(
+                    "order.changed",
+                    order=order.id,
+                    previous=previous,
+                    current=order.summary_snapshot(),
+                )
+        for field, value in totals.items():
+            setattr(self, field, value)
+        self.grand_total = grand_total
+
+    def order_request_mail_context(self):
+        return {
             "user": self.placed_to.company_name,
             "order": self.id,
             "order_object": self,
             "buyer": self.placed_by,
         }
+
+    def send_order_request_by_email(self, connection=None):
+        mail_context = self.order_request_mail_context()
         send_template_email(
             [self.placed_to.email],
             "mail/order_created_title.txt",
             "mail/order_created_body.html",
             mail_context,
             None,
+            connection=connection,
+        )
+
+
+class OutboxEvent(models.Model):
+    """
+    Side effects of order changes, written in the same transaction as the
+    change and carried out by the relay_outbox task
+    """
+
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["processed_at", "id"], name="outbox_pending_idx")
+        ]
+
+    @classmethod
+    def publish(cls, topic, **payload):
+        cls.publish_many(topic, [payload])
+
+    @classmethod
+    def publish_many(cls, topic, payloads):
+        from .tasks import relay_outbox
+
+        cls.objects.bulk_create(
+            [cls(topic=topic, payload=payload) for payload in payloads]
+        )
+        # The periodic relay picks the events up anyway, this only saves the wait
+        transaction.on_commit(relay_outbox.delay)
+
+
+class CompanyOrderSummary(models.Model):
+    """
+    Running number and value of a seller's orders per status and currency, so
+    dashboards read a handful of rows instead of aggregating every order
+    """
+
+    company = models.ForeignKey(
+        Company, related_name="order_summaries", on_delete=models.CASCADE
+    )
+    status = models.CharField(max_length=10, choices=Order.STATUS)
+    currency = models.CharField(max_length=50, choices=Order.CURRENCY)
+    order_count = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=25, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["company", "status", "currency"],
+                name="unique_company_order_summary",
+            )
+        ]
+
+    @classmethod
+    def add(cls, company_id, status, currency, count=0, total=0):
+        if not count and not total:
+            return
+        summary = cls.objects.filter(
+            company_id=company_id, status=status, currency=currency
         )
+        changes = {"order_count": F("order_count") + count, "total": F("total") + total}
+        if summary.update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    company_id=company_id,
+                    status=status,
+                    currency=currency,
+                    order_count=count,
+                    total=total,
+                )
+        except IntegrityError:
+            # Created by a concurrent order in the meantime
+            summary.update(**changes)
+
+    @classmethod
+    def add_snapshot(cls, snapshot, sign=1):
+        """Counts (or with sign=-1 uncounts) an Order.summary_snapshot()"""
+        cls.add(
+            snapshot["company"],
+            snapshot["status"],
+            snapshot["currency"],
+            count=sign,
+            total=sign * Decimal(snapshot["grand_total"]),
+        )
+
+
+class SellerDailySales(models.Model):
+    """
+    Number and value of a seller's orders placed on a day, per status and
+    currency. Kept up to date like CompanyOrderSummary, weeks and months are
+    summed from the days when read
+    """
+
+    company = models.ForeignKey(
+        Company, related_name="daily_sales", on_delete=models.CASCADE
+    )
+    date = models.DateField()
+    status = models.CharField(max_length=10, choices=Order.STATUS)
+    currency = models.CharField(max_length=50, choices=Order.CURRENCY)
+    order_count = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=25, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = "seller daily sales"
+        constraints = [
+            # Also the index for a company's rows over a range of dates
+            models.UniqueConstraint(
+                fields=["company", "date", "status", "currency"],
+                name="unique_seller_daily_sales",
+            )
+        ]
+
+    @classmethod
+    def add(cls, company_id, date, status, currency, count=0, total=0):
+        if not count and not total:
+            return
+        sales = cls.objects.filter(
+            company_id=company_id, date=date, status=status, currency=currency
+        )
+        changes = {"order_count": F("order_count") + count, "total": F("total") + total}
+        if sales.update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    company_id=company_id,
+                    date=date,
+                    status=status,
+                    currency=currency,
+                    order_count=count,
+                    total=total,
+                )
+        except IntegrityError:
+            sales.update(**changes)
+
+    @classmethod
+    def add_snapshot(cls, snapshot, sign=1):
+        if "date" not in snapshot:
+            # Recorded before the daily rollup existed, the backfill covers it
+            return
+        cls.add(
+            snapshot["company"],
+            snapshot["date"],
+            snapshot["status"],
+            snapshot["currency"],
+            count=sign,
+            total=sign * Decimal(snapshot["grand_total"]),
+        )
+
+    @classmethod
+    def rebuild(cls, company_ids):
+        """
+        Recomputes the rows of the given companies from their orders, live and
+        archived. Orders with outbox events still pending are counted as they
+        were before the first of them, the relay adds the rest when it applies
+        the events
+        """
+        company_ids = set(company_ids)
+        rows = {}
+
+        def count(company_id, date, status, currency, order_count, total):
+            key = (company_id, date, status, currency)
+            if key in rows:
+                rows[key].order_count += order_count
+                rows[key].total += total
+            else:
+                rows[key] = cls(
+                    company_id=company_id,
+                    date=date,
+                    status=status,
+                    currency=currency,
+                    order_count=order_count,
+                    total=total,
+                )
+
+        with transaction.atomic():
+            # Locked so the relay cannot apply them while the rows are replaced
+            pending = {}
+            for payload in (
+                OutboxEvent.objects.select_for_update()
+                .filter(processed_at__isnull=True)
+                .order_by("id")
+                .values_list("payload", flat=True)
+            ):
+                snapshots = [payload.get("previous"), payload.get("current")]
+                if any(
+                    snapshot and snapshot["company"] in company_ids
+                    for snapshot in snapshots
+                ):
+                    pending.setdefault(payload["order"], payload.get("previous"))
+
+            for model in (Order, ArchivedOrder):
+                sales = (
+                    model.objects.filter(placed_to__in=company_ids)
+                    .exclude(pk__in=pending)
+                    .values("status", "currency", company_id=F("placed_to"))
+                    .annotate(
+                        # The day in local time, as the live updates count it
+                        date=TruncDate("order_date", tzinfo=get_current_timezone()),
+                        order_count=Count("pk"),
+                        total=Sum("grand_total"),
+                    )
+                    .order_by()
+                )
+                for row in sales:
+                    count(**row)
+            for snapshot in pending.values():
+                if (
+                    snapshot
+                    and "date" in snapshot
+                    and snapshot["company"] in company_ids
+                ):
+                    count(
+                        snapshot["company"],
+                        date.fromisoformat(snapshot["date"]),
+                        snapshot["status"],
+                        snapshot["currency"],
+                        1,
+                        Decimal(snapshot["grand_total"]),
+                    )
+
+            cls.objects.filter(company__in=company_ids).delete()
+            return len(cls.objects.bulk_create(rows.values()))
+
+
+class SellerStatement(models.Model):
+    """
+    What a seller invoiced in a month, per invoice currency in by_currency and
+    converted to currency in the totals, see apps.orders.statements
+    """
+
+    company = models.ForeignKey(
+        Company, related_name="statements", on_delete=models.CASCADE
+    )
+    period_start = models.DateField(help_text="First day of the month")
+    currency = models.CharField(max_length=50, choices=Order.CURRENCY)
+    invoice_count = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=25, decimal_places=2, default=0)
+    tax_total = models.DecimalField(max_digits=25, decimal_places=2, default=0)
+    shipping = models.DecimalField(max_digits=25, decimal_places=2, default=0)
+    by_currency = models.JSONField(default=dict)
+    # The rates the totals were converted with
+    rates = models.JSONField(default=dict)
+    generated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["company", "period_start", "currency"],
+                name="unique_seller_statement",
+            )
+        ]
 
 
 class OrderDetail(models.Model):
@@ -68,18 +443,14 @@ class OrderDetail(models.Model):
         default=0,
     )
     item_code = models.ForeignKey(Product, on_delete=models.CASCADE, default=uuid.uuid4)
+    # Copied from the product when the order is placed, so the order and its
+    # invoices keep reading the same after the product is renamed or repriced
+    product_name = models.CharField(max_length=255, blank=True)
+    unit_price = models.DecimalField(max_digits=25, decimal_places=2, default=0.00)
     quantity = models.IntegerField(default=0)
     subtotal = models.DecimalField(max_digits=25, decimal_places=2, default=0.00)
     tax = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
 
-    @property
-    def product_name(self):
-        return self.item_code.name
-
-    # @property
-    # def unit_price(self):
-    #     return self.item_code.price
-
 
 class Invoice(models.Model):
     INVOICE_TYPES = (
@@ -144,24 +515,93 @@ class Invoice(models.Model):
     shipping_city = models.CharField(max_length=200, verbose_name=_("City"), blank=True)
     shipping_country = CountryField(verbose_name=_("Country"), default="PL", blank=True)
     require_shipment = models.BooleanField(default=False, db_index=True)
+    # Numbered per issuer and year by InvoiceSequence, empty on old invoices
+    number_year = models.PositiveSmallIntegerField(blank=True, null=True)
+    sequence_number = models.PositiveIntegerField(blank=True, null=True)
+    # Rendered by the render_invoice_pdf task, pdf_hash identifies the content
+    # it was rendered from
+    pdf = models.FileField(upload_to="invoices/", blank=True, null=True, db_index=True)
+    pdf_hash = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["issuer", "number_year", "sequence_number"],
+                name="unique_invoice_number",
+            )
+        ]
+        indexes = [
+            # Monthly statements sum a seller's invoices by issue date
+            models.Index(fields=["issuer", "issued"], name="invoice_issuer_issued_idx")
+        ]
 
-    def send_invoice_by_email(self):
-        mail_context = {
+    @property
+    def invoice_number(self):
+        if self.sequence_number is None:
+            return str(self.id)
+        return f"{self.number_year}-{self.sequence_number:06d}"
+
+    def invoice_mail_context(self):
+        return {
             "user": self.buyer,
             "invoice_type": self.type,
-            "invoice_number": self.id,
+            "invoice_number": self.invoice_number,
             "order": self.order.id,
             "order_object": self.order,
         }
+
+    def send_invoice_by_email(self, connection=None):
+        mail_context = self.invoice_mail_context()
         send_template_email(
             [self.buyer.email],
             "mail/invoice_created_title.txt",
             "mail/invoice_created_body.html",
             mail_context,
             None,
+            connection=connection,
         )
 
 
+class InvoiceSequence(models.Model):
+    """
+    Next invoice number of an issuer for a year. Numbers are taken with a single
+    UPDATE in the transaction creating the invoices, so only invoices of the
+    same issuer wait for each other and a rollback gives the numbers back
+    """
+
+    issuer = models.ForeignKey(
+        Company, related_name="invoice_sequences", on_delete=models.CASCADE
+    )
+    year = models.PositiveSmallIntegerField()
+    next_number = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["issuer", "year"], name="unique_invoice_sequence"
+            )
+        ]
+
+    @classmethod
+    def allocate(cls, issuer_id, year, count=1):
+        """
+        Reserves count consecutive numbers, returned as a range. Must run inside
+        the transaction that uses them, the row stays locked until it ends
+        """
+        sequence = cls.objects.filter(issuer_id=issuer_id, year=year)
+        if not sequence.update(next_number=F("next_number") + count):
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        issuer_id=issuer_id, year=year, next_number=1 + count
+                    )
+            except IntegrityError:
+                # Created by a concurrent transaction in the meantime
+                sequence.update(next_number=F("next_number") + count)
+        next_number = sequence.values_list("next_number", flat=True).get()
+        return range(next_number - count, next_number)
+
+
 class Transaction(models.Model):
     transactions_id = models.UUIDField(
         primary_key=True, default=uuid.uuid4, editable=False
@@ -176,7 +616,8 @@ class Transaction(models.Model):
         on_delete=models.PROTECT,
     )
     key = models.CharField(max_length=512)
-    reference = models.CharField(max_length=100)
+    # Payment callbacks look transactions up by reference
+    reference = models.CharField(max_length=100, db_index=True)
     amount = models.PositiveIntegerField()
     method = models.CharField(max_length=100)
     status = models.CharField(max_length=100)
@@ -184,3 +625,200 @@ class Transaction(models.Model):
 
     def __str__(self):
         return str(self.transactions_id) if self.transactions_id else ""
+
+
+class WebhookEvent(models.Model):
+    """
+    Payment provider callbacks as received, a provider retrying a delivery hits
+    the unique constraint and is dropped. Applied by process_webhook_events
+    """
+
+    provider = models.CharField(max_length=50)
+    event_id = models.CharField(max_length=255)
+    body = models.TextField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    result = models.CharField(max_length=50, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["provider", "event_id"], name="unique_webhook_event"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["processed_at", "id"], name="webhook_pending_idx")
+        ]
+
+
+class StatementReconciliation(models.Model):
+    """
+    A settlement statement reconciled by reconcile_statement and the report of
+    its exceptions. Both files are private, only staff can download them
+    """
+
+    statement = models.FileField(upload_to="reconciliation/", db_index=True)
+    report = models.FileField(
+        upload_to="reconciliation/", blank=True, null=True, db_index=True
+    )
+    counts = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class ArchivedOrder(models.Model):
+    """
+    An order moved out of the live tables by apps.orders.archive, with its
+    details, invoices and transactions as the order-detail endpoint returned
+    them. The columns the order lists filter and sort on are kept as fields
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    placed_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    placed_to = models.ForeignKey(Company, on_delete=models.CASCADE)
+    order_date = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=Order.STATUS)
+    currency = models.CharField(max_length=50, choices=Order.CURRENCY)
+    grand_total = models.DecimalField(max_digits=25, decimal_places=2, default=0)
+    document = models.JSONField(encoder=DjangoJSONEncoder)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["placed_to", "status", "order_date"],
+                name="archived_order_seller_idx",
+            ),
+            models.Index(
+                fields=["placed_by", "order_date"], name="archived_order_buyer_idx"
+            ),
+        ]
+
+
+class ArchivedInvoice(models.Model):
+    """
+    An invoice of an ArchivedOrder, kept so its PDF can still be downloaded.
+    The PDF is rendered when the order is archived if it was not already
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(
+        ArchivedOrder, related_name="invoices", on_delete=models.CASCADE
+    )
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE)
+    issuer = models.ForeignKey(Company, on_delete=models.CASCADE)
+    number = models.CharField(max_length=50)
+    pdf = models.FileField(upload_to="invoices/", db_index=True)
+
+
+class StockReservation(models.Model):
+    """
+    Units of a product taken from its available_quantity for an order. HELD
+    while the order is pending, CONFIRMED once it moves on and RELEASED (the
+    units are given back) when it is cancelled. Orders left pending past
+    expires_at are cancelled by the sweep
+    """
+
+    HELD = "HELD"
+    CONFIRMED = "CONFIRMED"
+    RELEASED = "RELEASED"
+    STATUS = ((HELD, HELD), (CONFIRMED, CONFIRMED), (RELEASED, RELEASED))
+
+    order = models.ForeignKey(
+        Order, related_name="stock_reservations", on_delete=models.CASCADE
+    )
+    product = models.ForeignKey(
+        Product, related_name="stock_reservations", on_delete=models.CASCADE
+    )
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS, default=HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    settled_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["status", "expires_at"], name="stock_reservation_expiry_idx"
+            )
+        ]
+
+    @classmethod
+    def reserve(cls, order_lines, expires_at):
+        """
+        Takes the stock of (order, product, quantity) lines and records their
+        reservations, products without tracked stock are skipped. Raises
+        ValidationError when a product is short, call inside the transaction
+        creating the orders so the units already taken are given back
+        """
+        reservations = {}
+        for order, product, quantity in order_lines:
+            if product.available_quantity is not None:
+                key = (order.id, product.id)
+                reservations[key] = reservations.get(key, 0) + quantity
+        per_product = {}
+        for (_order_id, product_id), quantity in reservations.items():
+            per_product[product_id] = per_product.get(product_id, 0) + quantity
+        # Products in id order, so concurrent carts never wait on each other in
+        # a cycle
+        for product_id in sorted(per_product):
+            if not Product.take_stock(product_id, per_product[product_id]):
+                raise ValidationError(f"Not enough stock of product {product_id}")
+        cls.objects.bulk_create(
+            cls(
+                order_id=order_id,
+                product_id=product_id,
+                quantity=quantity,
+                expires_at=expires_at,
+            )
+            for (order_id, product_id), quantity in reservations.items()
+        )
+
+    @classmethod
+    def settle(cls, order_ids, status, states=(HELD,)):
+        """Confirms or releases the reservations of the orders in states"""
+        return cls._settle(
+            cls.objects.select_for_update().filter(
+                order__in=order_ids, status__in=states
+            ),
+            status,
+        )
+
+    @classmethod
+    def cancel_expired(cls, limit):
+        """
+        Cancels up to limit pending orders whose reservations are past their
+        expiry, which gives their stock back. Returns the number cancelled
+        """
+        # limit counts orders, not their reservations
+        order_ids = list(
+            cls.objects.filter(
+                status=cls.HELD, expires_at__lt=now(), order__status="PENDING"
+            )
+            .order_by("order_id")
+            .values_list("order_id", flat=True)
+            .distinct()[:limit]
+        )
+        orders = list(
+            Order.objects.select_for_update(skip_locked=True).filter(
+                id__in=order_ids, status="PENDING"
+            )
+        )
+        for order in orders:
+            order.transition_to("CANCELLED")
+        return len(orders)
+
+    @classmethod
+    def _settle(cls, held, status):
+        reservations = list(held.values_list("id", "product_id", "quantity"))
+        if not reservations:
+            return 0
+        if status == cls.RELEASED:
+            returned = {}
+            for _id, product_id, quantity in reservations:
+                returned[product_id] = returned.get(product_id, 0) + quantity
+            for product_id in sorted(returned):
+                Product.return_stock(product_id, returned[product_id])
+        cls.objects.filter(id__in=[row[0] for row in reservations]).update(
+            status=status, settled_at=now()
+        )
+        return len(reservations)
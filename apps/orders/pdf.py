@@ -0,0 +1,168 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from decimal import Decimal
+from .models import Invoice
+from utils.pdf import PDFDocument, A4_HEIGHT
+import hashlib
+import json
+
+# Part of the content hash, bump it when the layout below changes so stored
+# PDFs are rendered again
+INVOICE_PDF_LAYOUT = 2
+
+LEFT = 50
+RIGHT = 545
+TOP = A4_HEIGHT - 60
+BOTTOM = 70
+LINE_HEIGHT = 16
+# x of the right edge of the quantity, unit cost, tax and subtotal columns
+COLUMNS = (330, 400, 470, RIGHT)
+
+
+def address(*parts):
+    return [str(part) for part in parts if part]
+
+
+def invoice_pdf_context(invoice, details):
+    """
+    Everything printed on the invoice as plain JSON data, rendering and the
+    content hash both work from this
+    """
+    order = invoice.order
+    shipping_price = invoice.final_shipping_price or invoice.estimated_shipping_price
+    total = invoice.total
+    if total is None:
+        total = order.grand_total + (shipping_price or Decimal(0))
+    return {
+        "layout": INVOICE_PDF_LAYOUT,
+        "site": settings.SITE_NAME,
+        "number": invoice.invoice_number,
+        "type": str(invoice.get_type_display()),
+        "issued": invoice.issued.isoformat(),
+        "order": order.id,
+        "currency": invoice.currency,
+        "seller": address(invoice.issuer.company_name, invoice.issuer.email),
+        "buyer": address(
+            invoice.buyer_name or invoice.buyer.name,
+            invoice.buyer_street,
+            invoice.buyer_city,
+            invoice.buyer_zipcode or invoice.buyer_postal_code,
+            invoice.buyer_region,
+            invoice.buyer_country.name if invoice.buyer_country else "",
+        ),
+        "shipping": address(
+            invoice.shipping_name,
+            invoice.shipping_street,
+            invoice.shipping_city,
+            invoice.shipping_zipcode or invoice.shipping_postal_code,
+            invoice.shipping_region,
+            invoice.shipping_country.name if invoice.shipping_country else "",
+        )
+        if invoice.require_shipment
+        else [],
+        "lines": [
+            [
+                detail.product_name,
+                detail.quantity,
+                str(detail.unit_price),
+                str(detail.tax),
+                str(detail.subtotal),
+            ]
+            for detail in details
+        ],
+        "subtotal": str(order.subtotal),
+        "tax_total": str(invoice.tax_total or order.tax_total),
+        "shipping_price": str(shipping_price) if shipping_price is not None else "",
+        "total": str(total),
+    }
+
+
+def load_invoice_pdf_context(invoice_id):
+    """(invoice, context) in two queries, (None, None) if it does not exist"""
+    invoice = (
+        Invoice.objects.select_related("order", "issuer", "buyer")
+        .filter(id=invoice_id)
+        .first()
+    )
+    if invoice is None:
+        return None, None
+    details = invoice.order.details.order_by("id")
+    return invoice, invoice_pdf_context(invoice, details)
+
+
+def invoice_pdf_hash(context):
+    return hashlib.sha256(
+        json.dumps(context, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+
+
+def invoice_pdf_bytes(context):
+    """PDF bytes of an invoice_pdf_context, needs no database access"""
+    document = PDFDocument()
+    y = TOP
+    document.text(LEFT, y, context["site"], size=18, bold=True)
+    document.text_right(RIGHT, y, f"{context['type']} {context['number']}", 14, True)
+    y -= LINE_HEIGHT * 1.5
+    document.text_right(RIGHT, y, f"Issued {context['issued']}")
+    y -= LINE_HEIGHT
+    document.text_right(RIGHT, y, f"Order {context['order']}")
+    y -= LINE_HEIGHT * 2
+
+    blocks = [("Seller", context["seller"]), ("Bill to", context["buyer"])]
+    if context["shipping"]:
+        blocks.append(("Ship to", context["shipping"]))
+    block_top = y
+    for index, (title, lines) in enumerate(blocks):
+        x = LEFT + index * 170
+        y = block_top
+        document.text(x, y, title, bold=True)
+        for line in lines:
+            y -= LINE_HEIGHT
+            document.text(x, y, line, max_width=160)
+    y = block_top - LINE_HEIGHT * (max(len(lines) for _title, lines in blocks) + 3)
+
+    def header(y):
+        document.text(LEFT, y, "Product", bold=True)
+        for x, title in zip(COLUMNS, ("Qty", "Unit", "Tax", "Amount")):
+            document.text_right(x, y, title, bold=True)
+        document.line(LEFT, y - 5, RIGHT, y - 5)
+        return y - LINE_HEIGHT * 1.25
+
+    y = header(y)
+    for name, *amounts in context["lines"]:
+        if y < BOTTOM + LINE_HEIGHT * 5:
+            document.add_page()
+            y = header(TOP)
+        document.text(LEFT, y, name, max_width=COLUMNS[0] - LEFT - 50)
+        for x, amount in zip(COLUMNS, amounts):
+            document.text_right(x, y, amount)
+        y -= LINE_HEIGHT
+    document.line(LEFT, y + 5, RIGHT, y + 5)
+
+    totals = [("Subtotal", context["subtotal"]), ("Tax", context["tax_total"])]
+    if context["shipping_price"]:
+        totals.append(("Shipping", context["shipping_price"]))
+    for label, amount in totals:
+        y -= LINE_HEIGHT
+        document.text_right(COLUMNS[2], y, label)
+        document.text_right(RIGHT, y, amount)
+    y -= LINE_HEIGHT * 1.25
+    document.text_right(COLUMNS[2], y, f"Total {context['currency']}", bold=True)
+    document.text_right(RIGHT, y, context["total"], bold=True)
+    return document.render()
+
+
+def store_invoice_pdf(invoice, content_hash, pdf_bytes):
+    """
+    Saves the PDF and points the invoice at it, unless another render stored one
+    in the meantime. The file replaced (or the one not needed) is released
+    """
+    name = default_storage.save("invoices/invoice.pdf", ContentFile(pdf_bytes))
+    updated = Invoice.objects.filter(pk=invoice.pk, pdf_hash=invoice.pdf_hash).update(
+        pdf=name, pdf_hash=content_hash
+    )
+    stale = invoice.pdf.name if updated else name
+    if stale:
+        default_storage.delete(stale)
+    return name
@@ -0,0 +1,198 @@
+from django.db import transaction
+from decimal import Decimal, InvalidOperation
+from xml.etree.ElementTree import iterparse
+from .models import Invoice, Transaction
+import csv
+import io
+import time
+
+# Statement columns (or XML child elements) accepted for each field, compared
+# lower cased with spaces and dashes as underscores
+COLUMNS = {
+    "reference": ("reference", "ref", "transaction_reference", "payment_reference"),
+    "amount": ("amount", "settled_amount", "value"),
+    "status": ("status", "state", "settlement_status"),
+    "invoice": ("invoice", "invoice_number", "invoice_no"),
+}
+REPORT_COLUMNS = ["line", "reference", "amount", "status", "reason", "detail"]
+# Takes the place of a matched reference's entry in the index, so a statement
+# of any length needs no memory beyond the index to spot duplicate lines
+MATCHED = None
+
+
+def normalise(record):
+    keys = {
+        key.strip().lower().replace(" ", "_").replace("-", "_"): value
+        for key, value in record.items()
+        if key
+    }
+    line = {}
+    for field, names in COLUMNS.items():
+        value = next((keys[name] for name in names if keys.get(name)), "")
+        line[field] = (value or "").strip()
+    return line
+
+
+def iter_csv(statement):
+    """Lines of a CSV statement, statement is a binary file"""
+    text = io.TextIOWrapper(statement, encoding="utf-8-sig", newline="")
+    for record in csv.DictReader(text):
+        yield normalise(record)
+
+
+def iter_xml(statement):
+    """
+    Lines of an XML statement, every child of the root element is a line and
+    its children the fields. Elements are cleared once read so memory stays flat
+    """
+    depth = 0
+    root = None
+    for event, element in iterparse(statement, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if root is None:
+                root = element
+            continue
+        depth -= 1
+        if depth == 1:
+            yield normalise(
+                {child.tag.rsplit("}", 1)[-1]: child.text for child in element}
+            )
+            root.clear()
+
+
+def parse_invoice_number(value):
+    """(year, sequence_number) of an Invoice.invoice_number, None if it is not one"""
+    year, _dash, number = value.partition("-")
+    if year.isdigit() and number.isdigit():
+        return int(year), int(number)
+    return None
+
+
+def build_index():
+    """
+    reference: (pk, amount, status, seller, invoice) for every transaction, read
+    with one streamed query
+    """
+    rows = (
+        Transaction.objects.values_list(
+            "reference", "pk", "amount", "status", "seller", "invoice"
+        )
+        .order_by()
+        .iterator(chunk_size=10000)
+    )
+    return {reference: entry for reference, *entry in rows}
+
+
+class Reconciliation:
+    """
+    Matches the lines of a settlement statement to Transactions by reference.
+    Matched transactions get the statement status and, when the line names one,
+    their invoice. Lines that cannot be applied are written to the report.
+    Updates are written every batch_size matched lines
+    """
+
+    def __init__(self, report, batch_size=5000):
+        self.report = csv.writer(report)
+        self.report.writerow(REPORT_COLUMNS)
+        self.batch_size = batch_size
+        self.index = build_index()
+        self.batch = []
+        self.counts = {"lines": 0, "matched": 0, "updated": 0, "exceptions": 0}
+
+    def exception(self, number, line, reason, detail=""):
+        self.counts["exceptions"] += 1
+        self.report.writerow(
+            [number, line["reference"], line["amount"], line["status"], reason, detail]
+        )
+
+    def add(self, number, line):
+        self.counts["lines"] += 1
+        reference = line["reference"]
+        if not reference or reference not in self.index:
+            return self.exception(number, line, "unknown_reference")
+        entry = self.index[reference]
+        if entry is MATCHED:
+            return self.exception(number, line, "duplicate_line")
+        pk, amount, status, seller, invoice = entry
+        try:
+            line_amount = Decimal(line["amount"].replace(",", ""))
+        except InvalidOperation:
+            return self.exception(number, line, "invalid_amount")
+        if line_amount != amount:
+            return self.exception(number, line, "amount_mismatch", f"expected {amount}")
+        self.index[reference] = MATCHED
+        self.counts["matched"] += 1
+        self.batch.append((number, line, pk, status, seller, invoice))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def invoice_ids(self):
+        """(seller, year, number): invoice id for the invoices named in the batch"""
+        wanted = set()
+        for _number, line, _pk, _status, seller, _invoice in self.batch:
+            invoice_number = parse_invoice_number(line["invoice"])
+            if invoice_number:
+                wanted.add((seller, *invoice_number))
+        if not wanted:
+            return {}
+        invoices = Invoice.objects.filter(
+            issuer__in={key[0] for key in wanted},
+            number_year__in={key[1] for key in wanted},
+            sequence_number__in={key[2] for key in wanted},
+        ).values_list("issuer", "number_year", "sequence_number", "id")
+        return {
+            (issuer, year, number): invoice_id
+            for issuer, year, number, invoice_id in invoices
+            if (issuer, year, number) in wanted
+        }
+
+    def flush(self):
+        invoices = self.invoice_ids()
+        # Statement lines nearly all carry the same status, so grouping by the
+        # new values turns a batch into a handful of UPDATE ... WHERE pk IN
+        changes = {}
+        for number, line, pk, status, seller, invoice in self.batch:
+            new_status = line["status"][:100] or status
+            new_invoice = invoice
+            if line["invoice"]:
+                invoice_number = parse_invoice_number(line["invoice"])
+                found = invoice_number and invoices.get((seller, *invoice_number))
+                if not found:
+                    self.exception(number, line, "unknown_invoice", line["invoice"])
+                elif invoice and invoice != found:
+                    self.exception(
+                        number, line, "invoice_conflict", f"linked to {invoice}"
+                    )
+                else:
+                    new_invoice = found
+            if (new_status, new_invoice) != (status, invoice):
+                changes.setdefault((new_status, new_invoice), []).append(pk)
+        with transaction.atomic():
+            for (new_status, new_invoice), pks in changes.items():
+                Transaction.objects.filter(pk__in=pks).update(
+                    status=new_status, invoice=new_invoice
+                )
+                self.counts["updated"] += len(pks)
+        self.batch = []
+
+
+def statement_format(name):
+    return "xml" if name.lower().endswith(".xml") else "csv"
+
+
+def reconcile(statement, report, file_format="csv", batch_size=5000):
+    """
+    Reconciles a statement (binary file, CSV or XML) and writes the exceptions
+    as CSV to report (text file), returns the counts of the run
+    """
+    started = time.monotonic()
+    reconciliation = Reconciliation(report, batch_size=batch_size)
+    lines = iter_xml(statement) if file_format == "xml" else iter_csv(statement)
+    # CSV line numbers count the header, XML ones the statement entries
+    first = 1 if file_format == "xml" else 2
+    for number, line in enumerate(lines, start=first):
+        reconciliation.add(number, line)
+    if reconciliation.batch:
+        reconciliation.flush()
+    return {**reconciliation.counts, "seconds": round(time.monotonic() - started, 2)}
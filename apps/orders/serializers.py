@@ -1,11 +1,13 @@
-from .models import Order, OrderDetail, Invoice
+from .models import Order, OrderDetail, Invoice, Transaction
 from rest_framework import serializers
+from apps.files.images import thumbnail_url
 
 
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = "__all__"
+        read_only_fields = ["item_count", "subtotal", "tax_total", "grand_total"]
 
 
 class OrderDetailSerializer(serializers.ModelSerializer):
@@ -15,6 +17,69 @@ class OrderDetailSerializer(serializers.ModelSerializer):
 
 
 class InvoiceSerializer(serializers.ModelSerializer):
+    invoice_number = serializers.CharField(read_only=True)
+
     class Meta:
         model = Invoice
         fields = "__all__"
+        read_only_fields = ["number_year", "sequence_number", "pdf", "pdf_hash"]
+
+
+class TransactionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Transaction
+        # key is the payment provider secret for the transaction
+        exclude = ["key"]
+
+
+class InvoiceDetailSerializer(serializers.ModelSerializer):
+    transactions = TransactionSerializer(many=True, read_only=True)
+    invoice_number = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Invoice
+        exclude = ["pdf", "pdf_hash"]
+
+
+class OrderLineSerializer(serializers.ModelSerializer):
+    # The price the line was ordered at, subtotal is quantity units of it
+    unit_cost = serializers.DecimalField(
+        source="unit_price", max_digits=25, decimal_places=2, read_only=True
+    )
+    thumbnail = serializers.SerializerMethodField()
+
+    class Meta:
+        model = OrderDetail
+        fields = "__all__"
+
+    def get_thumbnail(self, obj):
+        # images are prefetched, .first() would query again
+        images = obj.item_code.images.all()
+        if not images:
+            return ""
+        return thumbnail_url(images[0].image, images[0].variants)
+
+
+class OrderDetailedSerializer(serializers.ModelSerializer):
+    """
+    An order with its lines, invoices and their transactions, expects the
+    related objects prefetched as in views.get_order_detail
+    """
+
+    details = OrderLineSerializer(many=True, read_only=True)
+    invoices = InvoiceDetailSerializer(source="invoice_set", many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = "__all__"
+
+
+class ArchivedOrderSerializer(serializers.BaseSerializer):
+    """Archived orders in the shape OrderSerializer gives live ones"""
+
+    def to_representation(self, instance):
+        return {
+            key: value
+            for key, value in instance.document.items()
+            if key not in ("details", "invoices")
+        }
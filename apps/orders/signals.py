@@ -0,0 +1,53 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+import threading
+from apps.profiles.models import Company
+from .models import Order, OrderDetail, OutboxEvent, StockReservation
+
+# Orders and companies whose delete is under way in this thread, between their
+# pre_delete and post_delete. A delete cascading from a user or company reaches
+# the details first, their totals go with the order's snapshot instead, and the
+# summaries of a deleted company go with it
+_deleting = threading.local()
+
+
+def deleting(model):
+    if not hasattr(_deleting, "ids"):
+        _deleting.ids = {Order: set(), Company: set()}
+    return _deleting.ids[model]
+
+
+@receiver(pre_delete, sender=Order)
+@receiver(pre_delete, sender=Company)
+def mark_deleting(sender, instance, **kwargs):
+    deleting(sender).add(instance.pk)
+
+
+@receiver(post_delete, sender=Company)
+def unmark_deleting(sender, instance, **kwargs):
+    deleting(sender).discard(instance.pk)
+
+
+@receiver(post_save, sender=OrderDetail)
+@receiver(post_delete, sender=OrderDetail)
+def update_order_totals(sender, instance, **kwargs):
+    if instance.order_id in deleting(Order):
+        # The whole order is being deleted, see remove_order_from_summary
+        return
+    # bulk_create in create_order skips this, the totals are set before insert
+    Order(pk=instance.order_id).update_totals()
+
+
+@receiver(post_delete, sender=Order)
+def remove_order_from_summary(sender, instance, **kwargs):
+    deleting(Order).discard(instance.pk)
+    if instance.placed_to_id in deleting(Company):
+        return
+    OutboxEvent.publish(
+        "order.deleted", order=instance.pk, previous=instance.summary_snapshot()
+    )
+
+
+@receiver(pre_delete, sender=Order)
+def release_order_stock(sender, instance, **kwargs):
+    StockReservation.settle([instance.id], StockReservation.RELEASED)
@@ -0,0 +1,141 @@
+"""
+Monthly seller statements: the invoices a seller issued in a month totalled per
+currency and converted into one reporting currency.
+
+Grouping and summing is done by the database, one query per chunk of sellers,
+so no invoice is loaded into Python. The sums are then handled as integer minor
+units and converted with exact decimal rates, so the result does not depend on
+float rounding
+"""
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_EVEN
+from apps.inventory.models import CurrencyRates
+from .models import Invoice, SellerStatement
+
+# Codes CurrencyRates knows the order currencies by
+RATE_CODES = {"GHC": "GHS", "CFA": "XOF", "NGN": "NGN", "EUR": "EUR", "USD": "USD"}
+AMOUNTS = ("total", "tax_total", "shipping")
+
+
+def month_range(day):
+    """First and last day of the month of day"""
+    start = day.replace(day=1)
+    next_month = (start + timedelta(days=32)).replace(day=1)
+    return start, next_month - timedelta(days=1)
+
+
+def load_rates():
+    """
+    Rates of the order currencies against the CurrencyRates base as strings, read
+    once per run and handed to every worker so all statements use the same ones
+    """
+    rates = CurrencyRates.objects.first()
+    if rates is None:
+        raise ValueError("No currency rates stored")
+    values = {
+        currency: getattr(rates, code.lower()) for currency, code in RATE_CODES.items()
+    }
+    missing = [currency for currency, rate in values.items() if not rate]
+    if missing:
+        raise ValueError(f"No currency rate for {', '.join(missing)}")
+    return {currency: str(rate) for currency, rate in values.items()}
+
+
+def to_minor(amount):
+    return int((amount or 0) * 100)
+
+
+def from_minor(minor):
+    return Decimal(minor).scaleb(-2)
+
+
+def convert(minor, currency, to_currency, rates):
+    if currency == to_currency:
+        return minor
+    rate = Decimal(rates[to_currency]) / Decimal(rates[currency])
+    return int((minor * rate).to_integral_value(ROUND_HALF_EVEN))
+
+
+def invoice_sums(company_ids, start, end):
+    """Count and sums of the invoices per (issuer, currency), one query"""
+    money = DecimalField(max_digits=25, decimal_places=2)
+    shipping = Coalesce(
+        "final_shipping_price",
+        "estimated_shipping_price",
+        Value(Decimal(0)),
+        output_field=money,
+    )
+    return (
+        Invoice.objects.filter(issuer__in=company_ids, issued__range=(start, end))
+        .values("issuer", "currency")
+        .annotate(
+            invoice_count=Count("id"),
+            # Invoices without stored totals are worth their order, as printed
+            total=Sum(
+                Coalesce(
+                    "total", F("order__grand_total") + shipping, output_field=money
+                )
+            ),
+            tax_total=Sum(
+                Coalesce("tax_total", "order__tax_total", output_field=money)
+            ),
+            shipping=Sum(shipping),
+        )
+        .order_by()
+    )
+
+
+def generate_statements(company_ids, period_start, currency, rates):
+    """
+    Writes the SellerStatement of each company for the month of period_start,
+    replacing earlier runs. Returns the number written
+    """
+    start, end = month_range(period_start)
+    statements = {}
+    totals = {}
+    for row in invoice_sums(company_ids, start, end):
+        company_id = row["issuer"]
+        if company_id not in statements:
+            statements[company_id] = SellerStatement(
+                company_id=company_id,
+                period_start=start,
+                currency=currency,
+                invoice_count=0,
+                by_currency={},
+                rates=rates,
+            )
+            totals[company_id] = dict.fromkeys(AMOUNTS, 0)
+        statement = statements[company_id]
+        minor = {amount: to_minor(row[amount]) for amount in AMOUNTS}
+        statement.invoice_count += row["invoice_count"]
+        statement.by_currency[row["currency"]] = {
+            "invoice_count": row["invoice_count"],
+            **{amount: str(from_minor(value)) for amount, value in minor.items()},
+        }
+        for amount, value in minor.items():
+            totals[company_id][amount] += convert(
+                value, row["currency"], currency, rates
+            )
+    for company_id, statement in statements.items():
+        for amount, value in totals[company_id].items():
+            setattr(statement, amount, from_minor(value))
+    with transaction.atomic():
+        SellerStatement.objects.filter(
+            company__in=company_ids, period_start=start, currency=currency
+        ).delete()
+        SellerStatement.objects.bulk_create(statements.values())
+    return len(statements)
+
+
+def statement_companies(period_start):
+    """Ids of the sellers that issued invoices in the month of period_start"""
+    return list(
+        Invoice.objects.filter(issued__range=month_range(period_start))
+        .order_by("issuer")
+        .values_list("issuer", flat=True)
+        .distinct()
+    )
@@ -0,0 +1,486 @@
+from celery import group, shared_task
+from celery.utils.time import get_exponential_backoff_interval
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import localdate, now
+from datetime import date, timedelta
+from decimal import Decimal
+from functools import partial
+from smtplib import SMTPException
+import io
+import json
+import posixpath
+import tempfile
+from utils.template_email import (
+    get_pooled_connection,
+    close_pooled_connection,
+    send_template_email_batch,
+)
+from .models import (
+    Order,
+    Invoice,
+    OutboxEvent,
+    CompanyOrderSummary,
+    SellerDailySales,
+    StatementReconciliation,
+    StockReservation,
+    Transaction,
+    WebhookEvent,
+)
+from .reconciliation import reconcile, statement_format
+from .statements import generate_statements, load_rates, statement_companies
+from .archive import archive_orders
+from .webhooks import is_status_transition, status_rank
+from apps.inventory.archive import archive_product_views
+from apps.profiles.models import Company
+from utils.archive import run_in_batches
+from .pdf import (
+    invoice_pdf_bytes,
+    invoice_pdf_hash,
+    load_invoice_pdf_context,
+    store_invoice_pdf,
+)
+
+RETRY_OPTIONS = {
+    "autoretry_for": (SMTPException, OSError),
+    "retry_backoff": True,
+    "retry_backoff_max": 600,
+    "retry_jitter": True,
+    "max_retries": 5,
+    "ignore_result": True,
+}
+
+
+def retry_failed_recipients(task, failed, **kwargs):
+    """
+    Queues task again for the recipients (or orders) in failed only, so those
+    who already got their e-mail do not get it twice
+    """
+    # The connection may be the problem, the retry opens a fresh one
+    close_pooled_connection()
+    raise task.retry(
+        args=(),
+        kwargs={**kwargs, "only": sorted(set(failed))},
+        exc=SMTPException(f"{len(failed)} notification e-mails could not be sent"),
+        countdown=get_exponential_backoff_interval(
+            factor=1,
+            retries=task.request.retries,
+            maximum=RETRY_OPTIONS["retry_backoff_max"],
+            full_jitter=True,
+        ),
+    )
+
+
+def send_coalesced(groups, single_templates, multiple_templates, single, multiple):
+    """
+    Sends one e-mail per recipient in groups ({email: [objects]}), using
+    single(object) or multiple(objects) to build the template context. Returns
+    the recipients whose e-mail could not be sent
+    """
+    connection = get_pooled_connection()
+    reports = [
+        send_template_email_batch(
+            [
+                ([email], single(objects[0]))
+                for email, objects in groups.items()
+                if len(objects) == 1
+            ],
+            *single_templates,
+            connection=connection,
+        ),
+        send_template_email_batch(
+            [
+                ([email], multiple(objects))
+                for email, objects in groups.items()
+                if len(objects) > 1
+            ],
+            *multiple_templates,
+            connection=connection,
+        ),
+    ]
+    return [email for report in reports for email in report["failed_recipients"]]
+
+
+@shared_task(bind=True, **RETRY_OPTIONS)
+def send_order_request_emails(self, order_ids, only=None):
+    """
+    Tells every seller about the orders placed with them, one e-mail each. only
+    limits the e-mails to those recipients, it is set by retries
+    """
+    groups = {}
+    for order in Order.objects.select_related("placed_to", "placed_by").filter(
+        id__in=order_ids
+    ):
+        groups.setdefault(order.placed_to.email, []).append(order)
+    groups.pop(None, None)
+    if only is not None:
+        groups = {email: groups[email] for email in only if email in groups}
+
+    failed = send_coalesced(
+        groups,
+        ("mail/order_created_title.txt", "mail/order_created_body.html"),
+        ("mail/orders_created_title.txt", "mail/order_created_body.html"),
+        lambda order: order.order_request_mail_context(),
+        lambda orders: {
+            "user": ", ".join(order.placed_to.company_name or "" for order in orders),
+            "orders": ", ".join(str(order.id) for order in orders),
+            "order_objects": orders,
+            "buyer": orders[0].placed_by,
+            "count": len(orders),
+        },
+    )
+    if failed:
+        retry_failed_recipients(self, failed, order_ids=order_ids)
+
+
+@shared_task(bind=True, **RETRY_OPTIONS)
+def send_invoice_emails(self, order_ids, only=None):
+    """Sends the buyer a single e-mail for the invoices of all their orders"""
+    groups = {}
+    for invoice in Invoice.objects.select_related("buyer", "order").filter(
+        order__in=order_ids
+    ):
+        groups.setdefault(invoice.buyer.email, []).append(invoice)
+    if only is not None:
+        groups = {email: groups[email] for email in only if email in groups}
+
+    failed = send_coalesced(
+        groups,
+        ("mail/invoice_created_title.txt", "mail/invoice_created_body.html"),
+        ("mail/invoices_created_title.txt", "mail/invoice_created_body.html"),
+        lambda invoice: invoice.invoice_mail_context(),
+        lambda invoices: {
+            "user": invoices[0].buyer,
+            "invoice_type": invoices[0].type,
+            "invoice_numbers": ", ".join(
+                invoice.invoice_number for invoice in invoices
+            ),
+            "orders": ", ".join(str(invoice.order.id) for invoice in invoices),
+            "invoice_objects": invoices,
+            "count": len(invoices),
+        },
+    )
+    if failed:
+        retry_failed_recipients(self, failed, order_ids=order_ids)
+
+
+@shared_task(bind=True, **RETRY_OPTIONS)
+def send_order_status_emails(self, order_ids, only=None):
+    """
+    Tells the buyer the new status of each order, only limits the e-mails to
+    those order ids
+    """
+    orders = Order.objects.select_related("placed_by").filter(id__in=order_ids)
+    if only is not None:
+        orders = orders.filter(id__in=only)
+    report = send_template_email_batch(
+        [
+            (
+                [order.placed_by.email],
+                {
+                    "user": order.placed_by,
+                    "order": order.id,
+                    "order_object": order,
+                    "status": order.status,
+                },
+            )
+            for order in orders
+        ],
+        "mail/order_status_title.txt",
+        "mail/order_status_body.html",
+        connection=get_pooled_connection(),
+    )
+    if report["failed"]:
+        # A buyer gets one e-mail per order, so the retry is narrowed by order
+        failed = set(report["failed_recipients"])
+        retry_failed_recipients(
+            self,
+            [order.id for order in orders if order.placed_by.email in failed],
+            order_ids=order_ids,
+        )
+
+
+def apply_to_summaries(event, companies):
+    """
+    Moves the order of event from its previous to its current snapshot in the
+    seller summaries. companies are the sellers that still exist, the rows of a
+    deleted one went with it
+    """
+    previous = event.payload.get("previous")
+    current = event.payload.get("current")
+    if previous and previous["company"] in companies:
+        CompanyOrderSummary.add_snapshot(previous, sign=-1)
+        SellerDailySales.add_snapshot(previous, sign=-1)
+    if current and current["company"] in companies:
+        CompanyOrderSummary.add_snapshot(current)
+        SellerDailySales.add_snapshot(current)
+
+
+def event_companies(events):
+    """The sellers named in the snapshots of events that still exist"""
+    company_ids = {
+        event.payload[key]["company"]
+        for event in events
+        for key in ("previous", "current")
+        if event.payload.get(key)
+    }
+    return set(Company.objects.filter(id__in=company_ids).values_list("id", flat=True))
+
+
+@shared_task(ignore_result=True)
+def relay_outbox(batch_size=None, max_batches=50):
+    """
+    Carries out pending OutboxEvents oldest first. Summaries are updated in the
+    transaction that marks the events processed and the e-mail tasks are only
+    queued once it has committed, so a rolled back batch sends nothing
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    processed = 0
+    for _batch in range(max_batches):
+        with transaction.atomic():
+            events = list(
+                OutboxEvent.objects.select_for_update(skip_locked=True)
+                .filter(processed_at__isnull=True)
+                .order_by("id")[:batch_size]
+            )
+            if not events:
+                break
+            companies = event_companies(events)
+            created = {}
+            status_changed = {}
+            for event in events:
+                apply_to_summaries(event, companies)
+                if event.topic == "order.created":
+                    created[event.payload["order"]] = True
+                elif event.topic == "order.status_changed":
+                    status_changed[event.payload["order"]] = True
+            OutboxEvent.objects.filter(id__in=[event.id for event in events]).update(
+                processed_at=now()
+            )
+            # One task per kind for the whole batch, recipients get one e-mail
+            if created:
+                transaction.on_commit(
+                    partial(send_order_request_emails.delay, list(created))
+                )
+                transaction.on_commit(partial(send_invoice_emails.delay, list(created)))
+            if status_changed:
+                transaction.on_commit(
+                    partial(send_order_status_emails.delay, list(status_changed))
+                )
+        processed += len(events)
+    return processed
+
+
+@shared_task(ignore_result=True)
+def purge_outbox():
+    OutboxEvent.objects.filter(
+        processed_at__lt=now() - timedelta(days=settings.OUTBOX_RETENTION_DAYS)
+    ).delete()
+
+
+@shared_task(ignore_result=True)
+def render_invoice_pdf(invoice_id):
+    invoice, context = load_invoice_pdf_context(invoice_id)
+    if invoice is None:
+        return
+    content_hash = invoice_pdf_hash(context)
+    if invoice.pdf and invoice.pdf_hash == content_hash:
+        return
+    store_invoice_pdf(invoice, content_hash, invoice_pdf_bytes(context))
+
+
+@shared_task(ignore_result=True)
+def render_invoices_for_period(start, end):
+    """
+    Renders the PDFs of the invoices issued from start to end (ISO dates,
+    inclusive), spread in chunks over the processes of the media workers
+    """
+    invoice_ids = list(
+        Invoice.objects.filter(issued__range=(start, end))
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    if invoice_ids:
+        render_invoice_pdf.chunks(
+            [(invoice_id,) for invoice_id in invoice_ids],
+            settings.INVOICE_PDF_CHUNK_SIZE,
+        ).group().apply_async(queue="media")
+    return len(invoice_ids)
+
+
+@shared_task
+def reconcile_statement(name, file_format=None):
+    """
+    Reconciles a settlement statement saved in the default storage and keeps
+    it with the exceptions report as a StatementReconciliation, which then
+    holds the reference to the statement. Returns the counts of the run
+    """
+    file_format = file_format or statement_format(name)
+    run = StatementReconciliation.objects.create(statement=name)
+    with tempfile.TemporaryFile() as report:
+        text = io.TextIOWrapper(report, encoding="utf-8", newline="")
+        with default_storage.open(name, "rb") as statement:
+            result = reconcile(
+                statement,
+                text,
+                file_format=file_format,
+                batch_size=settings.RECONCILIATION_BATCH_SIZE,
+            )
+        text.detach()
+        report.seek(0)
+        stem = posixpath.splitext(posixpath.basename(name))[0]
+        run.report.save(f"{stem}-exceptions.csv", File(report), save=False)
+    run.counts = result
+    run.save(update_fields=["report", "counts"])
+    return {**result, "id": run.id, "report": run.report.name}
+
+
+def parse_webhook_event(event):
+    """
+    (reference, status, amount) of a payment event, None if it is not one.
+    amount is None when the event does not carry it
+    """
+    try:
+        data = json.loads(event.body)["data"]
+        amount = data.get("amount")
+        return (
+            str(data["reference"]),
+            str(data["status"])[:100],
+            None if amount is None else Decimal(str(amount)),
+        )
+    except (ValueError, KeyError, TypeError, ArithmeticError):
+        return None
+
+
+@shared_task(ignore_result=True)
+def process_webhook_events(batch_size=None, max_batches=50):
+    """
+    Applies stored payment callbacks oldest first: the transaction with the
+    event reference gets the event status, unless that would move the payment
+    backwards (see PAYMENT_STATUS_RANKS). Each event records its result
+    """
+    batch_size = batch_size or settings.PAYMENT_WEBHOOK_BATCH_SIZE
+    for _batch in range(max_batches):
+        with transaction.atomic():
+            events = list(
+                WebhookEvent.objects.select_for_update(skip_locked=True)
+                .filter(processed_at__isnull=True)
+                .order_by("id")[:batch_size]
+            )
+            if not events:
+                break
+            parsed = {event.id: parse_webhook_event(event) for event in events}
+            transactions = {}
+            current_statuses = {}
+            for reference, pk, amount, current in Transaction.objects.filter(
+                reference__in={
+                    values[0] for values in parsed.values() if values is not None
+                }
+            ).values_list("reference", "pk", "amount", "status"):
+                transactions[reference] = (pk, amount)
+                current_statuses[pk] = current
+
+            results = {}
+            statuses = {}
+            for event in events:
+                values = parsed[event.id]
+                if values is None:
+                    results.setdefault("invalid", []).append(event.id)
+                    continue
+                reference, payment_status, amount = values
+                if reference not in transactions:
+                    results.setdefault("unknown_reference", []).append(event.id)
+                    continue
+                pk, expected_amount = transactions[reference]
+                if amount is not None and amount != expected_amount:
+                    results.setdefault("amount_mismatch", []).append(event.id)
+                    continue
+                if status_rank(payment_status) is None:
+                    results.setdefault("unknown_status", []).append(event.id)
+                    continue
+                # Events are in arrival order, a late one can be older than the
+                # status the payment already has
+                if not is_status_transition(current_statuses[pk], payment_status):
+                    results.setdefault("out_of_order", []).append(event.id)
+                    continue
+                current_statuses[pk] = statuses[pk] = payment_status
+                results.setdefault("applied", []).append(event.id)
+
+            by_status = {}
+            for pk, payment_status in statuses.items():
+                by_status.setdefault(payment_status, []).append(pk)
+            for payment_status, pks in by_status.items():
+                Transaction.objects.filter(pk__in=pks).update(status=payment_status)
+            processed_at = now()
+            for result, event_ids in results.items():
+                WebhookEvent.objects.filter(id__in=event_ids).update(
+                    processed_at=processed_at, result=result
+                )
+
+
+@shared_task(ignore_result=True)
+def generate_seller_statements(company_ids, period_start, currency, rates):
+    generate_statements(company_ids, date.fromisoformat(period_start), currency, rates)
+
+
+@shared_task(ignore_result=True)
+def generate_monthly_statements(period_start=None, currency=None):
+    """
+    Statements of every seller for the month of period_start (ISO date, by
+    default last month), in chunks of sellers run in parallel by the workers
+    """
+    if period_start:
+        period_start = date.fromisoformat(period_start)
+    else:
+        period_start = (localdate().replace(day=1) - timedelta(days=1)).replace(day=1)
+    currency = currency or settings.STATEMENT_CURRENCY
+    rates = load_rates()
+    company_ids = statement_companies(period_start)
+    size = settings.STATEMENT_CHUNK_SIZE
+    group(
+        generate_seller_statements.s(
+            company_ids[start : start + size],
+            period_start.isoformat(),
+            currency,
+            rates,
+        )
+        for start in range(0, len(company_ids), size)
+    ).apply_async()
+    return len(company_ids)
+
+
+@shared_task(ignore_result=True)
+def archive_old_records():
+    """
+    Moves finished orders and product views past their retention period to the
+    archive tables, in batches with ARCHIVE_BATCH_PAUSE seconds in between
+    """
+    for archive, days in (
+        (archive_orders, settings.ORDER_ARCHIVE_AFTER_DAYS),
+        (archive_product_views, settings.PRODUCT_VIEW_ARCHIVE_AFTER_DAYS),
+    ):
+        run_in_batches(
+            archive,
+            now() - timedelta(days=days),
+            settings.ARCHIVE_BATCH_SIZE,
+            pause=settings.ARCHIVE_BATCH_PAUSE,
+        )
+
+
+@shared_task(ignore_result=True)
+def release_expired_reservations(batch_size=None, max_batches=50):
+    """
+    Cancels the orders that stayed pending past their reservation expiry, their
+    stock is given back
+    """
+    batch_size = batch_size or settings.STOCK_SWEEP_BATCH_SIZE
+    cancelled = 0
+    for _batch in range(max_batches):
+        with transaction.atomic():
+            count = StockReservation.cancel_expired(batch_size)
+        cancelled += count
+        if count < batch_size:
+            break
+    return cancelled
@@ -1,3 +1,1021 @@
 from django.test import TestCase
+from unittest import mock
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+from django.contrib.auth import get_user_model
+from apps.inventory.models import Product, ProductImage
+from apps.profiles.models import Company
+from .models import (
+    Order,
+    OrderDetail,
+    Invoice,
+    CompanyOrderSummary,
+    Transaction,
+    OutboxEvent,
+    InvoiceSequence,
+    WebhookEvent,
+    SellerDailySales,
+    SellerStatement,
+    StockReservation,
+    ArchivedInvoice,
+    StatementReconciliation,
+)
+from .archive import archive_orders
+from apps.files.views import can_view_private_file
+from datetime import timedelta
+from apps.profiles.models import ContactPerson
+from . import tasks
+from .pdf import invoice_pdf_bytes, load_invoice_pdf_context
+from .reconciliation import reconcile
+from .webhooks import LocalPaymentProvider
+from utils import template_email
+from utils.idempotency import idempotent
+from utils.pdf import display_text
+from reportlab.pdfbase import pdfmetrics
+from django.test import override_settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core import mail
+from django.core.mail.backends import locmem
+from smtplib import SMTPException
+from django.utils.timezone import localdate, now
+from apps.inventory.models import CurrencyRates
+from .statements import generate_statements, load_rates
+from decimal import Decimal
+import functools
+import io
+import shutil
+import tempfile
+import threading
 
 # Create your tests here.
+User = get_user_model()
+
+
+def run_relay():
+    """Runs the outbox relay, returns the mocked .delay of the e-mail tasks"""
+    with mock.patch.object(
+        tasks.send_order_request_emails, "delay"
+    ) as order_emails, mock.patch.object(
+        tasks.send_invoice_emails, "delay"
+    ) as invoice_emails, mock.patch.object(
+        tasks.send_order_status_emails, "delay"
+    ) as status_emails, TestCase.captureOnCommitCallbacks(
+        execute=True
+    ):
+        tasks.relay_outbox()
+    return order_emails, invoice_emails, status_emails
+
+
+class CreateOrderTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(
+            email="buyer@example.com", password="password", name="Buyer"
+        )
+        self.seller = Company.objects.create(
+            company_name="Seller", email="seller@example.com"
+        )
+        self.products = [
+            Product.objects.create(
+                name=f"Product {index}",
+                description="description",
+                seller=self.seller,
+                cost="2.50",
+            )
+            for index in range(5)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def place_order(self, products):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/api/v1/create-order/",
+                {
+                    "currency": "USD",
+                    "products": [
+                        {"id": product.id, "quantity": 2} for product in products
+                    ],
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_order_details_created(self):
+        self.place_order(self.products[:3])
+        response = self.client.post(
+            "/api/v1/create-order/",
+            {
+                "currency": "USD",
+                "products": [{"id": self.products[0].id, "quantity": 1}],
+            },
+            format="json",
+        )
+        # A single seller gets the order itself, only a split cart a list
+        self.assertEqual(response.data["placed_to"], self.seller.id)
+        Order.objects.filter(id=response.data["id"]).delete()
+        order = Order.objects.get()
+        self.assertEqual(order.placed_to, self.seller)
+        details = OrderDetail.objects.filter(order=order)
+        self.assertEqual(details.count(), 3)
+        self.assertEqual({str(detail.subtotal) for detail in details}, {"5.00"})
+
+    def test_invoice_unchanged_by_catalogue_edits(self):
+        self.place_order(self.products[:2])
+        invoice = Invoice.objects.get()
+        _invoice, context = load_invoice_pdf_context(invoice.id)
+        self.assertEqual(context["lines"][0], ["Product 0", 2, "2.50", "0.00", "5.00"])
+
+        Product.objects.filter(id=self.products[0].id).update(
+            name="Renamed", cost="9.99"
+        )
+        _invoice, after = load_invoice_pdf_context(invoice.id)
+        self.assertEqual(after, context)
+
+    def test_query_count_independent_of_lines(self):
+        # The first order for a seller also creates its summary rows
+        self.place_order(self.products[:1])
+        single_line = self.place_order(self.products[:1])
+        five_lines = self.place_order(self.products)
+        self.assertEqual(single_line, five_lines)
+
+    def test_unknown_product_rejected(self):
+        response = self.client.post(
+            "/api/v1/create-order/",
+            {"currency": "USD", "products": [{"id": 0, "quantity": 1}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    @override_settings(
+        CELERY_EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"
+    )
+    def test_cart_split_per_seller(self):
+        other_seller = Company.objects.create(
+            company_name="Other Seller", email="other@example.com"
+        )
+        other_product = Product.objects.create(
+            name="Other Product",
+            description="description",
+            seller=other_seller,
+            cost="1.00",
+        )
+        response = self.client.post(
+            "/api/v1/create-order/",
+            {
+                "currency": "USD",
+                "products": [
+                    {"id": self.products[0].id, "quantity": 1},
+                    {"id": other_product.id, "quantity": 3},
+                    {"id": self.products[1].id, "quantity": 1},
+                ],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(
+            OrderDetail.objects.filter(order__placed_to=self.seller).count(), 2
+        )
+        self.assertEqual(
+            Invoice.objects.filter(issuer=other_seller, buyer=self.buyer).count(), 1
+        )
+
+        # Only the seller whose e-mail failed is sent it again
+        send_messages = mail.get_connection().send_messages
+        failures = ["other@example.com"]
+
+        def flaky_send(connection, messages):
+            if failures and failures[0] in messages[0].to:
+                failures.pop()
+                raise SMTPException("connection reset")
+            return send_messages(messages)
+
+        mail.outbox = []
+        template_email.close_pooled_connection()
+        self.addCleanup(template_email.close_pooled_connection)
+        one_per_chunk = functools.partial(tasks.send_template_email_batch, chunk_size=1)
+        with mock.patch.object(
+            locmem.EmailBackend, "send_messages", flaky_send
+        ), mock.patch.object(
+            tasks, "send_template_email_batch", one_per_chunk
+        ), mock.patch.object(
+            tasks, "get_exponential_backoff_interval", return_value=0
+        ):
+            tasks.send_order_request_emails.apply(
+                args=([order["id"] for order in response.data],)
+            )
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            ["other@example.com", self.seller.email],
+        )
+
+    def test_idempotent_retry_replays_response(self):
+        payload = {
+            "currency": "USD",
+            "products": [{"id": self.products[0].id, "quantity": 1}],
+        }
+        first = self.client.post(
+            "/api/v1/create-order/",
+            payload,
+            format="json",
+            HTTP_IDEMPOTENCY_KEY="retry-key",
+        )
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.client.post(
+                "/api/v1/create-order/",
+                payload,
+                format="json",
+                HTTP_IDEMPOTENCY_KEY="retry-key",
+            )
+        self.assertEqual(retry.status_code, first.status_code)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertFalse(
+            any("orders_order" in query["sql"] for query in queries.captured_queries)
+        )
+
+        payload["products"][0]["quantity"] = 2
+        reused = self.client.post(
+            "/api/v1/create-order/",
+            payload,
+            format="json",
+            HTTP_IDEMPOTENCY_KEY="retry-key",
+        )
+        self.assertEqual(reused.status_code, 422)
+
+    def test_idempotency_key_needs_a_user(self):
+        calls = []
+
+        @api_view(["POST"])
+        @permission_classes([AllowAny])
+        @idempotent
+        def view(request):
+            calls.append(request)
+            return Response({"secret": "code"}, status=201)
+
+        request = APIRequestFactory().post(
+            "/anonymous/", {}, format="json", HTTP_IDEMPOTENCY_KEY="shared-key"
+        )
+        response = view(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(calls, [])
+
+    def test_order_totals_and_summary(self):
+        self.place_order(self.products[:3])
+        run_relay()
+        order = Order.objects.get()
+        self.assertEqual(order.item_count, 6)
+        self.assertEqual(str(order.grand_total), "15.00")
+
+        detail = order.details.first()
+        detail.tax = "1.50"
+        detail.save()
+        order.refresh_from_db()
+        self.assertEqual(str(order.tax_total), "1.50")
+        self.assertEqual(str(order.grand_total), "16.50")
+
+        self.client.post(
+            "/api/v1/edit-order/",
+            {"order": order.id, "status": "FULFILLED"},
+            format="json",
+        )
+        run_relay()
+        contact = ContactPerson.objects.create(user=self.buyer)
+        contact.companies.add(self.seller)
+        response = self.client.get(
+            "/api/v1/order-summary/", {"company_id": self.seller.id}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["by_status"], {"FULFILLED": 1})
+        self.assertEqual(response.data["by_currency"]["USD"]["total"], "16.50")
+
+        order.refresh_from_db()
+        order.delete()
+        run_relay()
+        summary = CompanyOrderSummary.objects.get(status="FULFILLED")
+        self.assertEqual((summary.order_count, str(summary.total)), (0, "0.00"))
+
+    def test_cascaded_delete_uncounts_order_once(self):
+        self.place_order(self.products[:2])
+        self.place_order(self.products[2:4])
+        run_relay()
+        other = User.objects.create_user(
+            email="other@example.com", password="password", name="Other"
+        )
+        Order.objects.filter(id=Order.objects.order_by("id").last().id).update(
+            placed_by=other
+        )
+
+        self.buyer.delete()
+        run_relay()
+        summary = CompanyOrderSummary.objects.get()
+        daily = SellerDailySales.objects.get()
+        self.assertEqual((summary.order_count, str(summary.total)), (1, "10.00"))
+        self.assertEqual((daily.order_count, str(daily.total)), (1, "10.00"))
+
+        self.seller.delete()
+        run_relay()
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(CompanyOrderSummary.objects.exists())
+        self.assertFalse(SellerDailySales.objects.exists())
+
+    def test_status_transitions_go_through_outbox(self):
+        self.place_order(self.products[:2])
+        order = Order.objects.get()
+        # A batch rolled back queues no e-mails and stays pending
+        with mock.patch.object(
+            tasks.send_order_request_emails, "delay"
+        ) as order_emails, self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                tasks.relay_outbox()
+                raise RuntimeError
+        order_emails.assert_not_called()
+
+        order_emails, invoice_emails, _status_emails = run_relay()
+        order_emails.assert_called_once_with([order.id])
+        invoice_emails.assert_called_once_with([order.id])
+
+        response = self.client.post(
+            "/api/v1/edit-order/",
+            {"order": order.id, "status": "CANCELLED"},
+            format="json",
+        )
+        self.assertEqual(response.data["status"], "CANCELLED")
+        response = self.client.post(
+            "/api/v1/edit-order/",
+            {"order": order.id, "status": "PENDING"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+        _order_emails, _invoice_emails, status_emails = run_relay()
+        status_emails.assert_called_once_with([order.id])
+        self.assertFalse(OutboxEvent.objects.filter(processed_at=None).exists())
+        summary = CompanyOrderSummary.objects.get(status="CANCELLED")
+        self.assertEqual(summary.order_count, 1)
+
+    def test_daily_sales_rollup(self):
+        self.place_order(self.products[:1])
+        self.place_order(self.products[:2])
+        cancelled = Order.objects.order_by("id").first()
+        self.client.post(
+            "/api/v1/edit-order/",
+            {"order": cancelled.id, "status": "CANCELLED"},
+            format="json",
+        )
+        run_relay()
+
+        contact = ContactPerson.objects.create(user=self.buyer)
+        contact.companies.add(self.seller)
+        today = localdate()
+        response = self.client.get(
+            "/api/v1/sales-analytics/",
+            {"company_id": self.seller.id, "period": "month"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["results"],
+            [
+                {
+                    "period_start": today.replace(day=1),
+                    "currency": "USD",
+                    "order_count": 1,
+                    "revenue": "10.00",
+                }
+            ],
+        )
+
+        live = set(
+            SellerDailySales.objects.exclude(order_count=0).values_list(
+                "date", "status", "order_count", "total"
+            )
+        )
+        self.assertEqual(SellerDailySales.rebuild([self.seller.id]), 2)
+        self.assertEqual(
+            set(
+                SellerDailySales.objects.values_list(
+                    "date", "status", "order_count", "total"
+                )
+            ),
+            live,
+        )
+
+    @override_settings(TIME_ZONE="Africa/Lagos")
+    def test_rebuild_leaves_pending_events_to_the_relay(self):
+        self.place_order(self.products[:1])
+        run_relay()
+        late = Order.objects.get()
+        # 23:30 UTC is already the next day in Lagos
+        Order.objects.filter(pk=late.pk).update(
+            order_date=late.order_date.replace(hour=23, minute=30)
+        )
+        SellerDailySales.objects.all().delete()
+        late.refresh_from_db()
+        SellerDailySales.add_snapshot(late.summary_snapshot())
+        self.place_order(self.products[:2])
+        pending = Order.objects.exclude(pk=late.pk).get()
+        self.client.post(
+            "/api/v1/edit-order/",
+            {"order": pending.id, "status": "CANCELLED"},
+            format="json",
+        )
+
+        SellerDailySales.rebuild([self.seller.id])
+        self.assertEqual(
+            list(SellerDailySales.objects.values_list("date", "order_count")),
+            [(localdate(late.order_date), 1)],
+        )
+        run_relay()
+        self.assertEqual(
+            set(
+                SellerDailySales.objects.exclude(order_count=0).values_list(
+                    "date", "status", "order_count"
+                )
+            ),
+            {
+                (localdate(late.order_date), "PENDING", 1),
+                (localdate(pending.order_date), "CANCELLED", 1),
+            },
+        )
+
+    def test_stock_reserved_and_given_back(self):
+        product = self.products[0]
+        Product.objects.filter(id=product.id).update(available_quantity=3)
+        self.place_order([product])
+        response = self.client.post(
+            "/api/v1/create-order/",
+            {"currency": "USD", "products": [{"id": product.id, "quantity": 2}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.available_quantity, 1)
+
+        order = Order.objects.get()
+        self.client.post(
+            "/api/v1/edit-order/",
+            {"order": order.id, "status": "CANCELLED"},
+            format="json",
+        )
+        product.refresh_from_db()
+        self.assertEqual(product.available_quantity, 3)
+        self.assertEqual(
+            StockReservation.objects.get().status, StockReservation.RELEASED
+        )
+
+        # Confirmed by a partial delivery, given back when cancelled after all
+        self.place_order([product])
+        order = Order.objects.latest("id")
+        for status in ("PARTIAL", "CANCELLED"):
+            self.client.post(
+                "/api/v1/edit-order/",
+                {"order": order.id, "status": status},
+                format="json",
+            )
+        product.refresh_from_db()
+        self.assertEqual(product.available_quantity, 3)
+
+        # Left pending too long: the order is cancelled, it cannot be fulfilled
+        # on stock it no longer holds
+        self.place_order([product])
+        order = Order.objects.latest("id")
+        StockReservation.objects.filter(status=StockReservation.HELD).update(
+            expires_at=now() - timedelta(minutes=1)
+        )
+        self.assertEqual(tasks.release_expired_reservations(), 1)
+        product.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual(product.available_quantity, 3)
+        self.assertEqual(order.status, "CANCELLED")
+        self.assertFalse(
+            StockReservation.objects.exclude(status=StockReservation.RELEASED).exists()
+        )
+
+    def test_expired_orders_swept_in_batches_of_orders(self):
+        Product.objects.update(available_quantity=10)
+        for _order in range(3):
+            self.place_order(self.products[:2])
+        StockReservation.objects.update(expires_at=now() - timedelta(minutes=1))
+        self.assertEqual(tasks.release_expired_reservations(batch_size=2), 3)
+        self.assertEqual(
+            set(Order.objects.values_list("status", flat=True)), {"CANCELLED"}
+        )
+        self.assertEqual(
+            set(Product.objects.values_list("available_quantity", flat=True)), {10}
+        )
+
+    def test_invoice_numbers_per_seller_and_year(self):
+        self.place_order(self.products[:1])
+        self.place_order(self.products[:2])
+        numbers = list(
+            Invoice.objects.order_by("id").values_list("sequence_number", flat=True)
+        )
+        self.assertEqual(numbers, [1, 2])
+
+        other_seller = Company.objects.create(
+            company_name="Other Seller", email="other@example.com"
+        )
+        with self.assertRaises(ValueError), transaction.atomic():
+            InvoiceSequence.allocate(other_seller.id, 2024)
+            raise ValueError
+        self.assertEqual(list(InvoiceSequence.allocate(other_seller.id, 2024)), [1])
+        self.assertEqual(
+            list(InvoiceSequence.allocate(other_seller.id, 2024, count=3)), [2, 3, 4]
+        )
+
+
+class SearchOrderTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(
+            email="buyer@example.com", password="password", name="Buyer"
+        )
+        self.seller = Company.objects.create(
+            company_name="Seller", email="seller@example.com"
+        )
+        self.other_seller = Company.objects.create(
+            company_name="Other Seller", email="other@example.com"
+        )
+        for company, order_status in [
+            (self.seller, "PENDING"),
+            (self.seller, "FULFILLED"),
+            (self.other_seller, "PENDING"),
+        ]:
+            Order.objects.create(
+                placed_by=self.buyer, placed_to=company, status=order_status
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def test_filters_and_cursor_pages(self):
+        response = self.client.get(
+            "/api/v1/user-orders/",
+            {"placed_to": self.seller.id, "status": "pending,fulfilled", "limit": 1},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 1)
+        next_page = self.client.get(response.data["next"])
+        self.assertEqual(len(next_page.data["results"]), 1)
+        self.assertIsNone(next_page.data["next"])
+
+        response = self.client.get("/api/v1/user-orders/", {"status": "SHIPPED"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_orders_scoped_to_user(self):
+        stranger = User.objects.create_user(
+            email="stranger@example.com", password="password", name="Stranger"
+        )
+        self.client.force_authenticate(stranger)
+        response = self.client.get("/api/v1/orders/")
+        self.assertEqual(response.data["results"], [])
+
+
+class OrderDetailViewTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(
+            email="buyer@example.com", password="password", name="Buyer"
+        )
+        self.seller = Company.objects.create(
+            company_name="Seller", email="seller@example.com"
+        )
+        self.order = Order.objects.create(placed_by=self.buyer, placed_to=self.seller)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def add_lines(self, count):
+        for index in range(count):
+            image = ProductImage.objects.create(
+                image="user_main/photo.jpg",
+                variants={"source": "user_main/photo.jpg", "jpeg": {"320": "a.jpeg"}},
+            )
+            product = Product.objects.create(
+                name=f"Product {index}",
+                description="description",
+                seller=self.seller,
+                cost="2.50",
+            )
+            product.images.add(image)
+            OrderDetail.objects.create(
+                order=self.order,
+                item_code=product,
+                product_name=product.name,
+                unit_price=product.cost,
+                quantity=1,
+                subtotal="2.50",
+            )
+
+    def test_fixed_number_of_queries(self):
+        self.add_lines(4)
+        invoice = Invoice.objects.create(
+            buyer=self.buyer, issuer=self.seller, order=self.order
+        )
+        Transaction.objects.create(
+            buyer=self.buyer,
+            seller=self.seller,
+            invoice=invoice,
+            key="secret",
+            reference="ref",
+            amount=1000,
+            method="card",
+            status="success",
+            date="2024-01-01T00:00:00Z",
+        )
+        # Repricing the product later changes nothing on the order
+        Product.objects.update(name="Renamed", cost="9.99")
+        with self.assertNumQueries(5):
+            response = self.client.get("/api/v1/order-detail/", {"id": self.order.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["details"]), 4)
+        line = response.data["details"][0]
+        self.assertEqual(line["product_name"], "Product 0")
+        self.assertEqual(line["unit_cost"], "2.50")
+        self.assertTrue(line["thumbnail"].endswith("a.jpeg"))
+        transaction = response.data["invoices"][0]["transactions"][0]
+        self.assertNotIn("key", transaction)
+
+        self.add_lines(4)
+        with self.assertNumQueries(5):
+            self.client.get("/api/v1/order-detail/", {"id": self.order.id})
+
+    def test_other_users_cannot_read_order(self):
+        stranger = User.objects.create_user(
+            email="stranger@example.com", password="password", name="Stranger"
+        )
+        self.client.force_authenticate(stranger)
+        response = self.client.get("/api/v1/order-detail/", {"id": self.order.id})
+        self.assertEqual(response.status_code, 404)
+
+    def test_archived_order_read_through_the_same_endpoints(self):
+        self.add_lines(2)
+        invoice = Invoice.objects.create(
+            buyer=self.buyer, issuer=self.seller, order=self.order
+        )
+        Transaction.objects.create(
+            buyer=self.buyer,
+            seller=self.seller,
+            invoice=invoice,
+            key="secret",
+            reference="ref",
+            amount=1000,
+            method="card",
+            status="success",
+            date="2024-01-01T00:00:00Z",
+        )
+        live = self.client.get("/api/v1/order-detail/", {"id": self.order.id}).data
+        Order.objects.filter(id=self.order.id).update(status="FULFILLED")
+        summaries = list(CompanyOrderSummary.objects.values_list("order_count"))
+
+        cutoff = now() + timedelta(days=1)
+        self.assertEqual(archive_orders(cutoff, 10), 1)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(
+            list(CompanyOrderSummary.objects.values_list("order_count")), summaries
+        )
+
+        response = self.client.get("/api/v1/order-detail/", {"id": self.order.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["details"]), 2)
+        self.assertEqual(response.data["invoices"][0]["id"], live["invoices"][0]["id"])
+        response = self.client.get("/api/v1/user-orders/", {"archived": "true"})
+        self.assertEqual(response.data["results"][0]["id"], self.order.id)
+        self.assertNotIn("details", response.data["results"][0])
+
+        # The PDF is rendered on the way into the archive and stays downloadable
+        archived = ArchivedInvoice.objects.get(id=invoice.id)
+        response = self.client.get("/api/v1/invoice-pdf/", {"id": invoice.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "private, no-store")
+        self.assertTrue(can_view_private_file(self.buyer, archived.pdf.name))
+        stranger = User.objects.create_user(
+            email="stranger@example.com", password="password", name="Stranger"
+        )
+        self.assertFalse(can_view_private_file(stranger, archived.pdf.name))
+        self.client.force_authenticate(stranger)
+        response = self.client.get("/api/v1/invoice-pdf/", {"id": invoice.id})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CELERY_EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend")
+class TemplateEmailTest(TestCase):
+    def setUp(self):
+        template_email.close_pooled_connection()
+
+    def tearDown(self):
+        template_email.close_pooled_connection()
+
+    def test_pooled_connection_kept_per_thread(self):
+        connection = template_email.get_pooled_connection()
+        self.assertIs(template_email.get_pooled_connection(), connection)
+        others = []
+        thread = threading.Thread(
+            target=lambda: others.append(template_email.get_pooled_connection())
+        )
+        thread.start()
+        thread.join()
+        self.assertIsNot(others[0], connection)
+
+    def test_close_drops_connection_that_fails_to_close(self):
+        connection = template_email.get_pooled_connection()
+        with mock.patch.object(connection, "close", side_effect=OSError):
+            template_email.close_pooled_connection()
+        self.assertIsNot(template_email.get_pooled_connection(), connection)
+
+        connection = template_email.get_pooled_connection()
+        with mock.patch.object(connection, "close", side_effect=KeyError):
+            with self.assertRaises(KeyError):
+                template_email.close_pooled_connection()
+
+    def test_batch_renders_each_context_and_reports_failures(self):
+        messages = [
+            ([f"buyer{order}@example.com"], {"order": order, "status": "SHIPPED"})
+            for order in range(5)
+        ]
+        send_messages = mail.get_connection().send_messages
+
+        def failing_second_chunk(connection, chunk):
+            if "buyer2@example.com" in chunk[0].to:
+                raise SMTPException("connection reset")
+            return send_messages(chunk)
+
+        mail.outbox = []
+        with mock.patch.object(
+            locmem.EmailBackend, "send_messages", failing_second_chunk
+        ):
+            report = template_email.send_template_email_batch(
+                messages,
+                "mail/order_status_title.txt",
+                "mail/order_status_body.html",
+                chunk_size=2,
+                connection=mail.get_connection(),
+            )
+
+        self.assertEqual((report["sent"], report["failed"]), (3, 2))
+        self.assertEqual(
+            report["failed_recipients"], ["buyer2@example.com", "buyer3@example.com"]
+        )
+        self.assertEqual(
+            [(message.to, message.subject) for message in mail.outbox],
+            [
+                (["buyer0@example.com"], "Order 0 - Your order is now SHIPPED"),
+                (["buyer1@example.com"], "Order 1 - Your order is now SHIPPED"),
+                (["buyer4@example.com"], "Order 4 - Your order is now SHIPPED"),
+            ],
+        )
+        self.assertIn("your order 4 has changed", mail.outbox[2].body)
+        self.assertEqual(mail.outbox[2].alternatives[0][1], "text/html")
+
+
+class InvoicePdfTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(
+            email="buyer@example.com", password="password", name="Buyer"
+        )
+        self.seller = Company.objects.create(
+            company_name="Seller", email="seller@example.com"
+        )
+        order = Order.objects.create(placed_by=self.buyer, placed_to=self.seller)
+        self.invoice = Invoice.objects.create(
+            buyer=self.buyer, issuer=self.seller, order=order
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def test_rendering_is_deterministic(self):
+        _invoice, context = load_invoice_pdf_context(self.invoice.id)
+        pdf_bytes = invoice_pdf_bytes(context)
+        self.assertTrue(pdf_bytes.startswith(b"%PDF-"))
+        self.assertEqual(pdf_bytes, invoice_pdf_bytes(context))
+
+    def test_names_in_any_script_have_glyphs(self):
+        _invoice, context = load_invoice_pdf_context(self.invoice.id)
+        names = ["Ɛdem Kɔfi Ŋuɖoɖo", "Ɓala Ɗanƙwai Ƴaro", "شركة النور للتجارة"]
+        context["buyer"] = names
+        pdf_bytes = invoice_pdf_bytes(context)
+        # Drawn in the embedded TrueType font, not a standard font without them
+        self.assertIn(b"/FontFile2", pdf_bytes)
+        self.assertNotIn(b"Helvetica", pdf_bytes)
+        font = pdfmetrics.getFont("Sans")
+        for name in names:
+            missing = [
+                char
+                for char in display_text(name)
+                if ord(char) not in font.face.charToGlyph
+            ]
+            self.assertEqual(missing, [], name)
+        self.assertNotEqual(display_text(names[2]), names[2])
+
+    def test_download_queues_render_when_missing(self):
+        with mock.patch.object(tasks.render_invoice_pdf, "delay") as render:
+            response = self.client.get("/api/v1/invoice-pdf/", {"id": self.invoice.id})
+        self.assertEqual(response.status_code, 202)
+        render.assert_called_once_with(self.invoice.id)
+
+
+class ReconciliationTest(TestCase):
+    def test_statement_lines_matched_and_exceptions_reported(self):
+        buyer = User.objects.create_user(
+            email="buyer@example.com", password="password", name="Buyer"
+        )
+        seller = Company.objects.create(company_name="Seller", email="s@example.com")
+        order = Order.objects.create(placed_by=buyer, placed_to=seller)
+        invoice = Invoice.objects.create(
+            buyer=buyer,
+            issuer=seller,
+            order=order,
+            number_year=2024,
+            sequence_number=3,
+        )
+        for reference in ("A1", "A2"):
+            Transaction.objects.create(
+                buyer=buyer,
+                seller=seller,
+                key="key",
+                reference=reference,
+                amount=100,
+                method="papss",
+                status="pending",
+                date="2024-01-01T00:00:00Z",
+            )
+        statement = io.BytesIO(
+            b"Reference,Amount,Status,Invoice Number\n"
+            b"A1,100.00,settled,2024-000003\n"
+            b"A2,90.00,settled,\n"
+            b"A1,100.00,settled,\n"
+            b"B9,100.00,settled,\n"
+        )
+        report = io.StringIO()
+        result = reconcile(statement, report, batch_size=1)
+
+        self.assertEqual((result["matched"], result["exceptions"]), (1, 3))
+        settled = Transaction.objects.get(reference="A1")
+        self.assertEqual((settled.status, settled.invoice), ("settled", invoice))
+        self.assertEqual(Transaction.objects.get(reference="A2").status, "pending")
+        reasons = [row.split(",")[4] for row in report.getvalue().splitlines()[1:]]
+        self.assertEqual(
+            reasons, ["amount_mismatch", "duplicate_line", "unknown_reference"]
+        )
+
+    def test_statement_and_report_kept_private(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        staff = User.objects.create_user(
+            email="staff@example.com", password="password", name="Staff"
+        )
+        staff.is_staff = True
+        staff.save()
+        stranger = User.objects.create_user(
+            email="stranger@example.com", password="password", name="Stranger"
+        )
+        with override_settings(MEDIA_ROOT=media_root):
+            name = default_storage.save(
+                "statement.csv", ContentFile(b"Reference,Amount,Status\nB9,1,x\n")
+            )
+            result = tasks.reconcile_statement(name)
+            run = StatementReconciliation.objects.get(id=result["id"])
+            self.assertEqual(run.counts["exceptions"], 1)
+            self.assertIn("B9", run.report.read().decode())
+            for path in (name, result["report"]):
+                self.assertFalse(can_view_private_file(stranger, path))
+                self.assertTrue(can_view_private_file(staff, path))
+
+
+@override_settings(PAYMENT_WEBHOOK_SECRETS={"papss": "secret"})
+class PaymentWebhookTest(TestCase):
+    def setUp(self):
+        buyer = User.objects.create_user(
+            email="buyer@example.com", password="password", name="Buyer"
+        )
+        seller = Company.objects.create(company_name="Seller", email="s@example.com")
+        for reference in ("P1", "P2"):
+            Transaction.objects.create(
+                buyer=buyer,
+                seller=seller,
+                key="key",
+                reference=reference,
+                amount=100,
+                method="papss",
+                status="pending",
+                date="2024-01-01T00:00:00Z",
+            )
+        self.provider = LocalPaymentProvider("papss")
+        cache.delete("webhook-processing-scheduled")
+
+    def deliver(self, event, provider=None):
+        body, headers = (provider or self.provider).sign(event)
+        return self.client.post(
+            "/api/v1/webhooks/papss/",
+            body,
+            content_type="application/json",
+            **{
+                "HTTP_" + key.upper().replace("-", "_"): v for key, v in headers.items()
+            },
+        )
+
+    @mock.patch.object(tasks.process_webhook_events, "apply_async")
+    def test_events_stored_once_and_applied_in_batch(self, apply_async):
+        settled = self.provider.event("P1", "settled", "100.00")
+        self.assertEqual(self.deliver(settled).status_code, 202)
+        self.assertEqual(self.deliver(settled).status_code, 202)
+        self.deliver(self.provider.event("P2", "failed", 90))
+        self.deliver(self.provider.event("P9", "settled", 100))
+        self.assertEqual(WebhookEvent.objects.count(), 3)
+        apply_async.assert_called_once()
+
+        tasks.process_webhook_events()
+        self.assertEqual(Transaction.objects.get(reference="P1").status, "settled")
+        self.assertEqual(Transaction.objects.get(reference="P2").status, "pending")
+        self.assertEqual(
+            sorted(WebhookEvent.objects.values_list("result", flat=True)),
+            ["amount_mismatch", "applied", "unknown_reference"],
+        )
+        self.assertFalse(WebhookEvent.objects.filter(processed_at=None).exists())
+
+    @mock.patch.object(tasks.process_webhook_events, "apply_async")
+    def test_late_events_do_not_move_payment_back(self, apply_async):
+        for reference, payment_status in [
+            ("P1", "settled"),
+            ("P1", "pending"),
+            ("P1", "failed"),
+            ("P2", "processing"),
+            ("P2", "on_hold"),
+        ]:
+            self.deliver(self.provider.event(reference, payment_status, 100))
+        tasks.process_webhook_events(batch_size=1)
+        self.deliver(self.provider.event("P2", "pending", 100))
+        tasks.process_webhook_events()
+
+        self.assertEqual(Transaction.objects.get(reference="P1").status, "settled")
+        self.assertEqual(Transaction.objects.get(reference="P2").status, "processing")
+        self.assertEqual(
+            list(WebhookEvent.objects.order_by("id").values_list("result", flat=True)),
+            [
+                "applied",
+                "out_of_order",
+                "out_of_order",
+                "applied",
+                "unknown_status",
+                "out_of_order",
+            ],
+        )
+
+    def test_bad_signature_rejected(self):
+        forged = LocalPaymentProvider("papss", secret="wrong")
+        response = self.deliver(forged.event("P1", "settled", 100), provider=forged)
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+
+class SellerStatementTest(TestCase):
+    def test_invoices_totalled_per_currency_and_converted(self):
+        buyer = User.objects.create_user(
+            email="buyer@example.com", password="password", name="Buyer"
+        )
+        seller = Company.objects.create(company_name="Seller", email="s@example.com")
+        order = Order.objects.create(placed_by=buyer, placed_to=seller)
+        for currency, total, tax, shipping in (
+            ("USD", "10.00", "1.00", "2.00"),
+            ("USD", "5.01", "0.50", None),
+            ("GHC", "150.00", "15.00", "30.00"),
+        ):
+            Invoice.objects.create(
+                buyer=buyer,
+                issuer=seller,
+                order=order,
+                currency=currency,
+                total=total,
+                tax_total=tax,
+                final_shipping_price=shipping,
+            )
+        CurrencyRates.objects.create(currency_rate_timestamp=now(), usd=1.1, ghs=16.5)
+
+        rates = load_rates()
+        self.assertEqual(generate_statements([seller.id], localdate(), "USD", rates), 1)
+        statement = SellerStatement.objects.get()
+        self.assertEqual(statement.invoice_count, 3)
+        self.assertEqual(
+            statement.by_currency["USD"],
+            {
+                "invoice_count": 2,
+                "total": "15.01",
+                "tax_total": "1.50",
+                "shipping": "2.00",
+            },
+        )
+        # 150 GHC at 1.1 / 16.5 is 10 USD
+        self.assertEqual(
+            (statement.total, statement.tax_total, statement.shipping),
+            (Decimal("25.01"), Decimal("2.50"), Decimal("4.00")),
+        )
+
+        generate_statements([seller.id], localdate(), "USD", rates)
+        self.assertEqual(SellerStatement.objects.count(), 1)
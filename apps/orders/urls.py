@@ -6,4 +6,9 @@ urlpatterns = [
     path("edit-order/", views.edit_order, name="edit-order"),
     path("orders/", views.SearchOrder.as_view(), name="search_orders"),
     path("user-orders/", views.SearchUsersOrder.as_view(), name="search_users_orders"),
+    path("order-detail/", views.get_order_detail, name="order_detail"),
+    path("invoice-pdf/", views.download_invoice_pdf, name="invoice_pdf"),
+    path("webhooks/<str:provider>/", views.payment_webhook, name="payment_webhook"),
+    path("order-summary/", views.get_order_summary, name="order_summary"),
+    path("sales-analytics/", views.get_sales_analytics, name="sales_analytics"),
 ]
@@ -3,77 +3,233 @@ from rest_framework.decorators import (
     authentication_classes,
     permission_classes,
 )
-from .models import Order, OrderDetail, Invoice
-from rest_framework import generics, filters, status
+from .models import (
+    Order,
+    OrderDetail,
+    Invoice,
+    InvoiceSequence,
+    CompanyOrderSummary,
+    OutboxEvent,
+    WebhookEvent,
+    SellerDailySales,
+    ArchivedInvoice,
+    ArchivedOrder,
+    StockReservation,
+)
+from rest_framework import generics, status
 from rest_framework.response import Response
-from .serializers import OrderSerializer, OrderDetailSerializer, InvoiceSerializer
+from .serializers import (
+    OrderSerializer,
+    OrderDetailSerializer,
+    InvoiceSerializer,
+    OrderDetailedSerializer,
+    ArchivedOrderSerializer,
+)
+from .archive import orders_with_details
+from .filters import OrderFilter, OrderCursorPagination
+from .pdf import invoice_pdf_hash, load_invoice_pdf_context
+from .tasks import render_invoice_pdf
+from .webhooks import (
+    SIGNATURE_HEADER,
+    TIMESTAMP_HEADER,
+    schedule_processing,
+    verify_signature,
+)
+from apps.files.views import media_file_response
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+import json
+from django.conf import settings
 from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils.dateparse import parse_date
+from django.core.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 import collections
 from apps.inventory.models import Product
+from apps.profiles.models import Company, ContactPerson
 from datetime import timedelta
-from django.utils.timezone import localtime, now
+from django.utils.timezone import localdate, localtime, now
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from utils.idempotency import idempotent
+
+
+def visible_to(queryset, user):
+    """
+    Orders (live or archived) placed by the user or to the user's companies,
+    staff see every order
+    """
+    if user.is_staff:
+        return queryset
+    companies = Company.objects.filter(contact_people__user=user).values("id")
+    return queryset.filter(Q(placed_by=user.id) | Q(placed_to__in=companies))
+
+
+class ArchivedOrdersMixin:
+    """?archived=true lists the archived orders instead of the live ones"""
+
+    def archived(self):
+        return self.request.query_params.get("archived") == "true"
 
+    def get_serializer_class(self):
+        return ArchivedOrderSerializer if self.archived() else OrderSerializer
 
-class SearchOrder(generics.ListAPIView):
-    serializer_class = OrderSerializer
-    filter_backends = [filters.SearchFilter]
-    search_fields = ["placed_by"]
+    def orders(self):
+        return ArchivedOrder.objects.all() if self.archived() else Order.objects.all()
+
+
+class SearchOrder(ArchivedOrdersMixin, generics.ListAPIView):
+    """
+    Orders placed by or to the user's companies, staff see every order. See
+    OrderFilter for the query parameters
+    """
+
+    filter_backends = [OrderFilter]
+    pagination_class = OrderCursorPagination
 
     def get_queryset(self):
-        queryset = Order.objects.all()
-        return queryset
+        return visible_to(self.orders(), self.request.user)
 
 
-class SearchUsersOrder(generics.ListAPIView):
-    serializer_class = OrderSerializer
-    filter_backends = [filters.SearchFilter]
-    search_fields = ["placed_to"]
+class SearchUsersOrder(ArchivedOrdersMixin, generics.ListAPIView):
+    filter_backends = [OrderFilter]
+    pagination_class = OrderCursorPagination
 
     def get_queryset(self):
-        queryset = Order.objects.filter(placed_by=self.request.user.id)
+        queryset = self.orders().filter(placed_by=self.request.user.id)
         return queryset
 
 
+def get_order_lines(products_data):
+    """
+    Fetches every product of the cart in one query, returns (product, quantity)
+    pairs in cart order
+    """
+    try:
+        quantities = [
+            (int(product["id"]), int(product["quantity"])) for product in products_data
+        ]
+    except (KeyError, TypeError, ValueError):
+        raise ValidationError("Each product needs a numeric id and quantity")
+    if not quantities:
+        raise ValidationError("An order needs at least one product")
+    products = Product.objects.select_related("seller").in_bulk(
+        [product_id for product_id, _quantity in quantities]
+    )
+    lines = []
+    for product_id, quantity in quantities:
+        if product_id not in products:
+            raise ValidationError(f"Product {product_id} does not exist")
+        if quantity <= 0:
+            raise ValidationError("Quantity must be greater than zero")
+        lines.append((products[product_id], quantity))
+    return lines
+
+
+def group_lines_by_seller(lines):
+    """Splits the cart into {seller: [(product, quantity)]} keeping cart order"""
+    sellers = {}
+    for product, quantity in lines:
+        if product.seller is None:
+            raise ValidationError(f"Product {product.id} has no seller")
+        sellers.setdefault(product.seller, []).append((product, quantity))
+    return sellers
+
+
 @api_view(["POST"])
 # @permission_classes([IsAuthenticated])
+@idempotent
 @transaction.atomic
 def create_order(request):
+    """
+    Places the cart, one Order and proforma Invoice is created for every seller
+    in it. Returns the order, or a list of orders when the cart was split
+    """
     data = request.data
     data["placed_by"] = request.user.id
-    company = Product.objects.get(id=data["products"][0]["id"]).seller
-    data["placed_to"] = company.id
+    sellers = group_lines_by_seller(get_order_lines(data["products"]))
+    companies = list(sellers)
+
+    # The order fields are the same for every seller, validated once
+    data["placed_to"] = companies[0].id
     order_serializer = OrderSerializer(data=data)
     order_serializer.is_valid(raise_exception=True)
-    order_instance = order_serializer.save()
+    order_data = order_serializer.validated_data
+    # Every order starts out PENDING, later statuses go through transition_to
+    order_data.pop("status", None)
 
-    for product in data["products"]:
-        product_instance = Product.objects.get(id=product["id"])
-        subtotal = product_instance.cost * product["quantity"]
-        order_detail_data = {
-            "order": order_instance.id,
-            "item_code": product_instance.id,
-            "quantity": product["quantity"],
-            "subtotal": subtotal,
-        }
-        order_detail_serializer = OrderDetailSerializer(data=order_detail_data)
-        order_detail_serializer.is_valid(raise_exception=True)
-        order_detail_serializer.save()
+    # Subtotals and order totals are computed in memory and all lines inserted
+    # in one statement
+    orders = []
+    details = []
+    for company in companies:
+        order = Order(**{**order_data, "placed_to": company})
+        lines = [
+            OrderDetail(
+                order=order,
+                item_code=product,
+                product_name=product.name,
+                unit_price=product.cost,
+                quantity=quantity,
+                subtotal=product.cost * quantity,
+            )
+            for product, quantity in sellers[company]
+        ]
+        order.set_totals(lines)
+        order.save()
+        orders.append(order)
+        details.extend(lines)
+    OrderDetail.objects.bulk_create(details)
 
     # Create and Send Proforma Invoice to buyer
     data["buyer"] = request.user.id
-    data["issuer"] = company.id
-    data["order"] = order_instance.id
+    data["issuer"] = companies[0].id
+    data["order"] = orders[0].id
     if "shipping_street" in data:
         data["require_shipment"] = True
     invoice_serializer = InvoiceSerializer(data=data)
     invoice_serializer.is_valid(raise_exception=True)
-    invoice_instance = invoice_serializer.save()
-    order_instance.send_order_request_by_email()
-    invoice_instance.send_invoice_by_email()
+    invoice_data = invoice_serializer.validated_data
+    # Numbers are taken last and in a fixed seller order, so each sequence row
+    # is locked as briefly as possible and carts never deadlock on them
+    year = localdate().year
+    numbers = {
+        company.id: InvoiceSequence.allocate(company.id, year)[0]
+        for company in sorted(companies, key=lambda company: company.id)
+    }
+    Invoice.objects.bulk_create(
+        [
+            Invoice(
+                **{**invoice_data, "issuer": company, "order": order},
+                number_year=year,
+                sequence_number=numbers[company.id],
+            )
+            for order, company in zip(orders, companies)
+        ]
+    )
+
+    # Stock is taken last, the product rows stay locked until the commit
+    StockReservation.reserve(
+        [
+            (order, product, quantity)
+            for order, company in zip(orders, companies)
+            for product, quantity in sellers[company]
+        ],
+        expires_at=now() + timedelta(hours=settings.STOCK_RESERVATION_HOURS),
+    )
+
+    # E-mails and seller summaries are handled by the outbox relay once the
+    # orders are committed
+    OutboxEvent.publish_many(
+        "order.created",
+        [{"order": order.id, "current": order.summary_snapshot()} for order in orders],
+    )
 
-    return Response(order_serializer.data, status=status.HTTP_200_OK)
+    if len(orders) == 1:
+        return Response(OrderSerializer(orders[0]).data, status=status.HTTP_200_OK)
+    return Response(OrderSerializer(orders, many=True).data, status=status.HTTP_200_OK)
 
 
 @api_view(["POST"])
@@ -81,7 +237,7 @@ def create_order(request):
 @transaction.atomic
 def edit_order(request):
     data = request.data
-    order_instance = Order.objects.get(id=data["order"])
+    order_instance = Order.objects.select_for_update().get(id=data["order"])
     if order_instance.order_date + timedelta(hours=48) < now():
         return Response(
             {
@@ -92,7 +248,295 @@ def edit_order(request):
             },
             status=status.HTTP_400_BAD_REQUEST,
         )
+    new_status = data.pop("status", None)
+    previous = order_instance.summary_snapshot()
     order_serializer = OrderSerializer(instance=order_instance, partial=True, data=data)
     order_serializer.is_valid(raise_exception=True)
-    order_serializer.save()
-    return Response(order_serializer.data, status=status.HTTP_200_OK)
+    order_instance = order_serializer.save()
+    if order_instance.summary_snapshot() != previous:
+        OutboxEvent.publish(
+            "order.changed",
+            order=order_instance.id,
+            previous=previous,
+            current=order_instance.summary_snapshot(),
+        )
+    if new_status:
+        order_instance.transition_to(new_status)
+    return Response(OrderSerializer(order_instance).data, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@authentication_classes([JWTAuthentication])
+def get_order_summary(request):
+    """
+    Order counts per status and totals per currency for one seller, read from
+    CompanyOrderSummary
+    """
+    company_id = request.query_params.get("company_id")
+    try:
+        company = Company.objects.get(id=company_id)
+    except (Company.DoesNotExist, ValueError):
+        return Response(
+            {
+                "errors": "Company not found",
+                "status": 400,
+                "message": "company_id must be the id of an existing company",
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if not (
+        request.user.is_staff
+        or ContactPerson.objects.filter(user=request.user, companies=company).exists()
+    ):
+        return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+    by_status = collections.Counter()
+    by_currency = {}
+    summaries = CompanyOrderSummary.objects.filter(company=company).exclude(
+        order_count=0
+    )
+    for summary in summaries:
+        by_status[summary.status] += summary.order_count
+        currency = by_currency.setdefault(
+            summary.currency, {"order_count": 0, "total": 0}
+        )
+        currency["order_count"] += summary.order_count
+        currency["total"] += summary.total
+    for currency in by_currency.values():
+        currency["total"] = str(currency["total"])
+    return Response(
+        {
+            "company": company.id,
+            "order_count": sum(by_status.values()),
+            "by_status": by_status,
+            "by_currency": by_currency,
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+SALES_PERIODS = {"day": None, "week": TruncWeek, "month": TruncMonth}
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@authentication_classes([JWTAuthentication])
+def get_sales_analytics(request):
+    """
+    Order count and revenue of one seller per day, week or month and currency,
+    summed from SellerDailySales:
+    ?company_id=3&period=week&start=2024-01-01&end=2024-03-31&status=FULFILLED
+    Cancelled orders are left out unless status asks for them
+    """
+    params = request.query_params
+    try:
+        company = Company.objects.get(id=params.get("company_id"))
+    except (Company.DoesNotExist, ValueError):
+        return Response(
+            {
+                "errors": "Company not found",
+                "status": 400,
+                "message": "company_id must be the id of an existing company",
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if not (
+        request.user.is_staff
+        or ContactPerson.objects.filter(user=request.user, companies=company).exists()
+    ):
+        return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+    period = params.get("period", "day")
+    if period not in SALES_PERIODS:
+        raise ValidationError(f"period must be one of {list(SALES_PERIODS)}")
+    try:
+        end = parse_date(params["end"]) if params.get("end") else localdate()
+        start = (
+            parse_date(params["start"])
+            if params.get("start")
+            else end - timedelta(days=364)
+        )
+    except (TypeError, ValueError):
+        start = end = None
+    if start is None or end is None or start > end:
+        raise ValidationError("start and end must be dates, start before end")
+    allowed = {choice for choice, _label in Order.STATUS}
+    statuses = (
+        params["status"].upper().split(",")
+        if params.get("status")
+        else sorted(allowed - {"CANCELLED"})
+    )
+    if not set(statuses) <= allowed:
+        raise ValidationError(f"status must be one of {sorted(allowed)}")
+
+    trunc = SALES_PERIODS[period]
+    rows = (
+        SellerDailySales.objects.filter(
+            company=company, date__range=(start, end), status__in=statuses
+        )
+        .values("currency", period_start=trunc("date") if trunc else F("date"))
+        .annotate(order_count=Sum("order_count"), revenue=Sum("total"))
+        .values("period_start", "currency", "order_count", "revenue")
+        .order_by("period_start", "currency")
+    )
+    return Response(
+        {
+            "company": company.id,
+            "period": period,
+            "start": start,
+            "end": end,
+            "results": [
+                {**row, "revenue": f"{row['revenue']:.2f}"}
+                for row in rows
+                if row["order_count"] or row["revenue"]
+            ],
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@authentication_classes([JWTAuthentication])
+def get_order_detail(request):
+    """
+    The order with its lines, invoices and transactions in five queries
+    whatever the number of lines. Archived orders are read from the archive
+    """
+    order_id = request.query_params.get("id")
+    try:
+        order_instance = visible_to(orders_with_details(), request.user).get(
+            id=order_id
+        )
+        data = OrderDetailedSerializer(order_instance).data
+    except Order.DoesNotExist:
+        # Finished orders move to the archive after ORDER_ARCHIVE_AFTER_DAYS
+        data = (
+            visible_to(ArchivedOrder.objects.all(), request.user)
+            .filter(id=order_id)
+            .values_list("document", flat=True)
+            .first()
+        )
+    except ValueError:
+        data = None
+    if data is None:
+        return Response(
+            {
+                "errors": "Order not found",
+                "status": 404,
+                "message": "No order with this id",
+            },
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    return Response(data, status=status.HTTP_200_OK)
+
+
+def invoice_not_found():
+    return Response(
+        {
+            "errors": "Invoice not found",
+            "status": 404,
+            "message": "No invoice with this id",
+        },
+        status=status.HTTP_404_NOT_FOUND,
+    )
+
+
+def archived_invoices_for(user):
+    invoices = ArchivedInvoice.objects.all()
+    if not user.is_staff:
+        companies = Company.objects.filter(contact_people__user=user).values("id")
+        invoices = invoices.filter(Q(buyer=user.id) | Q(issuer__in=companies))
+    return invoices
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@authentication_classes([JWTAuthentication])
+def download_invoice_pdf(request):
+    """
+    The invoice as a PDF. PDFs are rendered by the media workers, until the one
+    for the current content exists this queues it and answers 202
+    """
+    invoice_id = request.query_params.get("id")
+    invoices = Invoice.objects.all()
+    if not request.user.is_staff:
+        companies = Company.objects.filter(contact_people__user=request.user).values(
+            "id"
+        )
+        invoices = invoices.filter(Q(buyer=request.user.id) | Q(issuer__in=companies))
+    try:
+        invoices.values("id").get(id=invoice_id)
+    except Invoice.DoesNotExist:
+        # Invoices of archived orders keep the PDF they had when archived
+        archived = archived_invoices_for(request.user).filter(id=invoice_id).first()
+        if archived is not None:
+            return media_file_response(
+                archived.pdf.name,
+                private=True,
+                filename=f"invoice-{archived.number}.pdf",
+            )
+        return invoice_not_found()
+    except ValueError:
+        return invoice_not_found()
+
+    invoice, context = load_invoice_pdf_context(invoice_id)
+    if invoice.pdf and invoice.pdf_hash == invoice_pdf_hash(context):
+        return media_file_response(
+            invoice.pdf.name, private=True, filename=f"invoice-{context['number']}.pdf"
+        )
+    render_invoice_pdf.delay(invoice.id)
+    response = Response(
+        {
+            "status": 202,
+            "message": "The PDF is being rendered, please try again in a few seconds",
+        },
+        status=status.HTTP_202_ACCEPTED,
+    )
+    response["Retry-After"] = "5"
+    return response
+
+
+@csrf_exempt
+@require_POST
+def payment_webhook(request, provider):
+    """
+    Payment provider callbacks. A plain Django view that only checks the
+    signature and stores the event, process_webhook_events applies them in
+    batches, so a burst of callbacks costs one INSERT each
+    """
+    body = request.body
+    if not verify_signature(
+        provider,
+        body,
+        request.headers.get(TIMESTAMP_HEADER),
+        request.headers.get(SIGNATURE_HEADER),
+    ):
+        return JsonResponse(
+            {
+                "errors": "Invalid signature",
+                "status": "failed",
+                "message": "The webhook signature could not be verified",
+            },
+            status=401,
+        )
+    try:
+        text = body.decode()
+        event_id = str(json.loads(text)["id"])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse(
+            {
+                "errors": "Invalid event",
+                "status": "failed",
+                "message": "The event must be a JSON object with an id",
+            },
+            status=400,
+        )
+    # Redeliveries of an event already stored are ignored by the database
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(provider=provider, event_id=event_id[:255], body=text)],
+        ignore_conflicts=True,
+    )
+    schedule_processing()
+    return JsonResponse({"status": 202, "message": "Accepted"}, status=202)
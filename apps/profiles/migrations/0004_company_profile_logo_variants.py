@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("profiles", "0003_company_business_certificate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="company",
+            name="profile_logo_variants",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:06
+
+import apps.profiles.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("profiles", "0004_company_profile_logo_variants"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="profiledocument",
+            name="file",
+            field=models.FileField(
+                blank=True,
+                db_index=True,
+                null=True,
+                upload_to=apps.profiles.models.ProfileDocument.user_directory_path,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="rep",
+            name="id_card",
+            field=models.FileField(
+                blank=True,
+                db_index=True,
+                null=True,
+                upload_to=apps.profiles.models.Rep.user_directory_path,
+            ),
+        ),
+    ]
@@ -52,6 +52,8 @@ class Company(models.Model):
     profile_logo = models.FileField(
         upload_to=user_directory_path, blank=True, null=True
     )
+    # Thumbnail and WebP renditions of profile_logo, filled in by a celery task
+    profile_logo_variants = models.JSONField(default=dict, blank=True)
 
     business_certificate = models.FileField(
         upload_to=user_directory_path, blank=True, null=True
@@ -161,7 +163,10 @@ class Rep(models.Model):
         # file will be uploaded to MEDIA_ROOT/user_<id>/<filename>
         return "user_{0}/{1}".format(instance.user.id, filename)
 
-    id_card = models.FileField(upload_to=user_directory_path, blank=True, null=True)
+    # Private, indexed so the media view can look up who may download it
+    id_card = models.FileField(
+        upload_to=user_directory_path, blank=True, null=True, db_index=True
+    )
     profile_photo = models.FileField(
         upload_to=user_directory_path, blank=True, null=True
     )
@@ -177,7 +182,10 @@ class ProfileDocument(models.Model):
     name = models.CharField(
         verbose_name=_("File Name"), blank=True, null=True, max_length=500
     )
-    file = models.FileField(upload_to=user_directory_path, blank=True, null=True)
+    # Private, indexed so the media view can look up who may download it
+    file = models.FileField(
+        upload_to=user_directory_path, blank=True, null=True, db_index=True
+    )
     rep = models.ForeignKey(
         Rep, blank=True, null=True, on_delete=models.CASCADE, related_name="documents"
     )
@@ -7,6 +7,7 @@ from django_countries.serializers import CountryFieldMixin
 from phonenumber_field.serializerfields import PhoneNumberField
 from django_countries import countries
 from apps.inventory.serializers import ProductReturnSerializer
+from apps.files.images import variant_urls
 
 
 User = get_user_model()
@@ -110,6 +111,7 @@ class CompanyCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Company
         fields = "__all__"
+        read_only_fields = ["profile_logo_variants"]
 
     # def create(self, validated_data):
     #     first_name = validated_data.pop("first_name")
@@ -130,6 +132,7 @@ class CompanySearchSerializer(serializers.ModelSerializer):
     categories = serializers.SerializerMethodField()
     countries = CountryFullNameField()
     profile_logo = serializers.SerializerMethodField()
+    profile_logo_variants = serializers.SerializerMethodField()
     business_certificate = serializers.SerializerMethodField()
 
     class Meta:
@@ -146,6 +149,9 @@ class CompanySearchSerializer(serializers.ModelSerializer):
             else ""
         )
 
+    def get_profile_logo_variants(self, obj):
+        return variant_urls(obj.profile_logo_variants)
+
     def get_business_certificate(self, obj):
         return (
             "https://www.tradepayafrica.com" + obj.business_certificate.url
@@ -158,6 +164,7 @@ class CompanyDetailSerializer(serializers.ModelSerializer):
     categories = serializers.SerializerMethodField()
     countries = CountryFullNameField()
     profile_logo = serializers.SerializerMethodField()
+    profile_logo_variants = serializers.SerializerMethodField()
     business_certificate = serializers.SerializerMethodField()
     products = serializers.SerializerMethodField()
 
@@ -175,6 +182,9 @@ class CompanyDetailSerializer(serializers.ModelSerializer):
             else ""
         )
 
+    def get_profile_logo_variants(self, obj):
+        return variant_urls(obj.profile_logo_variants)
+
     def get_products(self, obj):
         return ProductReturnSerializer(obj.products.all(), many=True).data
 
@@ -0,0 +1,5 @@
+from utils.cache import invalidate_on_change
+from .models import Company
+
+# Cached company responses, see utils.cache
+invalidate_on_change(Company, "companies")
@@ -17,6 +17,8 @@ from .serializers import (
     CompanyDetailSerializer,
 )
 from apps.inventory.models import Category
+from apps.inventory.serializers import with_current_stock
+from utils.cache import CachedListMixin, cache_response
 from utils.fuzzysearch import FuzzySearchFilter
 from django_countries import countries
 from rest_framework_simplejwt.authentication import JWTAuthentication
@@ -24,8 +26,12 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 # Create your views here.
 
 
-class SearchForCompany(generics.ListAPIView):
+class SearchForCompany(CachedListMixin, generics.ListAPIView):
     serializer_class = CompanySearchSerializer
+    cache_name = "companies"
+    cache_tags = ("companies", "categories", "products", "currency_rates")
+    # A single company is shown with its products
+    cache_live_tags = ("stock",)
     filter_backends = [
         FuzzySearchFilter,
     ]
@@ -66,8 +72,17 @@ class SearchForCompany(generics.ListAPIView):
                 )
         return queryset
 
+    def refresh_cached(self, data):
+        return [
+            {**company, "products": with_current_stock(company["products"])}
+            if "products" in company
+            else company
+            for company in data
+        ]
+
 
 @api_view(["GET"])
+@cache_response("countries", tags=("companies",))
 def get_all_countries(request):
     country_codes = set(Company.objects.values_list("countries", flat=True))
     countries_dict = dict(countries)
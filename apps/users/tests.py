@@ -1,3 +1,36 @@
 from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
 
 # Create your tests here.
+User = get_user_model()
+
+
+class RegisterTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user(
+                email="admin@example.com", password="password", name="Admin"
+            )
+        )
+
+    def register(self, key):
+        return self.client.post(
+            "/api/v1/auth/register/",
+            {"email": "rep@example.com", "name": "Rep", "user_type": "REP"},
+            format="json",
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_registers_once_without_storing_the_code(self):
+        first = self.register("register-key")
+        self.assertEqual(first.status_code, 201, first.data)
+        retry = self.register("register-key")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(User.objects.filter(email="rep@example.com").count(), 1)
+
+        code = User.objects.get(email="rep@example.com").registration_code
+        self.assertIn(code, str(first.data))
+        self.assertNotIn(code, str(retry.data))
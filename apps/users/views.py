@@ -29,6 +29,7 @@ from django.contrib.auth import (
 from djoser.serializers import SetPasswordRetypeSerializer
 from apps.inventory.serializers import CategorySerializer
 from apps.inventory.models import Category
+from utils.idempotency import idempotent
 
 
 # Create your views here.
@@ -65,7 +66,15 @@ class UserLogin(APIView):
             )
 
 
+def registration_replay(response):
+    # The registration code is the new user's password, it is never stored
+    if response.status_code == status.HTTP_201_CREATED:
+        return ["Registration completed, the code is only shown once"]
+    return response.data
+
+
 @api_view(["POST"])
+@idempotent(replay=registration_replay)
 @transaction.atomic
 def register(request):
     """
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 import environ
 import os
+import sys
 
 env = environ.Env(DEBUG=(bool, True))
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -60,6 +61,7 @@ LOCAL_APPS = [
     "apps.profiles",
     "apps.inventory",
     "apps.orders",
+    "apps.files",
 ]
 
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
@@ -109,7 +111,9 @@ DATABASES = {
 
 PHONENUMBER_DEFAULT_REGION = "GH"
 
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+# Mail is handed to celery, the worker delivers it with CELERY_EMAIL_BACKEND
+EMAIL_BACKEND = "djcelery_email.backends.CeleryEmailBackend"
+CELERY_EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 EMAIL_HOST = env("EMAIL_HOST")
 EMAIL_USE_TLS = env("EMAIL_USE_TLS")
 EMAIL_PORT = env("EMAIL_PORT")
@@ -118,6 +122,34 @@ EMAIL_HOST_PASSWORD = env("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = "TradePayAfrica <info@tradepayafrica.com>"
 SITE_NAME = "TradePayAfrica"
 
+CACHES = {
+    # The redis service Celery uses, on a database of its own
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": env("REDIS_CACHE_URL", default="redis://redis:6379/1"),
+    },
+    # Responses stored for Idempotency-Key retries, shared by every worker
+    "idempotency": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "idempotency_keys",
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    },
+}
+# Tests must never read or flush the redis of the machine they run on, nor
+# send mail through its SMTP server
+if sys.argv[1:2] == ["test"]:
+    CACHES["default"] = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    CELERY_EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+IDEMPOTENCY_CACHE = "idempotency"
+IDEMPOTENCY_TTL = 60 * 60 * 24
+# Cached responses of the catalogue endpoints, see utils.cache
+RESPONSE_CACHE = "default"
+RESPONSE_CACHE_TIMEOUT = env.int("RESPONSE_CACHE_TIMEOUT", default=300)
+# An expired response is still served for this long while one worker rebuilds it,
+# workers without one wait up to RESPONSE_CACHE_WAIT for the rebuild
+RESPONSE_CACHE_STALE = env.int("RESPONSE_CACHE_STALE", default=60)
+RESPONSE_CACHE_WAIT = env.float("RESPONSE_CACHE_WAIT", default=5)
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -161,6 +193,20 @@ STATICFILES_DIR = []
 MEDIA_URL = "/mediafiles/"
 MEDIA_ROOT = BASE_DIR / "mediafiles"
 
+# Media is sent by nginx once Django has checked access, see apps.files.views
+MEDIA_ACCEL_REDIRECT = env.bool("MEDIA_ACCEL_REDIRECT", default=not DEBUG)
+MEDIA_ACCEL_REDIRECT_PREFIX = "/protected-media/"
+
+# Uploads are stored once per distinct content, see apps.files.storage
+STORAGES = {
+    "default": {
+        "BACKEND": "apps.files.storage.ContentAddressedStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -183,6 +229,7 @@ REST_FRAMEWORK = {
 
 
 from datetime import timedelta
+from celery.schedules import crontab
 
 DATE_FORMAT = "%Y-%m-%d"
 DATETIME_FORMAT = "%Y-%m-%d %H:%M"
@@ -231,3 +278,98 @@ CELERY_RESULT_BACKEND = env("CELERY_BACKEND")
 CELERY_TIMEZONE = "Africa/Accra"
 
 CELERY_WORKER_MAX_TASKS_PER_CHILD = 100
+
+# Image renditions and PDFs are CPU heavy, keep them off the default queue
+CELERY_TASK_ROUTES = {
+    "apps.files.tasks.generate_image_variants": {"queue": "media"},
+    "apps.orders.tasks.render_invoice_pdf": {"queue": "media"},
+    "apps.orders.tasks.render_invoices_for_period": {"queue": "media"},
+}
+
+CELERY_BEAT_SCHEDULE = {
+    "purge-stale-uploads": {
+        "task": "apps.files.tasks.purge_stale_uploads",
+        "schedule": timedelta(hours=1),
+    },
+    # Normally kicked right after commit, this catches anything missed
+    "relay-outbox": {
+        "task": "apps.orders.tasks.relay_outbox",
+        "schedule": timedelta(seconds=30),
+    },
+    "purge-outbox": {
+        "task": "apps.orders.tasks.purge_outbox",
+        "schedule": timedelta(days=1),
+    },
+    "process-webhook-events": {
+        "task": "apps.orders.tasks.process_webhook_events",
+        "schedule": timedelta(seconds=30),
+    },
+    "generate-monthly-statements": {
+        "task": "apps.orders.tasks.generate_monthly_statements",
+        "schedule": crontab(day_of_month=1, hour=2, minute=0),
+    },
+    "archive-old-records": {
+        "task": "apps.orders.tasks.archive_old_records",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    "release-expired-reservations": {
+        "task": "apps.orders.tasks.release_expired_reservations",
+        "schedule": timedelta(minutes=1),
+    },
+}
+
+# Resumable uploads, chunks are kept on local disk until the upload completes
+CHUNKED_UPLOAD_ROOT = env("CHUNKED_UPLOAD_ROOT", default=str(BASE_DIR / "uploads"))
+CHUNKED_UPLOAD_CHUNK_SIZE = env.int("CHUNKED_UPLOAD_CHUNK_SIZE", default=1024 * 1024)
+CHUNKED_UPLOAD_MAX_SIZE = env.int("CHUNKED_UPLOAD_MAX_SIZE", default=100 * 1024 * 1024)
+CHUNKED_UPLOAD_EXPIRY = timedelta(hours=24)
+
+# Widths of the thumbnail and WebP renditions generated for uploaded images
+IMAGE_VARIANT_WIDTHS = [320, 640, 1280]
+
+# Order events carried out per transaction by the outbox relay
+OUTBOX_BATCH_SIZE = env.int("OUTBOX_BATCH_SIZE", default=100)
+OUTBOX_RETENTION_DAYS = env.int("OUTBOX_RETENTION_DAYS", default=7)
+
+# Invoices rendered by each task of the render_invoices_for_period job
+INVOICE_PDF_CHUNK_SIZE = env.int("INVOICE_PDF_CHUNK_SIZE", default=25)
+
+# TrueType fonts invoice PDFs are drawn in, DejaVu covers Latin with the letters
+# of Ewe and Hausa, and Arabic (fonts-dejavu-core in the Docker image)
+PDF_FONT_DIR = env("PDF_FONT_DIR", default="/usr/share/fonts/truetype/dejavu")
+
+# Matched statement lines written per transaction by the reconciliation
+RECONCILIATION_BATCH_SIZE = env.int("RECONCILIATION_BATCH_SIZE", default=5000)
+
+# Payment provider callbacks, signed with HMAC-SHA256 using the provider secret.
+# A provider without a secret is not accepted
+PAYMENT_WEBHOOK_SECRETS = {
+    "papss": env("PAPSS_WEBHOOK_SECRET", default=""),
+    "peoplespay": env("PEOPLESPAY_WEBHOOK_SECRET", default=""),
+}
+PAYMENT_WEBHOOK_TOLERANCE = env.int("PAYMENT_WEBHOOK_TOLERANCE", default=300)
+PAYMENT_WEBHOOK_BATCH_DELAY = env.int("PAYMENT_WEBHOOK_BATCH_DELAY", default=2)
+PAYMENT_WEBHOOK_BATCH_SIZE = env.int("PAYMENT_WEBHOOK_BATCH_SIZE", default=500)
+
+# Monthly seller statements: the currency they are totalled in and the sellers
+# handled by each task
+STATEMENT_CURRENCY = env("STATEMENT_CURRENCY", default="USD")
+STATEMENT_CHUNK_SIZE = env.int("STATEMENT_CHUNK_SIZE", default=100)
+
+# Finished orders (with their invoices and transactions) and product views older
+# than this move to the archive tables, in batches with a pause in between
+ORDER_ARCHIVE_AFTER_DAYS = env.int("ORDER_ARCHIVE_AFTER_DAYS", default=730)
+PRODUCT_VIEW_ARCHIVE_AFTER_DAYS = env.int("PRODUCT_VIEW_ARCHIVE_AFTER_DAYS", default=90)
+ARCHIVE_BATCH_SIZE = env.int("ARCHIVE_BATCH_SIZE", default=500)
+ARCHIVE_BATCH_PAUSE = env.float("ARCHIVE_BATCH_PAUSE", default=0.5)
+
+# Orders pending this long are cancelled and their stock given back, the sweeper
+# cancels up to that many orders per transaction
+STOCK_RESERVATION_HOURS = env.int("STOCK_RESERVATION_HOURS", default=72)
+STOCK_SWEEP_BATCH_SIZE = env.int("STOCK_SWEEP_BATCH_SIZE", default=500)
+
+# Catalogue changes returned per page of the delta sync feed. Changes are
+# written after commit, those younger than CATALOG_CHANGES_DELAY seconds are
+# held back so two writes racing for the next ids both land before the cursor
+CATALOG_CHANGES_PAGE_SIZE = env.int("CATALOG_CHANGES_PAGE_SIZE", default=500)
+CATALOG_CHANGES_DELAY = env.int("CATALOG_CHANGES_DELAY", default=5)
@@ -0,0 +1,21 @@
+"""
+Moving old rows out of the live tables. Each archive function moves one batch
+in its own transaction and returns how many rows it moved, run_in_batches
+repeats it with a pause in between so the live tables and replicas keep up
+"""
+
+import time
+
+
+def run_in_batches(archive, cutoff, batch_size, pause=0, max_batches=None):
+    """Calls archive(cutoff, batch_size) until a batch comes back short"""
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive(cutoff, batch_size)
+        moved += count
+        batches += 1
+        if count < batch_size:
+            break
+        time.sleep(pause)
+    return moved
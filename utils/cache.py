@@ -0,0 +1,314 @@
+"""
+Response caching for read endpoints. An entry is keyed by the endpoint, the
+audience (staff see inactive rows), the normalised query params and the current
+version of every tag the endpoint depends on. Saving a model bumps the versions
+of its tags, entries built from older versions are never read again and expire
+on their own.
+
+Responses carry an ETag derived from that key and the media type they are
+rendered in, so a conditional GET for an unchanged list gets a 304 without the
+view running or the cache entry being read. No Last-Modified is sent: a second
+is too coarse to tell a list from one changed in the same second.
+
+Values that change far more often than the rest of a response, stock levels,
+have live tags instead: a newer version of one doesn't throw the entry away,
+the stale values are read again and filled in when the entry is served. The
+ETag covers live tag versions too.
+
+A missing or expired entry is rebuilt by one caller at a time (single flight):
+threads of the same process wait for its result, other processes get the
+expired entry meanwhile, or poll for the new one when there is none
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from rest_framework.response import Response
+from concurrent.futures import Future
+import functools
+import hashlib
+import threading
+import time
+import urllib.parse
+
+# Names of the cached endpoints, for cache_metrics
+ENDPOINTS = set()
+OUTCOMES = ("hit", "stale", "coalesced", "miss")
+# cache_metrics fields and the outcome they count
+COUNTERS = {
+    "hits": "hit",
+    "stale": "stale",
+    "coalesced": "coalesced",
+    "misses": "miss",
+    "not_modified": "not_modified",
+}
+
+# Keys being rebuilt in this process, and the future of their value
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE]
+
+
+def tag_key(tag):
+    return f"tag-version:{tag}"
+
+
+def new_version():
+    # Versions start from the clock, so a version evicted from the cache never
+    # comes back with a number older entries were stored under
+    return time.time_ns() // 1000
+
+
+def tag_versions(tags):
+    cache = get_cache()
+    versions = cache.get_many([tag_key(tag) for tag in tags])
+    for tag in tags:
+        if tag_key(tag) not in versions:
+            cache.add(tag_key(tag), new_version(), None)
+            versions[tag_key(tag)] = cache.get(tag_key(tag))
+    return [str(versions[tag_key(tag)]) for tag in tags]
+
+
+def bump_tags(*tags):
+    cache = get_cache()
+    for tag in tags:
+        try:
+            cache.incr(tag_key(tag))
+        except ValueError:
+            cache.add(tag_key(tag), new_version(), None)
+
+
+def bump_on_commit(*tags):
+    """For changes made without signals, update() and the like"""
+    transaction.on_commit(lambda: bump_tags(*tags))
+
+
+def invalidate_on_change(model, *tags):
+    """
+    Bumps tags when a model instance is saved or deleted or one of its many to
+    many relations changes, once the transaction commits
+    """
+
+    def receiver(sender, **kwargs):
+        bump_on_commit(*tags)
+
+    uid = f"invalidate-{model._meta.label}"
+    post_save.connect(receiver, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(receiver, sender=model, weak=False, dispatch_uid=uid)
+    for field in model._meta.many_to_many:
+        m2m_changed.connect(
+            receiver,
+            sender=field.remote_field.through,
+            weak=False,
+            dispatch_uid=f"{uid}-{field.name}",
+        )
+
+
+def count(name, outcome):
+    cache = get_cache()
+    key = f"cache-metrics:{name}:{outcome}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def cache_metrics():
+    """
+    {endpoint: {"hits", "stale", "coalesced", "misses", "not_modified",
+    "hit_ratio"}} since the counters were reset. Only misses ran the view
+    """
+    names = sorted(ENDPOINTS)
+    counters = get_cache().get_many(
+        [
+            f"cache-metrics:{name}:{outcome}"
+            for name in names
+            for outcome in COUNTERS.values()
+        ]
+    )
+    metrics = {}
+    for name in names:
+        metrics[name] = {
+            field: counters.get(f"cache-metrics:{name}:{outcome}", 0)
+            for field, outcome in COUNTERS.items()
+        }
+        requests = sum(metrics[name].values())
+        metrics[name]["hit_ratio"] = (
+            round(1 - metrics[name]["misses"] / requests, 3) if requests else None
+        )
+    return metrics
+
+
+def single_flight(key, compute, timeout):
+    """
+    (value, outcome) of key, outcome being one of OUTCOMES. compute() returns
+    the value and whether it may be stored, it is called when the entry is
+    missing or older than timeout and nobody else is already computing it
+    """
+    cache = get_cache()
+    entry = cache.get(key)
+    if entry is not None and entry["fresh_until"] > time.time():
+        return entry["value"], "hit"
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Future()
+    if not leader:
+        if entry is not None:
+            return entry["value"], "stale"
+        value, stored = flight.result()
+        if stored:
+            return value, "coalesced"
+        # Not storable (an error response), so not shared either
+        value, _stored = compute()
+        return value, "miss"
+    try:
+        value, stored, outcome = _rebuild(cache, key, entry, compute, timeout)
+        flight.set_result((value, stored))
+    except BaseException as error:
+        flight.set_exception(error)
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+    return value, outcome
+
+
+def _rebuild(cache, key, entry, compute, timeout):
+    lock = f"rebuilding:{key}"
+    deadline = time.monotonic() + settings.RESPONSE_CACHE_WAIT
+    locked = cache.add(lock, True, int(settings.RESPONSE_CACHE_WAIT) + 1)
+    while not locked:
+        # Another process is rebuilding the entry
+        if entry is not None:
+            return entry["value"], True, "stale"
+        if time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry["value"], True, "coalesced"
+    try:
+        value, stored = compute()
+        if stored:
+            cache.set(
+                key,
+                {"value": value, "fresh_until": time.time() + timeout},
+                timeout + settings.RESPONSE_CACHE_STALE,
+            )
+        return value, stored, "miss"
+    finally:
+        if locked:
+            cache.delete(lock)
+
+
+def response_key(name, request, tags):
+    audience = "staff" if request.user.is_staff or request.user.is_superuser else "all"
+    params = urllib.parse.urlencode(
+        sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            for value in values
+        )
+    )
+    digest = hashlib.sha256(params.encode()).hexdigest()
+    # v2 entries hold (data, live tag versions)
+    versions = ".".join(tag_versions(tags))
+    return f"response:v2:{name}:{audience}:{versions}:{digest}"
+
+
+def _build(compute, live):
+    response = compute()
+    if response.status_code == 200:
+        # Stored with the live tag versions the data is current for
+        return (response.data, live), True
+    return response, False
+
+
+def cached(name, tags, request, compute, timeout=None, live_tags=(), refresh=None):
+    """
+    The response of a GET from the cache, or compute()'s when it is not there.
+    Only 200 responses are stored. A request whose If-None-Match still holds
+    gets a 304 instead. refresh(data) returns the data with the values of
+    live_tags read again, it is called when one of them changed since the entry
+    was stored
+    """
+    ENDPOINTS.add(name)
+    key = response_key(name, request, tags)
+    live = ".".join(tag_versions(live_tags)) if live_tags else ""
+    # JSON and the browsable API render the same data differently
+    digest = hashlib.sha256(f"{key}:{live}:{request.accepted_media_type}".encode())
+    etag = f'"{digest.hexdigest()[:32]}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        count(name, "not_modified")
+    else:
+        value, outcome = single_flight(
+            key,
+            functools.partial(_build, compute, live),
+            timeout or settings.RESPONSE_CACHE_TIMEOUT,
+        )
+        count(name, outcome)
+        if isinstance(value, Response):
+            response = value
+        else:
+            data, stored_live = value
+            if stored_live != live:
+                data = refresh(data)
+            response = Response(data)
+    if response.status_code in (200, 304):
+        response["ETag"] = etag
+        patch_vary_headers(response, ("Accept",))
+    return response
+
+
+def cache_response(name, tags, timeout=None):
+    """For function views, goes under the DRF decorators, without live tags"""
+
+    def decorator(view):
+        ENDPOINTS.add(name)
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET":
+                return view(request, *args, **kwargs)
+            return cached(
+                name, tags, request, lambda: view(request, *args, **kwargs), timeout
+            )
+
+        return wrapper
+
+    return decorator
+
+
+class CachedListMixin:
+    """
+    For list views, set cache_name and cache_tags. Views with cache_live_tags
+    override refresh_cached
+    """
+
+    cache_name = None
+    cache_tags = ()
+    cache_live_tags = ()
+    cache_timeout = None
+
+    def refresh_cached(self, data):
+        return data
+
+    def list(self, request, *args, **kwargs):
+        return cached(
+            self.cache_name,
+            self.cache_tags,
+            request,
+            lambda: super(CachedListMixin, self).list(request, *args, **kwargs),
+            self.cache_timeout,
+            self.cache_live_tags,
+            self.refresh_cached,
+        )
@@ -0,0 +1,112 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.http.request import RawPostDataException
+from rest_framework import status
+from rest_framework.response import Response
+import functools
+import hashlib
+import json
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# How long a request may run before a retry with the same key is allowed through
+IN_PROGRESS_TIMEOUT = 60
+
+
+def request_fingerprint(request):
+    try:
+        body = request.body
+    except RawPostDataException:
+        # Multipart bodies are consumed while parsing, hash the parsed data instead
+        body = json.dumps(request.data, sort_keys=True, default=str).encode()
+    fingerprint = hashlib.sha256(f"{request.method}:{request.path}:".encode())
+    fingerprint.update(body)
+    return fingerprint.hexdigest()
+
+
+def idempotency_error(message, response_status):
+    return Response(
+        {"errors": message, "status": response_status, "message": message},
+        status=response_status,
+    )
+
+
+def idempotent(view=None, *, replay=None):
+    """
+    Lets clients safely retry a POST by sending an Idempotency-Key header. The
+    first response is stored for IDEMPOTENCY_TTL seconds and a retry with the
+    same key and body gets it back without running the view again. Keys belong
+    to the signed in user, anonymous requests can't use them. Goes below the
+    DRF decorators and above transaction.atomic.
+
+    For a view whose response holds a secret, replay(response) gives the data
+    stored and sent back to retries instead. Those keys are scoped by the body
+    as well, so anonymous requests can use them: a retry only ever gets back a
+    response to the body it sent itself
+    """
+    if view is None:
+        return functools.partial(idempotent, replay=replay)
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            return idempotency_error(
+                "Idempotency-Key must be at most 255 characters",
+                status.HTTP_400_BAD_REQUEST,
+            )
+
+        if replay is None and not request.user.is_authenticated:
+            return idempotency_error(
+                "Idempotency-Key can only be used by authenticated users",
+                status.HTTP_400_BAD_REQUEST,
+            )
+
+        cache = caches[settings.IDEMPOTENCY_CACHE]
+        fingerprint = request_fingerprint(request)
+        user = request.user.id if request.user.is_authenticated else "anonymous"
+        scope = f"{user}:{request.path}:{key}"
+        if replay is not None:
+            scope += f":{fingerprint}"
+        cache_key = "idempotency:" + hashlib.sha256(scope.encode()).hexdigest()
+
+        stored = cache.get(cache_key)
+        if stored is None and cache.add(
+            cache_key, {"fingerprint": fingerprint}, IN_PROGRESS_TIMEOUT
+        ):
+            try:
+                response = view(request, *args, **kwargs)
+            except Exception:
+                cache.delete(cache_key)
+                raise
+            if response.status_code >= 500:
+                cache.delete(cache_key)
+            else:
+                cache.set(
+                    cache_key,
+                    {
+                        "fingerprint": fingerprint,
+                        "status": response.status_code,
+                        "data": response.data if replay is None else replay(response),
+                    },
+                    settings.IDEMPOTENCY_TTL,
+                )
+            return response
+
+        stored = stored or cache.get(cache_key) or {}
+        if stored.get("fingerprint") != fingerprint:
+            return idempotency_error(
+                "Idempotency-Key was already used for a different request",
+                status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if "status" not in stored:
+            return idempotency_error(
+                "A request with this Idempotency-Key is still being processed",
+                status.HTTP_409_CONFLICT,
+            )
+        response = Response(stored["data"], status=stored["status"])
+        response["Idempotent-Replayed"] = "true"
+        return response
+
+    return wrapper
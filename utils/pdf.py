@@ -0,0 +1,85 @@
+"""
+Text documents such as invoices on A4 pages, drawn by reportlab in TrueType
+fonts so names print in whatever script the fonts cover. Arabic and other
+right to left text is shaped and put in display order. The output is
+deterministic, the same calls always produce the same bytes
+"""
+from django.conf import settings
+from bidi.algorithm import get_display
+from functools import lru_cache
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+import arabic_reshaper
+import io
+import os
+import unicodedata
+
+A4_WIDTH, A4_HEIGHT = A4
+# Font name: file in settings.PDF_FONT_DIR
+FONTS = {"Sans": "DejaVuSans.ttf", "Sans-Bold": "DejaVuSans-Bold.ttf"}
+ELLIPSIS = "…"
+
+
+@lru_cache(maxsize=None)
+def register_fonts():
+    for name, filename in FONTS.items():
+        pdfmetrics.registerFont(
+            TTFont(name, os.path.join(settings.PDF_FONT_DIR, filename))
+        )
+
+
+def display_text(value):
+    """value as it is drawn, right to left runs are joined and reversed"""
+    if any(unicodedata.bidirectional(char) in ("R", "AL") for char in value):
+        return get_display(arabic_reshaper.reshape(value))
+    return value
+
+
+class PDFDocument:
+    def __init__(self):
+        register_fonts()
+        self.buffer = io.BytesIO()
+        # invariant leaves out the creation date and random document id
+        self.canvas = canvas.Canvas(
+            self.buffer, pagesize=A4, invariant=1, initialFontName="Sans"
+        )
+
+    def add_page(self):
+        self.canvas.showPage()
+
+    def font(self, size, bold):
+        name = "Sans-Bold" if bold else "Sans"
+        self.canvas.setFont(name, size)
+        return name
+
+    def fit(self, value, font, size, max_width):
+        """value cut short with an ellipsis to be at most max_width wide"""
+        if pdfmetrics.stringWidth(value, font, size) <= max_width:
+            return value
+        while value and (
+            pdfmetrics.stringWidth(value + ELLIPSIS, font, size) > max_width
+        ):
+            value = value[:-1]
+        return value + ELLIPSIS
+
+    def text(self, x, y, value, size=10, bold=False, max_width=None):
+        font = self.font(size, bold)
+        value = str(value)
+        if max_width:
+            value = self.fit(value, font, size, max_width)
+        self.canvas.drawString(x, y, display_text(value))
+
+    def text_right(self, x, y, value, size=10, bold=False):
+        """Text ending at x, for columns of amounts"""
+        self.font(size, bold)
+        self.canvas.drawRightString(x, y, display_text(str(value)))
+
+    def line(self, x1, y1, x2, y2, width=0.5):
+        self.canvas.setLineWidth(width)
+        self.canvas.line(x1, y1, x2, y2)
+
+    def render(self):
+        self.canvas.save()
+        return self.buffer.getvalue()
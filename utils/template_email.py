@@ -2,31 +2,128 @@ from django.conf import settings
 from django.core import mail
 from django.core.exceptions import ImproperlyConfigured
 from django.template import loader
-from django.template.exceptions import TemplateDoesNotExist
+from smtplib import SMTPException
+import logging
+import threading
+import time
 
+logger = logging.getLogger(__name__)
 
-def send_template_email(recipients, title_template, body_template, context, language):
-    """Sends e-mail using templating system"""
+# SMTP connection reused by the e-mails a worker thread sends, connections are
+# not thread safe so each thread keeps its own
+_pool = threading.local()
 
-    # context.update(
 
-    # )
+def get_pooled_connection():
+    """
+    Returns an open connection of the backend that actually delivers mail, kept
+    for the life of the thread instead of reconnecting for every message
+    """
+    connection = getattr(_pool, "connection", None)
+    if connection is None:
+        connection = _pool.connection = mail.get_connection(
+            getattr(settings, "CELERY_EMAIL_BACKEND", settings.EMAIL_BACKEND)
+        )
+    connection.open()
+    return connection
 
-    mail_title_template = loader.get_template(title_template)
-    mail_body_template = loader.get_template(body_template)
-    title = mail_title_template.render(context).strip()
-    body = mail_body_template.render(context)
-    try:
-        mail_body_template_html = loader.get_template(body_template)
-        html_body = mail_body_template_html.render(context)
-    except TemplateDoesNotExist:
-        html_body = None
 
+def close_pooled_connection():
+    """Drops the connection of this thread, e.g. after the server closed it"""
+    connection = getattr(_pool, "connection", None)
+    if connection is not None:
+        _pool.connection = None
+        try:
+            connection.close()
+        except (SMTPException, OSError):
+            logger.warning("Could not close the pooled SMTP connection", exc_info=True)
+
+
+def get_from_email():
     try:
-        email_from = getattr(settings, "DEFAULT_FROM_EMAIL")
+        return getattr(settings, "DEFAULT_FROM_EMAIL")
     except AttributeError:
         raise ImproperlyConfigured(
             "DEFAULT_FROM_EMAIL setting needed for sending e-mails"
         )
 
-    mail.send_mail(title, body, email_from, recipients, html_message=html_body)
+
+def build_template_email(recipients, templates, context, email_from, connection=None):
+    """
+    Renders one message from already compiled (title, body) templates, the body
+    template is rendered once and used for both the text and html parts
+    """
+    title_template, body_template = templates
+    title = title_template.render(context).strip()
+    body = body_template.render(context)
+    message = mail.EmailMultiAlternatives(
+        title, body, email_from, recipients, connection=connection
+    )
+    message.attach_alternative(body, "text/html")
+    return message
+
+
+def send_template_email(
+    recipients, title_template, body_template, context, language, connection=None
+):
+    """Sends e-mail using templating system"""
+
+    # context.update(
+
+    # )
+
+    templates = (
+        loader.get_template(title_template),
+        loader.get_template(body_template),
+    )
+    build_template_email(
+        recipients, templates, context, get_from_email(), connection=connection
+    ).send()
+
+
+def send_template_email_batch(
+    messages, title_template, body_template, chunk_size=100, connection=None
+):
+    """
+    Sends one templated e-mail per (recipients, context) pair in messages.
+    Templates are compiled once and messages go out over a single connection in
+    chunks of chunk_size, meant to run in a celery worker. Returns counts, per
+    message throughput and the recipients of the messages that were not sent
+    """
+    templates = (
+        loader.get_template(title_template),
+        loader.get_template(body_template),
+    )
+    email_from = get_from_email()
+    connection = connection or get_pooled_connection()
+    report = {"sent": 0, "failed": 0, "failed_recipients": []}
+    started = time.monotonic()
+
+    chunk = []
+    messages = iter(messages)
+    while True:
+        for recipients, context in messages:
+            chunk.append(
+                build_template_email(recipients, templates, context, email_from)
+            )
+            if len(chunk) >= chunk_size:
+                break
+        if not chunk:
+            break
+        try:
+            report["sent"] += connection.send_messages(chunk) or 0
+        except (SMTPException, OSError):
+            logger.exception("Failed to send a chunk of %s e-mails", len(chunk))
+            report["failed"] += len(chunk)
+            for message in chunk:
+                report["failed_recipients"].extend(message.to)
+            # Reconnect for the next chunk
+            connection.close()
+        chunk = []
+
+    report["seconds"] = round(time.monotonic() - started, 3)
+    report["per_second"] = (
+        round(report["sent"] / report["seconds"], 1) if report["seconds"] else None
+    )
+    logger.info("Batch e-mail %s", report)
+    return report